@@ -1,21 +1,117 @@
 import streamlit as st
 import pandas as pd
+import codecs
 import os
+from datetime import datetime
 from pathlib import Path
 
+from retrieval import IndexUpdater, format_context
+from site_health import DEGRADED, DOWN, UNKNOWN, UP, HealthMonitor
+from jobs import ACTIVE_STATES, FAILED, default_runner
+from asset_graph import AssetGraph, source_stamps
+
 # 常數定義
 PREVIEW_LENGTH = 500  # 文件預覽長度
+ASSET_PREVIEW_LENGTH = 400  # 資產文件預覽長度
+
+
+# 快取輔助函式：Streamlit 每次互動都會重跑整個腳本，
+# 目錄清單與文件預覽以「路徑 + mtime」作為快取鍵，內容未變更時不重新讀取磁碟
+@st.cache_data(max_entries=32, show_spinner=False)
+def _list_markdown(directory: str, mtime_ns: int) -> list:
+    entries = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.endswith(".md") and entry.is_file():
+                entries.append((entry.stat().st_mtime_ns, entry.name))
+    entries.sort(reverse=True)
+    return [name for _, name in entries]
+
+
+def list_markdown(directory: Path) -> list:
+    """列出目錄下的 Markdown 檔名（最新修改者在前）；僅在目錄內容增減時重新掃描"""
+    try:
+        mtime_ns = directory.stat().st_mtime_ns
+    except FileNotFoundError:
+        return []
+    return _list_markdown(str(directory), mtime_ns)
+
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def _read_preview(path: str, mtime_ns: int, size: int, length: int) -> str:
+    # UTF-8 每字最多 4 位元組：讀取 length + 1 個字所需的位元組即可判斷是否需要截斷
+    with open(path, "rb") as f:
+        data = f.read(4 * (length + 1))
+    # 增量解碼器保留結尾不完整的多位元組字元，不會誤報解碼錯誤
+    text = codecs.getincrementaldecoder("utf-8")().decode(data, final=len(data) >= size)
+    if len(text) > length:
+        return text[:length] + "..."
+    return text
+
+
+def read_preview(path: Path, length: int = PREVIEW_LENGTH) -> str:
+    """讀取文件開頭的 length 個字（超過時加上 ...）；以路徑、mtime 與大小快取"""
+    stat = path.stat()
+    return _read_preview(str(path), stat.st_mtime_ns, stat.st_size, length)
+
+
+# Runbook 檢索索引（retrieval.py）：背景執行緒每 5 分鐘檢查一次文件變更並增量更新，頁面只載入已建立的索引
+@st.cache_resource(show_spinner=False)
+def runbook_updater() -> IndexUpdater:
+    return IndexUpdater(interval=300).start()
+
+
+# 資產依賴圖（asset_graph.py）：以來源紀錄的 (路徑, mtime, 大小) 作為快取鍵，紀錄未變更時不重新解析
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _asset_graph(stamps: tuple) -> AssetGraph:
+    return AssetGraph.from_sources([Path(path) for path, _, _ in stamps])
+
+
+def asset_graph() -> AssetGraph:
+    return _asset_graph(source_stamps())
+
 
 # 1. 基礎配置
 st.set_page_config(page_title="Kausan IT-Ops Dashboard", layout="wide")
 ROOT_DIR = Path(__file__).parent.parent  # 橫向定位到 Kausan-IT-ISO 根目錄
 
-# 2. 側邊欄：據點狀態 (模擬連動 Zabbix)
+# 2. 側邊欄：據點狀態（site_health.py 於背景並行輪詢，頁面只讀取快取）
+@st.cache_resource(show_spinner=False)
+def site_monitor():
+    config_path = Path(__file__).parent / "sites.yaml"
+    if not config_path.exists():
+        return None
+    return HealthMonitor.from_config(
+        str(config_path), ttl=float(os.getenv("DATA_REFRESH_INTERVAL", "300"))
+    ).start()
+
+
 with st.sidebar:
     st.title("🌐 據點實體狀態")
     locations = ["總部", "ILC 倉庫", "Kausan 辦公室", "據點 D", "據點 E"]
+    try:
+        monitor = site_monitor()
+    except ValueError as e:
+        st.error(f"據點設定錯誤：{e}")
+        monitor = None
+    site_states = monitor.snapshot() if monitor is not None else {}
     for loc in locations:
-        st.success(f"● {loc} - 正常") # 未來此處對接 Zabbix API
+        state = site_states.get(loc)
+        if state is None:
+            st.info(f"○ {loc} - 未設定監控")
+            continue
+        failed = [check for check in state["checks"] if not check["ok"]]
+        detail = f"（{failed[0]['probe']}：{failed[0]['detail']}）" if failed else ""
+        if state["status"] == UP:
+            st.success(f"● {loc} - 正常")
+        elif state["status"] == DEGRADED:
+            st.warning(f"◐ {loc} - 部分異常{detail}")
+        elif state["status"] == DOWN:
+            st.error(f"● {loc} - 離線{detail}")
+        else:
+            st.info(f"○ {loc} - 檢查中...")
+        if state["stale"] and state["status"] != UNKNOWN:
+            st.caption("⚠️ 狀態已過期，背景更新可能停止")
     
     st.divider()
     st.info("系統角色：IT 主管 (Admin)")
@@ -34,19 +130,13 @@ with col_main:
         st.subheader("最近備份狀態 (HPE G9/G10)")
         # 範例：讀取檔案列表並顯示
         if log_path.exists():
-            files = [f.name for f in log_path.glob("*.md")]
+            files = list_markdown(log_path)
             if files:
                 selected_file = st.selectbox("選擇日誌查看", files)
-                # 讀取選中的文件內容
+                # 只讀取預覽所需的開頭部分
                 file_content_path = log_path / selected_file
                 if file_content_path.exists():
-                    with open(file_content_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    # 顯示文件預覽
-                    if len(content) > PREVIEW_LENGTH:
-                        preview = content[:PREVIEW_LENGTH] + "..."
-                    else:
-                        preview = content
+                    preview = read_preview(file_content_path, PREVIEW_LENGTH)
                     st.code(f"讀取自：{selected_file}\n\n{preview}", language="markdown")
             else:
                 st.warning("未找到備份日誌文件")
@@ -55,33 +145,30 @@ with col_main:
 
     with tab2:
         st.subheader("關鍵資產依賴圖")
-        st.graphviz_chart('''
-            digraph {
-                SQL_Server -> MWS_System
-                SQL_Server -> Video_System
-                SQL_Server -> ERP
-                Core_Switch -> SQL_Server
-                Fortigate_60F -> Core_Switch
-            }
-        ''')
+        graph = asset_graph()
+        if graph.nodes:
+            # 預設選影響範圍最大的資產；只繪製與所選資產相關的子圖
+            default = max(graph.nodes, key=lambda node: len(graph.impacted(node)))
+            focus = st.selectbox("模擬故障資產", graph.nodes, index=graph.nodes.index(default), key="asset_focus")
+            impacted = graph.impacted(focus)
+            st.graphviz_chart(graph.subgraph_dot(focus))
+            if impacted:
+                st.warning(f"{focus} 故障時受影響（{len(impacted)} 項）：" + "、".join(impacted))
+            else:
+                st.success(f"{focus} 故障不影響其他已登錄資產")
+        else:
+            st.info("資產管理記錄與 BIA 報告中尚未登錄資產依賴關係")
         
         # 顯示資產清單
         st.subheader("IT 資產清單")
         asset_path = ROOT_DIR / "ISO27001_文檔體系" / "04_資產管理記錄"
         if asset_path.exists():
-            files = [f.name for f in asset_path.glob("*.md")]
+            files = list_markdown(asset_path)
             if files:
                 selected_asset = st.selectbox("選擇資產文件查看", files, key="asset_select")
                 asset_file_path = asset_path / selected_asset
                 if asset_file_path.exists():
-                    with open(asset_file_path, 'r', encoding='utf-8') as f:
-                        asset_content = f.read()
-                    # 顯示文件預覽
-                    if len(asset_content) > 400:
-                        asset_preview = asset_content[:400] + "..."
-                    else:
-                        asset_preview = asset_content
-                    st.code(asset_preview, language="markdown")
+                    st.code(read_preview(asset_file_path, ASSET_PREVIEW_LENGTH), language="markdown")
 
 # 4. 右側 AI 區：診斷助手
 with col_ai:
@@ -99,31 +186,73 @@ with col_ai:
     if prompt := st.chat_input("請描述 IT 異常 (如：MWS 連線錯誤)"):
         st.session_state.messages.append({"role": "user", "content": prompt})
         
-        # 這裡就是「橫向視野」的展現：自動附加上下文
-        context = "當前環境：ILC 據點, SQL Server 運行中, 最近備份正常。" 
+        # 這裡就是「橫向視野」的展現：自動附加本地 Runbook 中最相關的段落
+        index = runbook_updater().current()
+        hits = index.search(prompt, k=3) if index is not None else []
+        context = format_context(hits)
         
-        # 呼叫 Gemini / Dify API (示意)
-        response = f"根據您的描述與 {context} 的背景，建議檢查 VLAN 20 的防火牆規則。"
+        # 呼叫 Gemini / Dify API (示意)：送出 prompt 與 context
+        if index is None:
+            response = "Runbook 索引建立中，請稍後再試（或先執行 `python retrieval.py build`）。"
+        elif hits:
+            sources = "\n".join(f"- `{hit['path']}` § {hit['heading']}" for hit in hits)
+            response = f"根據您的描述，以下 Runbook 段落可能相關：\n\n{sources}"
+        else:
+            response = "找不到相關的 Runbook 段落，請補充設備名稱或錯誤訊息。"
         
         with st.chat_message("assistant"):
             st.markdown(response)
+            if context:
+                with st.expander("送給 AI 的 Runbook 上下文"):
+                    st.text(context)
         st.session_state.messages.append({"role": "assistant", "content": response})
 
-# 5. 特殊行動按鈕 (Action Buttons)
+# 5. 特殊行動按鈕 (Action Buttons)：工作於背景執行（jobs.py），重複點擊不會重複執行
+@st.cache_resource(show_spinner=False)
+def job_runner():
+    return default_runner()
+
+
+def show_job(kind: str):
+    """顯示某類型最近一次工作的狀態或結果"""
+    job = job_runner().latest(kind)
+    if job is None:
+        return
+    if job["status"] in ACTIVE_STATES:
+        st.progress(job["progress"], text=job["message"] or "執行中")
+    elif job["status"] == FAILED:
+        st.error(f"執行失敗：{job['error']}")
+    else:
+        finished = datetime.fromtimestamp(job["finished_at"]).strftime("%m/%d %H:%M")
+        st.caption(f"✅ 完成於 {finished}")
+        result = job["result"]
+        if kind == "backup_report":
+            st.markdown(result["report"])
+        elif kind == "asset_scan":
+            st.caption(f"最近 {result['window_days']} 天共 {len(result['changes'])} 筆變更（本次新增 {result['new']} 筆）")
+            for change in result["changes"][:20]:
+                st.text(f"{change['status']} {change['path']}（{change['author']}：{change['subject']}）")
+        else:
+            st.code(result["output"] or "（無輸出）")
+
+
 st.divider()
 col_btn1, col_btn2, col_btn3 = st.columns(3)
 
 with col_btn1:
     if st.button("⚡ 執行 Exchange Log 抓取 (PowerShell)"):
-        st.warning("正在透過系統介面抓取 joe.chung@dradvice.com 的郵件日誌...")
-        # 這裡串接 subprocess 執行你的腳本
+        job_runner().submit("exchange_log", {"mailbox": os.getenv("EXCHANGE_MAILBOX", "joe.chung@dradvice.com")})
+    show_job("exchange_log")
 
 with col_btn2:
     if st.button("📊 生成月度備份報告"):
-        st.info("正在生成月度備份統計報告...")
-        # 未來整合數據分析
+        job_runner().submit("backup_report", {"month": datetime.now().strftime("%Y-%m")})
+    show_job("backup_report")
 
 with col_btn3:
     if st.button("🔍 掃描資產變更"):
-        st.info("正在掃描最近7天的資產變更紀錄...")
-        # 未來整合 git log 或文件變更檢測
+        job_runner().submit("asset_scan")
+    show_job("asset_scan")
+
+if any(job["status"] in ACTIVE_STATES for job in job_runner().recent(limit=3)):
+    st.button("🔄 更新工作進度")
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+資產依賴圖
+
+從資產管理紀錄（04_資產管理記錄）與業務影響分析（11_業務影響分析）建立資產依賴圖：
+- 表格欄位：名稱欄（設備名稱、IT系統名稱、流程名稱…）搭配「依賴 / 上游」與「下游 / 支援業務流程」欄
+- 「項目 | 內容」形式的基本資訊表（流程名稱、上游流程、下游流程）
+- Mermaid / Graphviz 程式碼區塊中的 A --> B、A -> B
+邊 A → B 表示 B 依賴 A（A 故障時 B 受影響）。
+
+建圖時以強連通分量縮點後依拓撲順序計算每個節點的可達位元集，
+「Core_Switch 故障會影響哪些資產」只需讀取一個整數的位元。
+
+使用方式：
+    python asset_graph.py impact Core_Switch
+    python asset_graph.py dot Core_Switch > core.dot
+"""
+
+import argparse
+import re
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+ROOT_DIR = Path(__file__).parent.parent
+DEFAULT_SOURCES = [
+    ROOT_DIR / "ISO27001_文檔體系" / "04_資產管理記錄",
+    ROOT_DIR / "ISO27001_文檔體系" / "11_業務影響分析",
+    Path(__file__).parent / "Knowledge_Graph.md",
+]
+
+# 表頭關鍵字
+NAME_HEADERS = ("資產名稱", "設備名稱", "IT系統名稱", "系統名稱", "電腦名稱", "流程名稱")
+UPSTREAM_HEADERS = ("依賴", "上游")
+DOWNSTREAM_HEADERS = ("下游", "支援業務流程", "被依賴", "依賴者")
+DESCRIPTIVE_HEADERS = ("說明", "類型", "備註", "程度", "日期")
+
+_EDGE_RE = re.compile(r"^\s*([\w\-.]+)(?:\[[^\]]*\])?\s*(?:-->|->|==>)\s*(?:\|[^|]*\|\s*)?([\w\-.]+)")
+_SPLIT_RE = re.compile(r"\s*(?:[、,，;；]|<br\s*/?>)\s*")
+_PLACEHOLDER_RE = re.compile(r"^[\s_＿\-]*$")
+
+
+def _clean(cell: str) -> str:
+    return cell.replace("**", "").strip()
+
+
+def _values(cell: str) -> List[str]:
+    """拆出儲存格中的名稱；略過空白樣板（____）與未勾選的選項（☐）"""
+    cell = _clean(cell)
+    if "☐" in cell:
+        return []
+    return [value for value in _SPLIT_RE.split(cell) if value and not _PLACEHOLDER_RE.match(value)]
+
+
+def _header_kind(header: str) -> Optional[str]:
+    header = _clean(header).replace(" ", "")
+    if any(key in header for key in DESCRIPTIVE_HEADERS):
+        return None
+    if any(key in header for key in DOWNSTREAM_HEADERS):
+        return "down"
+    if any(key in header for key in UPSTREAM_HEADERS):
+        return "up"
+    if header in NAME_HEADERS:
+        return "name"
+    return None
+
+
+def _tables(lines: Sequence[str]) -> Iterable[List[List[str]]]:
+    """依序產生文件中的 Markdown 表格（每列為儲存格列表，不含分隔列）"""
+    table: List[List[str]] = []
+    for line in list(lines) + [""]:
+        if line.lstrip().startswith("|"):
+            cells = [cell.strip() for cell in line.strip().strip("|").split("|")]
+            if not all(re.fullmatch(r":?-+:?", cell) for cell in cells if cell):
+                table.append(cells)
+            continue
+        if table:
+            yield table
+            table = []
+
+
+def parse_edges(text: str) -> Set[Tuple[str, str]]:
+    """
+    從一份 Markdown 文件解析依賴邊
+
+    Returns:
+        {(上游, 下游)}
+    """
+    edges: Set[Tuple[str, str]] = set()
+    lines = text.splitlines()
+
+    # 程式碼區塊中的 Mermaid / Graphviz 邊
+    in_graph = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            in_graph = not in_graph and stripped[3:].strip().lower() in ("mermaid", "dot", "graphviz")
+            continue
+        if in_graph:
+            match = _EDGE_RE.match(stripped)
+            if match:
+                edges.add((match.group(1), match.group(2)))
+
+    for table in _tables(lines):
+        header, rows = table[0], table[1:]
+        kinds = [_header_kind(cell) for cell in header]
+        if "up" in kinds or "down" in kinds:
+            for row in rows:
+                names, upstream, downstream = [], [], []
+                for kind, cell in zip(kinds, row):
+                    if kind == "name" and not names:
+                        names = _values(cell)
+                    elif kind == "up":
+                        upstream += _values(cell)
+                    elif kind == "down":
+                        downstream += _values(cell)
+                _add_record(edges, names, upstream, downstream)
+        elif len(header) == 2:
+            # 「項目 | 內容」基本資訊表：整張表描述一筆紀錄
+            names, upstream, downstream = [], [], []
+            for row in rows:
+                if len(row) < 2:
+                    continue
+                kind = _header_kind(row[0])
+                if kind == "name" and not names:
+                    names = _values(row[1])
+                elif kind == "up":
+                    upstream += _values(row[1])
+                elif kind == "down":
+                    downstream += _values(row[1])
+            _add_record(edges, names, upstream, downstream)
+    return edges
+
+
+def _add_record(edges: Set[Tuple[str, str]], names: List[str], upstream: List[str], downstream: List[str]):
+    if names:
+        name = names[0]
+        edges.update((source, name) for source in upstream if source != name)
+        edges.update((name, target) for target in downstream if target != name)
+    else:
+        # 「上游資產 | 下游資產」成對表格
+        edges.update((source, target) for source in upstream for target in downstream if source != target)
+
+
+class AssetGraph:
+    """
+    鄰接串列表示的資產依賴圖，附預先計算的可達位元集
+
+    impacted(name)：name 故障時受影響（可由 name 到達）的所有資產
+    dependencies(name)：name 所依賴（可到達 name）的所有資產
+    """
+
+    def __init__(self, edges: Iterable[Tuple[str, str]]):
+        self.edges = sorted(set(edges))
+        nodes = sorted({node for edge in self.edges for node in edge})
+        self.nodes = nodes
+        self.index = {node: i for i, node in enumerate(nodes)}
+        self.successors: List[List[int]] = [[] for _ in nodes]
+        self.predecessors: List[List[int]] = [[] for _ in nodes]
+        for source, target in self.edges:
+            self.successors[self.index[source]].append(self.index[target])
+            self.predecessors[self.index[target]].append(self.index[source])
+        self._downstream = _reachability(self.successors)
+        self._upstream = _reachability(self.predecessors)
+
+    @classmethod
+    def from_sources(cls, sources: Sequence[Path] = DEFAULT_SOURCES) -> "AssetGraph":
+        """從目錄（其下所有 .md）或單一檔案建立"""
+        edges: Set[Tuple[str, str]] = set()
+        for path in source_files(sources):
+            edges |= parse_edges(path.read_text(encoding="utf-8", errors="replace"))
+        return cls(edges)
+
+    def _names(self, bits: int, exclude: int) -> List[str]:
+        bits &= ~(1 << exclude)
+        names = []
+        while bits:
+            low = bits & -bits
+            names.append(self.nodes[low.bit_length() - 1])
+            bits ^= low
+        return names
+
+    def impacted(self, name: str) -> List[str]:
+        """name 故障時受影響的資產（不含自己）；未知資產回傳空列表"""
+        i = self.index.get(name)
+        return [] if i is None else self._names(self._downstream[i], i)
+
+    def dependencies(self, name: str) -> List[str]:
+        """name 直接或間接依賴的資產（不含自己）"""
+        i = self.index.get(name)
+        return [] if i is None else self._names(self._upstream[i], i)
+
+    def subgraph_dot(self, focus: str, include_dependencies: bool = True) -> str:
+        """
+        只包含 focus、其影響範圍（與依賴來源）的 Graphviz DOT
+
+        Args:
+            focus: 故障資產名稱
+            include_dependencies: 是否一併顯示 focus 的上游依賴
+        """
+        i = self.index.get(focus)
+        if i is None:
+            return "digraph {}"
+        bits = self._downstream[i] | (self._upstream[i] if include_dependencies else 0)
+        members = {self.nodes[j] for j in range(len(self.nodes)) if bits >> j & 1}
+        impacted = set(self.impacted(focus))
+        lines = ["digraph {", "    rankdir=LR", "    node [shape=box, style=rounded]"]
+        for node in sorted(members):
+            if node == focus:
+                attrs = ' [style="rounded,filled", fillcolor="#f8d7da", color="#c0392b", penwidth=2]'
+            elif node in impacted:
+                attrs = ' [style="rounded,filled", fillcolor="#fff3cd"]'
+            else:
+                attrs = ""
+            lines.append(f"    {_quote(node)}{attrs}")
+        for source, target in self.edges:
+            if source in members and target in members:
+                lines.append(f"    {_quote(source)} -> {_quote(target)}")
+        lines.append("}")
+        return "\n".join(lines)
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _reachability(adjacency: List[List[int]]) -> List[int]:
+    """
+    計算每個節點的可達位元集（含自己）
+
+    以 Tarjan 演算法（迭代版）求強連通分量；Tarjan 產生分量的順序即為縮點後的逆拓撲順序，
+    因此依序計算時，後繼分量的位元集都已完成。
+    """
+    n = len(adjacency)
+    index = [-1] * n
+    low = [0] * n
+    on_stack = [False] * n
+    stack: List[int] = []
+    component = [-1] * n
+    components: List[List[int]] = []
+    counter = 0
+
+    for root in range(n):
+        if index[root] != -1:
+            continue
+        work = [(root, 0)]
+        while work:
+            node, child = work.pop()
+            if child == 0:
+                index[node] = low[node] = counter
+                counter += 1
+                stack.append(node)
+                on_stack[node] = True
+            recurse = False
+            for position in range(child, len(adjacency[node])):
+                successor = adjacency[node][position]
+                if index[successor] == -1:
+                    work.append((node, position + 1))
+                    work.append((successor, 0))
+                    recurse = True
+                    break
+                if on_stack[successor]:
+                    low[node] = min(low[node], index[successor])
+            if recurse:
+                continue
+            if low[node] == index[node]:
+                members = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component[member] = len(components)
+                    members.append(member)
+                    if member == node:
+                        break
+                components.append(members)
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+
+    reach_by_component = []
+    for members in components:
+        bits = 0
+        for member in members:
+            bits |= 1 << member
+        for member in members:
+            for successor in adjacency[member]:
+                if component[successor] != len(reach_by_component):
+                    bits |= reach_by_component[component[successor]]
+        reach_by_component.append(bits)
+    return [reach_by_component[component[node]] for node in range(n)]
+
+
+def source_files(sources: Sequence[Path] = DEFAULT_SOURCES) -> List[Path]:
+    """依設定列出所有來源 Markdown 檔"""
+    files = []
+    for source in sources:
+        source = Path(source)
+        if source.is_dir():
+            files.extend(sorted(source.glob("*.md")))
+        elif source.exists():
+            files.append(source)
+    return files
+
+
+def source_stamps(sources: Sequence[Path] = DEFAULT_SOURCES) -> Tuple[Tuple[str, int, int], ...]:
+    """來源檔的 (路徑, mtime, 大小)，作為快取鍵：任何檔案變更、新增或刪除時改變"""
+    stamps = []
+    for path in source_files(sources):
+        stat = path.stat()
+        stamps.append((str(path), stat.st_mtime_ns, stat.st_size))
+    return tuple(stamps)
+
+
+_cache: Dict[Tuple[Tuple[str, int, int], ...], AssetGraph] = {}
+
+
+def load_graph(sources: Sequence[Path] = DEFAULT_SOURCES) -> AssetGraph:
+    """取得依賴圖；來源檔未變更時沿用上次建立的圖"""
+    stamps = source_stamps(sources)
+    graph = _cache.get(stamps)
+    if graph is None:
+        _cache.clear()
+        graph = _cache[stamps] = AssetGraph.from_sources(sources)
+    return graph
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """主程式入口"""
+    parser = argparse.ArgumentParser(description="資產依賴圖")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    impact_parser = subparsers.add_parser("impact", help="列出資產故障時受影響的資產")
+    impact_parser.add_argument("asset", help="資產名稱")
+    dot_parser = subparsers.add_parser("dot", help="輸出資產相關子圖的 Graphviz DOT")
+    dot_parser.add_argument("asset", help="資產名稱")
+    subparsers.add_parser("list", help="列出所有資產與依賴邊數")
+    args = parser.parse_args(argv)
+
+    graph = load_graph()
+    if args.command == "list":
+        print(f"{len(graph.nodes)} 個資產、{len(graph.edges)} 條依賴")
+        for node in graph.nodes:
+            print(f"  {node}（影響 {len(graph.impacted(node))} 個）")
+        return 0
+    if args.asset not in graph.index:
+        print(f"錯誤: 找不到資產 {args.asset}", file=sys.stderr)
+        return 1
+    if args.command == "impact":
+        impacted = graph.impacted(args.asset)
+        print(f"{args.asset} 故障時受影響的資產（{len(impacted)} 個）：")
+        for node in impacted:
+            print(f"  - {node}")
+    else:
+        print(graph.subgraph_dot(args.asset))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+"""
+儀表板背景工作
+
+讓儀表板的行動按鈕不會卡住 Streamlit 腳本執行緒：
+- 工作在執行緒池中執行，狀態與進度寫入 SQLite 工作表（重新整理或重新啟動後仍可查詢）
+- 相同參數且仍在執行中的工作不會重複建立，直接回傳既有工作
+- 每個工作記錄所屬程序（開機 ID + pid）；只有所屬程序已結束的工作才會被標記為中斷，
+  因此 python jobs.py list 等其他程序不會影響儀表板正在執行的工作
+- 成功結果依 fingerprint（如 git HEAD 與日期、紀錄目錄的 mtime）快取，重複點擊立即回傳上次的報告
+- 資產變更掃描記住上次掃描的 commit，只讀取之後新增的 git 紀錄
+
+使用方式：
+    python jobs.py run asset_scan
+    python jobs.py list
+"""
+
+import argparse
+import json
+import os
+import re
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT_DIR = Path(__file__).parent.parent
+JOBS_DB = Path(__file__).parent / ".jobs" / "jobs.db"
+
+# 工作狀態
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    job_key TEXT NOT NULL,
+    params TEXT NOT NULL,
+    fingerprint TEXT,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    owner_boot TEXT,
+    owner_pid INTEGER
+);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (job_key, status, finished_at);
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS asset_changes (
+    commit_hash TEXT NOT NULL,
+    committed_at REAL NOT NULL,
+    author TEXT,
+    subject TEXT,
+    status TEXT NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (commit_hash, path)
+);
+"""
+
+
+def connect(db_path: Path) -> sqlite3.Connection:
+    """開啟工作資料庫（WAL 模式，讀取不會被寫入阻塞）"""
+    db_path = Path(db_path)
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path), timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(_SCHEMA)
+    # 舊版資料庫沒有工作所屬程序的欄位
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+    with conn:
+        for name, kind in (("owner_boot", "TEXT"), ("owner_pid", "INTEGER")):
+            if name not in columns:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {kind}")
+    return conn
+
+
+def _boot_id() -> str:
+    """本次開機的識別碼（重新開機後所有舊 pid 都已失效）；無法取得時以主機名稱代替"""
+    try:
+        with open("/proc/sys/kernel/random/boot_id", encoding="ascii") as f:
+            return f.read().strip()
+    except OSError:
+        return "host:" + socket.gethostname()
+
+
+def _pid_alive(pid: int) -> bool:
+    """檢查同一台主機上的程序是否仍在執行"""
+    if sys.platform == "win32":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        try:
+            return bool(kernel32.GetExitCodeProcess(handle, ctypes.byref(code))) and code.value == 259
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class JobRunner:
+    """
+    以執行緒池執行已註冊的工作
+
+    工作函數的簽章為 fn(params, progress) -> result，
+    progress(fraction, message) 回報 0~1 的進度；result 需可序列化為 JSON。
+    """
+
+    def __init__(self, db_path: Path = JOBS_DB, max_workers: int = 2, clock: Callable[[], float] = time.time):
+        """
+        Args:
+            db_path: SQLite 工作表路徑
+            max_workers: 同時執行的工作數
+            clock: 時間函數
+        """
+        self.db_path = Path(db_path)
+        self._clock = clock
+        self._kinds: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dashboard-job")
+        self._owner = (_boot_id(), os.getpid())
+        self.sweep_orphans()
+
+    def sweep_orphans(self) -> int:
+        """
+        將所屬程序已結束的排隊中 / 執行中工作標記為失敗，以免永遠卡在「執行中」
+
+        Returns:
+            標記的工作數
+        """
+        boot, pid = self._owner
+        with self._lock:
+            conn = self._db()
+            rows = conn.execute(
+                "SELECT id, owner_boot, owner_pid FROM jobs WHERE status IN (?, ?)", ACTIVE_STATES
+            ).fetchall()
+            # 未記錄所屬程序的舊版工作視為已中斷
+            orphans = [row["id"] for row in rows
+                       if row["owner_pid"] is None or row["owner_boot"] != boot
+                       or (row["owner_pid"] != pid and not _pid_alive(row["owner_pid"]))]
+            with conn:
+                conn.executemany(
+                    "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status IN (?, ?)",
+                    [(FAILED, "執行工作的程序已結束，工作已中斷", self._clock(), job_id, *ACTIVE_STATES)
+                     for job_id in orphans]
+                )
+        return len(orphans)
+
+    def _db(self) -> sqlite3.Connection:
+        # sqlite3 連線不可跨執行緒共用：每個執行緒一條
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect(self.db_path)
+        return conn
+
+    def register(
+        self,
+        kind: str,
+        func: Callable[[Dict[str, Any], Callable[[float, str], None]], Any],
+        cache_seconds: float = 0,
+        fingerprint: Optional[Callable[[Dict[str, Any]], str]] = None
+    ):
+        """
+        註冊工作類型
+
+        Args:
+            kind: 工作類型名稱
+            func: 工作函數
+            cache_seconds: 成功結果的快取時間（0 表示不依時間失效，只看 fingerprint）
+            fingerprint: 由參數計算資料版本的函數；版本改變時快取失效（None 表示不快取）
+        """
+        self._kinds[kind] = {"func": func, "cache_seconds": cache_seconds, "fingerprint": fingerprint}
+
+    def submit(self, kind: str, params: Optional[Dict[str, Any]] = None, force: bool = False) -> str:
+        """
+        提交工作
+
+        Args:
+            kind: 已註冊的工作類型
+            params: 工作參數
+            force: 忽略快取結果，重新執行
+
+        Returns:
+            工作 ID（可能是執行中的相同工作，或快取結果所屬的工作）
+
+        Raises:
+            ValueError: 未註冊的工作類型
+        """
+        if kind not in self._kinds:
+            raise ValueError(f"未註冊的工作類型：{kind}")
+        spec = self._kinds[kind]
+        params = params or {}
+        job_key = kind + ":" + json.dumps(params, sort_keys=True, ensure_ascii=False)
+        fingerprint = spec["fingerprint"](params) if spec["fingerprint"] is not None else None
+        now = self._clock()
+
+        with self._lock:
+            conn = self._db()
+            active = conn.execute(
+                "SELECT id FROM jobs WHERE job_key = ? AND status IN (?, ?) ORDER BY created_at DESC LIMIT 1",
+                (job_key, *ACTIVE_STATES)
+            ).fetchone()
+            if active is not None:
+                return active["id"]
+            if not force and fingerprint is not None:
+                cached = conn.execute(
+                    "SELECT id, finished_at FROM jobs WHERE job_key = ? AND status = ? AND fingerprint = ? "
+                    "ORDER BY finished_at DESC LIMIT 1",
+                    (job_key, SUCCEEDED, fingerprint)
+                ).fetchone()
+                if cached is not None and (not spec["cache_seconds"]
+                                           or now - cached["finished_at"] < spec["cache_seconds"]):
+                    return cached["id"]
+            job_id = uuid.uuid4().hex
+            with conn:
+                conn.execute(
+                    "INSERT INTO jobs (id, kind, job_key, params, fingerprint, status, message, created_at, "
+                    "owner_boot, owner_pid) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, job_key, json.dumps(params, ensure_ascii=False), fingerprint, QUEUED,
+                     "排隊中", now, *self._owner)
+                )
+        self._executor.submit(self._run, job_id, spec["func"], params)
+        return job_id
+
+    def _run(self, job_id: str, func: Callable, params: Dict[str, Any]):
+        # 狀態更新都限定目前狀態，已被標記為中斷的工作不會被改回執行中或成功
+        conn = self._db()
+        with conn:
+            started = conn.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, message = ? WHERE id = ? AND status = ?",
+                (RUNNING, self._clock(), "執行中", job_id, QUEUED)
+            ).rowcount
+        if not started:
+            return
+
+        def progress(fraction: float, message: str = ""):
+            with conn:
+                conn.execute("UPDATE jobs SET progress = ?, message = ? WHERE id = ? AND status = ?",
+                             (max(0.0, min(1.0, fraction)), message, job_id, RUNNING))
+
+        try:
+            result = func(params, progress)
+        except Exception as e:
+            with conn:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, message = ?, finished_at = ? WHERE id = ? AND status = ?",
+                    (FAILED, str(e), "失敗", self._clock(), job_id, RUNNING)
+                )
+            return
+        with conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, progress = 1, message = ?, result = ?, finished_at = ? "
+                "WHERE id = ? AND status = ?",
+                (SUCCEEDED, "完成", json.dumps(result, ensure_ascii=False), self._clock(), job_id, RUNNING)
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """取得工作狀態（result 已解析）"""
+        row = self._db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row is not None else None
+
+    def latest(self, kind: str) -> Optional[Dict[str, Any]]:
+        """取得某類型最近一次提交的工作"""
+        row = self._db().execute(
+            "SELECT * FROM jobs WHERE kind = ? ORDER BY created_at DESC LIMIT 1", (kind,)
+        ).fetchone()
+        return _row_to_job(row) if row is not None else None
+
+    def recent(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """最近的工作（新到舊，不含 result）"""
+        rows = self._db().execute(
+            "SELECT id, kind, status, progress, message, error, created_at, finished_at "
+            "FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def wait(self, job_id: str, timeout: float = 30.0, interval: float = 0.05) -> Dict[str, Any]:
+        """
+        等待工作結束（供命令列與測試使用）
+
+        Raises:
+            TimeoutError: 逾時仍未結束
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is not None and job["status"] not in ACTIVE_STATES:
+                return job
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"工作 {job_id} 在 {timeout} 秒內未完成")
+            time.sleep(interval)
+
+    def close(self):
+        """等待執行中的工作結束並關閉執行緒池"""
+        self._executor.shutdown(wait=True)
+
+
+def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(row)
+    job["params"] = json.loads(job["params"])
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    return job
+
+
+# ---------------------------------------------------------------------------
+# 工作：Exchange 郵件日誌抓取
+# ---------------------------------------------------------------------------
+
+def fetch_exchange_log(params: Dict[str, Any], progress: Callable[[float, str], None],
+                       script: Path = ROOT_DIR / "scripts" / "get-exchange-log.ps1") -> Dict[str, Any]:
+    """
+    執行 PowerShell 腳本抓取指定信箱的郵件日誌
+
+    Raises:
+        RuntimeError: 找不到腳本或 PowerShell，或腳本執行失敗
+    """
+    if not script.exists():
+        raise RuntimeError(f"找不到腳本 {script.relative_to(ROOT_DIR)}")
+    command = ["powershell", "-NoProfile", "-ExecutionPolicy", "Bypass", "-File", str(script)]
+    if params.get("mailbox"):
+        command += ["-Mailbox", params["mailbox"]]
+    progress(0.1, "正在執行 PowerShell 腳本...")
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=params.get("timeout", 600))
+    except FileNotFoundError:
+        raise RuntimeError("找不到 PowerShell") from None
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f"腳本結束代碼 {result.returncode}")
+    lines = result.stdout.splitlines()
+    return {"lines": len(lines), "output": "\n".join(lines[-200:])}
+
+
+# ---------------------------------------------------------------------------
+# 工作：月度備份報告
+# ---------------------------------------------------------------------------
+
+BACKUP_RECORDS = ROOT_DIR / "記錄與證據" / "備份與復原"
+_CHECKED = "☑☒■✅✔"
+_SUCCESS_RE = re.compile(f"[{_CHECKED}]\\s*成功")
+_FAILURE_RE = re.compile(f"[{_CHECKED}]\\s*失敗")
+
+
+def _month(params: Dict[str, Any]) -> str:
+    return params.get("month") or datetime.now().strftime("%Y-%m")
+
+
+def backup_report_fingerprint(params: Dict[str, Any], records: Path = BACKUP_RECORDS) -> str:
+    """月份目錄內檔案的數量與最新 mtime；紀錄未變更時沿用上次報告"""
+    year, month = _month(params).split("-")
+    directory = records / year / month
+    if not directory.exists():
+        return "missing"
+    stamps = [entry.stat().st_mtime_ns for entry in os.scandir(directory) if entry.name.endswith(".md")]
+    return f"{len(stamps)}:{max(stamps, default=0)}"
+
+
+def monthly_backup_report(params: Dict[str, Any], progress: Callable[[float, str], None],
+                          records: Path = BACKUP_RECORDS) -> Dict[str, Any]:
+    """
+    彙整指定月份（params['month'] = 'YYYY-MM'，預設本月）的備份執行紀錄
+
+    以勾選的「成功 / 失敗」核取方塊統計結果。
+    """
+    month = _month(params)
+    year, mm = month.split("-")
+    directory = records / year / mm
+    files = sorted(directory.glob("*.md")) if directory.exists() else []
+    rows = []
+    for index, path in enumerate(files, 1):
+        text = path.read_text(encoding="utf-8", errors="replace")
+        rows.append({
+            "file": path.name,
+            "success": len(_SUCCESS_RE.findall(text)),
+            "failure": len(_FAILURE_RE.findall(text)),
+        })
+        progress(index / len(files), f"已讀取 {index}/{len(files)} 份紀錄")
+    success = sum(row["success"] for row in rows)
+    failure = sum(row["failure"] for row in rows)
+    total = success + failure
+    lines = [
+        f"# {month} 月度備份報告",
+        "",
+        f"- 紀錄檔案：{len(rows)} 份",
+        f"- 成功：{success} 次，失敗：{failure} 次",
+        f"- 成功率：{success / total:.1%}" if total else "- 成功率：無已勾選的執行結果",
+        "",
+        "| 紀錄 | 成功 | 失敗 |",
+        "|------|------|------|",
+    ]
+    lines += [f"| {row['file']} | {row['success']} | {row['failure']} |" for row in rows]
+    return {"month": month, "files": rows, "success": success, "failure": failure,
+            "report": "\n".join(lines)}
+
+
+# ---------------------------------------------------------------------------
+# 工作：資產變更掃描（增量讀取 git 紀錄）
+# ---------------------------------------------------------------------------
+
+ASSET_PATHS = ["ISO27001_文檔體系/04_資產管理記錄", "記錄與證據/資產管理"]
+
+
+def _git(repo: Path, *args: str) -> str:
+    result = subprocess.run(["git", "-c", "core.quotePath=false", *args], cwd=str(repo),
+                            capture_output=True, text=True, encoding="utf-8")
+    if result.returncode != 0:
+        raise RuntimeError(f"git {args[0]} 失敗：{result.stderr.strip()}")
+    return result.stdout
+
+
+def git_head(repo: Path = ROOT_DIR) -> str:
+    """目前的 HEAD commit"""
+    return _git(repo, "rev-parse", "HEAD").strip()
+
+
+def asset_scan_fingerprint(params: Dict[str, Any], repo: Path = ROOT_DIR,
+                           clock: Callable[[], float] = time.time) -> str:
+    """HEAD commit 加上今天的日期：HEAD 未變更時結果仍每天重新計算，讓最近 N 天的視窗持續往前移"""
+    return f"{git_head(repo)}:{datetime.fromtimestamp(clock()).date().isoformat()}"
+
+
+class AssetChangeScanner:
+    """
+    資產變更掃描
+
+    將變更逐筆存入 asset_changes 表並記住最後掃描的 commit；
+    之後只讀取 last..HEAD 的新紀錄，回傳視窗內（預設 7 天）的所有變更。
+    """
+
+    def __init__(self, db_path: Path = JOBS_DB, repo: Path = ROOT_DIR, paths: Optional[List[str]] = None,
+                 window_days: int = 7, clock: Callable[[], float] = time.time):
+        self.db_path = Path(db_path)
+        self.repo = Path(repo)
+        self.paths = paths or ASSET_PATHS
+        self.window_days = window_days
+        self._clock = clock
+
+    def __call__(self, params: Dict[str, Any], progress: Callable[[float, str], None]) -> Dict[str, Any]:
+        conn = connect(self.db_path)
+        try:
+            return self._scan(conn, progress)
+        finally:
+            conn.close()
+
+    def _scan(self, conn: sqlite3.Connection, progress: Callable[[float, str], None]) -> Dict[str, Any]:
+        head = git_head(self.repo)
+        row = conn.execute("SELECT value FROM state WHERE name = 'asset_scan_commit'").fetchone()
+        last = row["value"] if row is not None else None
+        cutoff = self._clock() - self.window_days * 86400
+
+        if last == head:
+            new_changes = []
+        elif last is not None and self._is_ancestor(last, head):
+            progress(0.2, f"讀取 {last[:8]}..{head[:8]} 的變更")
+            new_changes = self._log(f"{last}..{head}")
+        else:
+            # 第一次掃描，或歷史被改寫：重新讀取整個視窗
+            progress(0.2, f"讀取最近 {self.window_days} 天的變更")
+            with conn:
+                conn.execute("DELETE FROM asset_changes")
+            new_changes = self._log(head, "--since=" + datetime.fromtimestamp(cutoff).isoformat(timespec="seconds"))
+
+        progress(0.8, f"新增 {len(new_changes)} 筆變更")
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO asset_changes VALUES (?, ?, ?, ?, ?, ?)",
+                [(c["commit"], c["committed_at"], c["author"], c["subject"], c["status"], c["path"])
+                 for c in reversed(new_changes)]  # 舊到新寫入，rowid 越大越新
+            )
+            conn.execute("DELETE FROM asset_changes WHERE committed_at < ?", (cutoff,))
+            conn.execute("INSERT OR REPLACE INTO state VALUES ('asset_scan_commit', ?)", (head,))
+        rows = conn.execute(
+            "SELECT * FROM asset_changes ORDER BY committed_at DESC, rowid DESC"
+        ).fetchall()
+        changes = [{
+            "commit": r["commit_hash"], "committed_at": r["committed_at"], "author": r["author"],
+            "subject": r["subject"], "status": r["status"], "path": r["path"],
+        } for r in rows]
+        return {"head": head, "new": len(new_changes), "window_days": self.window_days, "changes": changes}
+
+    def _is_ancestor(self, commit: str, head: str) -> bool:
+        result = subprocess.run(["git", "merge-base", "--is-ancestor", commit, head], cwd=str(self.repo),
+                                capture_output=True)
+        return result.returncode == 0
+
+    def _log(self, *revisions: str) -> List[Dict[str, Any]]:
+        output = _git(self.repo, "log", "--name-status", "--format=%x1e%H%x1f%ct%x1f%an%x1f%s",
+                      *revisions, "--", *self.paths)
+        changes = []
+        for record in output.split("\x1e")[1:]:
+            header, _, files = record.partition("\n")
+            commit, committed_at, author, subject = header.split("\x1f", 3)
+            for line in files.splitlines():
+                if not line.strip():
+                    continue
+                fields = line.split("\t")
+                # 重新命名 / 複製（R100 舊路徑 新路徑）記錄新路徑
+                changes.append({"commit": commit, "committed_at": float(committed_at), "author": author,
+                                "subject": subject, "status": fields[0][0], "path": fields[-1]})
+        return changes
+
+
+# ---------------------------------------------------------------------------
+
+def default_runner(db_path: Path = JOBS_DB, max_workers: int = 2) -> JobRunner:
+    """註冊儀表板三個行動按鈕的工作"""
+    runner = JobRunner(db_path, max_workers=max_workers)
+    runner.register("exchange_log", fetch_exchange_log)
+    runner.register("backup_report", monthly_backup_report, fingerprint=backup_report_fingerprint)
+    runner.register("asset_scan", AssetChangeScanner(db_path), fingerprint=asset_scan_fingerprint)
+    return runner
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """主程式入口"""
+    parser = argparse.ArgumentParser(description="儀表板背景工作")
+    parser.add_argument("--db", default=str(JOBS_DB), help="工作資料庫路徑")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="執行工作並等待結果")
+    run_parser.add_argument("kind", choices=["exchange_log", "backup_report", "asset_scan"])
+    run_parser.add_argument("--params", default="{}", help="JSON 格式的工作參數")
+    run_parser.add_argument("--force", action="store_true", help="忽略快取結果")
+    subparsers.add_parser("list", help="列出最近的工作")
+    args = parser.parse_args(argv)
+
+    runner = default_runner(Path(args.db))
+    try:
+        if args.command == "list":
+            for job in runner.recent():
+                created = datetime.fromtimestamp(job["created_at"]).strftime("%Y-%m-%d %H:%M:%S")
+                print(f"{created}  {job['kind']:14} {job['status']:10} {job['message'] or ''}")
+            return 0
+        job = runner.wait(runner.submit(args.kind, json.loads(args.params), force=args.force), timeout=900)
+    finally:
+        runner.close()
+    if job["status"] == FAILED:
+        print(f"錯誤: {job['error']}", file=sys.stderr)
+        return 1
+    print(json.dumps(job["result"], ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
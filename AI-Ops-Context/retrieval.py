@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+"""
+Runbook 檢索索引
+
+離線建立、增量更新的本地檢索索引，為 AI 診斷中樞提供相關的 Runbook 段落：
+- 依 Markdown 標題切分段落（程式碼區塊內的 # 不視為標題）
+- 英數字以單字、中日韓文字以二元組（bigram）作為詞彙
+- BM25 權重預先計算並以「詞彙 → 段落」倒排陣列存成 .npy，查詢時以 mmap 載入
+- 增量更新：只重新切分 mtime 或大小改變的檔案，其餘沿用快取的詞頻
+- IndexUpdater 於背景執行緒定期更新，查詢端（儀表板）只載入已建立的索引
+
+使用方式：
+    python retrieval.py build            # 建立或增量更新索引
+    python retrieval.py search "MWS 連線錯誤" -k 3
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+ROOT_DIR = Path(__file__).parent.parent
+INDEX_DIR = Path(__file__).parent / ".runbook_index"
+
+# BM25 參數
+K1 = 1.5
+B = 0.75
+MAX_CHUNK_CHARS = 2000
+INDEX_VERSION = 1
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_TOKEN_RE = re.compile(r"[a-z0-9][a-z0-9_\-]*|[㐀-䶿一-鿿豈-﫿]+")
+_SKIP_DIRS = {".git", ".runbook_index", "node_modules", "__pycache__", ".venv", "venv"}
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    切分詞彙
+
+    Args:
+        text: 原始文字
+
+    Returns:
+        詞彙列表（英數字為小寫單字，中文為相鄰兩字的二元組；單一中文字保留原字）
+    """
+    tokens = []
+    for match in _TOKEN_RE.findall(text.lower()):
+        if match[0].isascii():
+            tokens.append(match)
+        elif len(match) == 1:
+            tokens.append(match)
+        else:
+            tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+    return tokens
+
+
+def split_sections(text: str, max_chars: int = MAX_CHUNK_CHARS) -> List[Dict[str, Any]]:
+    """
+    依標題切分 Markdown
+
+    Args:
+        text: Markdown 內容
+        max_chars: 單一段落的字數上限（超過時於空行處再切分）
+
+    Returns:
+        [{'heading': 'H1 > H2', 'line': 起始行號, 'text': 段落內容}]
+    """
+    sections = []
+    stack: List[Tuple[int, str]] = []
+    lines: List[str] = []
+    start = 1
+    in_fence = False
+
+    def flush():
+        body = "\n".join(lines).strip()
+        if body:
+            heading = " > ".join(title for _, title in stack)
+            for offset, part in _split_long(lines, max_chars):
+                sections.append({'heading': heading, 'line': start + offset, 'text': part})
+
+    for number, line in enumerate(text.splitlines(), 1):
+        if _FENCE_RE.match(line):
+            in_fence = not in_fence
+        match = None if in_fence else _HEADING_RE.match(line)
+        if match:
+            flush()
+            level = len(match.group(1))
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            stack.append((level, match.group(2)))
+            lines = [line]
+            start = number
+        else:
+            lines.append(line)
+    flush()
+    return sections
+
+
+def _split_long(lines: List[str], max_chars: int) -> Iterable[Tuple[int, str]]:
+    """將過長的段落於空行處切分；回傳 (相對行號, 內容)"""
+    part: List[str] = []
+    part_start = 0
+    size = 0
+    for offset, line in enumerate(lines):
+        if size > max_chars and not line.strip() and part:
+            yield part_start, "\n".join(part).strip()
+            part, part_start, size = [], offset + 1, 0
+            continue
+        part.append(line)
+        size += len(line) + 1
+    if "\n".join(part).strip():
+        yield part_start, "\n".join(part).strip()
+
+
+def find_markdown(roots: Iterable[Path]) -> List[Path]:
+    """列出所有 Markdown 檔案（略過 .git、索引目錄等）"""
+    files = []
+    for root in roots:
+        for directory, dirnames, filenames in os.walk(root):
+            dirnames[:] = [name for name in dirnames if name not in _SKIP_DIRS]
+            files.extend(Path(directory) / name for name in filenames if name.endswith(".md"))
+    return sorted(files)
+
+
+# ---------------------------------------------------------------------------
+# 建立索引
+# ---------------------------------------------------------------------------
+
+def _load_json(path: Path, default: Any) -> Any:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def _write_json(path: Path, data: Any):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def build_index(
+    roots: Optional[Iterable[Path]] = None,
+    index_dir: Path = INDEX_DIR,
+    base: Path = ROOT_DIR
+) -> Dict[str, int]:
+    """
+    建立或增量更新索引
+
+    只重新切分新增或修改過的檔案；BM25 權重依全體段落重新計算（僅陣列運算）。
+
+    Args:
+        roots: 要索引的目錄（預設為專案根目錄）
+        index_dir: 索引目錄
+        base: 記錄相對路徑的基準目錄
+
+    Returns:
+        {'files', 'changed', 'removed', 'sections', 'terms'}；沒有任何變更時 changed 與 removed 皆為 0
+    """
+    index_dir = Path(index_dir)
+    index_dir.mkdir(parents=True, exist_ok=True)
+    stamps = {}
+    for path in find_markdown(roots or [base]):
+        try:
+            stat = path.stat()
+            stamps[path.relative_to(base).as_posix()] = [str(path), stat.st_mtime_ns, stat.st_size]
+        except (OSError, ValueError):
+            continue
+
+    # 快速路徑：manifest 只有檔案的 mtime 與大小，與目前相同時不需載入詞頻快取
+    manifest_path = index_dir / "manifest.json"
+    manifest = _load_json(manifest_path, {})
+    current = {relative: stamp[1:] for relative, stamp in stamps.items()}
+    if manifest.get("version") == INDEX_VERSION and manifest.get("files") == current:
+        return {'files': len(current), 'changed': 0, 'removed': 0,
+                'sections': manifest["sections"], 'terms': manifest["terms"]}
+
+    cache_path = index_dir / "files.json"
+    cache = _load_json(cache_path, {})
+    if cache.get("version") != INDEX_VERSION:
+        cache = {"version": INDEX_VERSION, "files": {}}
+    cached_files = cache["files"]
+
+    files = {}
+    changed = 0
+    for relative, (path, mtime_ns, size) in stamps.items():
+        entry = cached_files.get(relative)
+        if entry is None or entry["mtime_ns"] != mtime_ns or entry["size"] != size:
+            text = Path(path).read_text(encoding="utf-8", errors="replace")
+            sections = split_sections(text)
+            for section in sections:
+                counts: Dict[str, int] = {}
+                for token in tokenize(section["text"]):
+                    counts[token] = counts.get(token, 0) + 1
+                section["terms"] = counts
+            entry = {"mtime_ns": mtime_ns, "size": size, "sections": sections}
+            changed += 1
+        files[relative] = entry
+    removed = len(set(cached_files) - set(files))
+
+    cache["files"] = files
+    _write_json(cache_path, cache)
+    stats = _write_arrays(files, index_dir, _load_json(index_dir / "meta.json", None), changed, removed)
+    _write_json(manifest_path, {"version": INDEX_VERSION, "files": current,
+                                "sections": stats["sections"], "terms": stats["terms"]})
+    return stats
+
+
+def _write_arrays(files: Dict[str, Any], index_dir: Path, previous: Optional[Dict[str, Any]],
+                  changed: int, removed: int) -> Dict[str, int]:
+    """依快取的詞頻計算 BM25 權重並寫出倒排陣列"""
+    vocabulary: Dict[str, int] = {}
+    sections = []
+    rows, cols, tfs, lengths = [], [], [], []
+    for relative, entry in sorted(files.items()):
+        for section in entry["sections"]:
+            doc = len(sections)
+            sections.append([relative, section["heading"], section["line"], section["text"]])
+            length = 0
+            for term, tf in section["terms"].items():
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                rows.append(doc)
+                cols.append(term_id)
+                tfs.append(tf)
+                length += tf
+            lengths.append(length)
+
+    docs = np.asarray(rows, dtype=np.int32)
+    terms = np.asarray(cols, dtype=np.int32)
+    tf = np.asarray(tfs, dtype=np.float32)
+    doc_lengths = np.asarray(lengths, dtype=np.float32)
+    avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+
+    # BM25：idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))
+    df = np.bincount(terms, minlength=len(vocabulary)).astype(np.float32)
+    idf = np.log(1.0 + (len(sections) - df + 0.5) / (df + 0.5))
+    norm = K1 * (1.0 - B + B * doc_lengths[docs] / max(avg_length, 1e-9))
+    weights = (idf[terms] * tf * (K1 + 1.0) / (tf + norm)).astype(np.float32)
+
+    # 依詞彙排序成倒排陣列：indptr[t]:indptr[t + 1] 為詞彙 t 出現的段落與權重
+    order = np.argsort(terms, kind="stable")
+    indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(df.astype(np.int64), out=indptr[1:])
+
+    # 陣列檔名含世代編號；meta.json 最後才替換，讀取端不會看到寫到一半的索引
+    generation = (previous or {}).get("generation", 0) + 1
+    for name, array in (("indptr", indptr), ("docs", docs[order]), ("weights", weights[order])):
+        np.save(index_dir / f"{name}-{generation}.npy", array)
+    _write_json(index_dir / "meta.json", {
+        "version": INDEX_VERSION,
+        "generation": generation,
+        "built_at": time.time(),
+        "vocabulary": vocabulary,
+        "sections": sections,
+    })
+    for path in index_dir.glob("*.npy"):
+        if not path.stem.endswith(f"-{generation}"):
+            try:
+                path.unlink()
+            except OSError:
+                # Windows 上仍被讀取端 mmap 的檔案無法刪除，留待下次建立時再清除
+                pass
+    return {'files': len(files), 'changed': changed, 'removed': removed,
+            'sections': len(sections), 'terms': len(vocabulary)}
+
+
+# ---------------------------------------------------------------------------
+# 查詢
+# ---------------------------------------------------------------------------
+
+class RunbookIndex:
+    """已建立的索引（倒排陣列以 mmap 唯讀載入）"""
+
+    def __init__(self, index_dir: Path = INDEX_DIR):
+        """
+        Args:
+            index_dir: 索引目錄
+
+        Raises:
+            FileNotFoundError: 尚未建立索引
+        """
+        index_dir = Path(index_dir)
+        with open(index_dir / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        generation = meta["generation"]
+        self.generation = generation
+        self.vocabulary: Dict[str, int] = meta["vocabulary"]
+        self.sections: List[List[Any]] = meta["sections"]
+        self.indptr = np.load(index_dir / f"indptr-{generation}.npy", mmap_mode="r")
+        self.docs = np.load(index_dir / f"docs-{generation}.npy", mmap_mode="r")
+        self.weights = np.load(index_dir / f"weights-{generation}.npy", mmap_mode="r")
+
+    def search(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
+        """
+        取得與查詢最相關的段落
+
+        Args:
+            query: 查詢文字（如使用者描述的異常）
+            k: 回傳段落數
+
+        Returns:
+            [{'path', 'heading', 'line', 'score', 'text'}]，依分數由高至低；無相符詞彙時為空列表
+        """
+        term_ids = {self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary}
+        if not term_ids or not self.sections:
+            return []
+        scores = np.zeros(len(self.sections), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            # 同一詞彙的段落編號不重複，可直接以索引累加
+            scores[self.docs[start:end]] += self.weights[start:end]
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        hits = []
+        for doc in top:
+            path, heading, line, text = self.sections[doc]
+            hits.append({'path': path, 'heading': heading, 'line': line,
+                         'score': float(scores[doc]), 'text': text})
+        return hits
+
+
+class IndexUpdater:
+    """
+    定期增量更新索引並保存目前世代的 RunbookIndex
+
+    current() 只讀取已建立的索引；建立與更新由 refresh()（背景執行緒每 interval 秒呼叫一次）完成。
+    """
+
+    def __init__(
+        self,
+        roots: Optional[Iterable[Path]] = None,
+        index_dir: Path = INDEX_DIR,
+        base: Path = ROOT_DIR,
+        interval: float = 300.0
+    ):
+        """
+        Args:
+            roots: 要索引的目錄（預設為專案根目錄）
+            index_dir: 索引目錄
+            base: 記錄相對路徑的基準目錄
+            interval: 檢查文件變更的間隔（秒）
+        """
+        self.roots = list(roots) if roots is not None else None
+        self.index_dir = Path(index_dir)
+        self.base = base
+        self.interval = interval
+        self.error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._index: Optional[RunbookIndex] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh(self) -> Dict[str, int]:
+        """
+        增量更新索引；有變更或尚未載入時切換到新世代
+
+        Returns:
+            build_index() 的統計
+        """
+        stats = build_index(self.roots, self.index_dir, self.base)
+        with self._lock:
+            stale = self._index is None or stats["changed"] or stats["removed"]
+        if stale:
+            index = RunbookIndex(self.index_dir)
+            with self._lock:
+                self._index = index
+        return stats
+
+    def current(self) -> Optional[RunbookIndex]:
+        """
+        取得目前的索引（不會建立索引）
+
+        Returns:
+            RunbookIndex；背景尚未完成第一次更新且磁碟上也沒有先前建立的索引時為 None
+        """
+        with self._lock:
+            if self._index is None:
+                try:
+                    self._index = RunbookIndex(self.index_dir)
+                except FileNotFoundError:
+                    return None
+            return self._index
+
+    def start(self) -> "IndexUpdater":
+        """啟動背景更新執行緒（立即執行第一次更新）"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="runbook-index-updater", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+                self.error = None
+            except (OSError, ValueError) as e:  # 更新失敗時沿用既有索引，下一輪再試
+                self.error = str(e)
+            if self._stop.wait(self.interval):
+                break
+
+    def stop(self):
+        """停止背景更新"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def format_context(hits: List[Dict[str, Any]], max_chars: int = 1500) -> str:
+    """
+    將檢索結果組成送給 LLM 的上下文
+
+    Args:
+        hits: search() 的結果
+        max_chars: 每個段落保留的字數上限
+
+    Returns:
+        含來源檔案與標題的文字
+    """
+    blocks = []
+    for hit in hits:
+        text = hit['text']
+        if len(text) > max_chars:
+            text = text[:max_chars] + "..."
+        blocks.append(f"[來源：{hit['path']} § {hit['heading']}（第 {hit['line']} 行）]\n{text}")
+    return "\n\n".join(blocks)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """主程式入口"""
+    parser = argparse.ArgumentParser(description="Runbook 檢索索引")
+    parser.add_argument("--index", default=str(INDEX_DIR), help="索引目錄")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="建立或增量更新索引")
+    build_parser.add_argument("roots", nargs="*", help="要索引的目錄（預設為專案根目錄）")
+
+    search_parser = subparsers.add_parser("search", help="查詢相關段落")
+    search_parser.add_argument("query", help="查詢文字")
+    search_parser.add_argument("-k", type=int, default=3, help="回傳段落數")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        stats = build_index([Path(root) for root in args.roots] or None, Path(args.index))
+        print(f"✅ 已索引 {stats['files']} 個檔案、{stats['sections']} 個段落、{stats['terms']} 個詞彙"
+              f"（更新 {stats['changed']}、移除 {stats['removed']}，{time.perf_counter() - start:.2f}s）")
+        return 0
+
+    try:
+        index = RunbookIndex(Path(args.index))
+    except FileNotFoundError:
+        print("錯誤: 尚未建立索引，請先執行 python retrieval.py build", file=sys.stderr)
+        return 1
+    start = time.perf_counter()
+    hits = index.search(args.query, args.k)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    for hit in hits:
+        print(f"{hit['score']:7.2f}  {hit['path']}:{hit['line']}  {hit['heading']}")
+    print(f"（{len(hits)} 筆，{elapsed_ms:.2f} ms）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
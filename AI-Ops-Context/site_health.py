@@ -0,0 +1,439 @@
+#!/usr/bin/env python3
+"""
+據點健康檢查
+
+為儀表板側邊欄提供各據點的實際狀態：
+- 可插拔的探測：ICMP（系統 ping）、TCP 連線、HTTP 狀態碼、Zabbix（JSON-RPC problem.get）
+- 所有據點的所有探測同時執行，各自受逾時限制
+- 結果快取於記憶體，由背景執行緒每 ttl 秒更新；頁面重跑只讀取快取，不會等待網路
+
+設定檔（sites.yaml，見 sites.example.yaml）：
+    sites:
+      - name: 總部
+        probes:
+          - {type: icmp, host: 10.0.0.1}
+          - {type: tcp, host: 10.0.0.10, port: 1433}
+          - {type: http, url: http://10.0.0.20/health}
+          - {type: zabbix, host: HQ-Core}
+
+使用方式：
+    python site_health.py --config sites.yaml
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import yaml
+
+# 據點狀態
+UP = "up"
+DEGRADED = "degraded"
+DOWN = "down"
+UNKNOWN = "unknown"
+
+
+# ---------------------------------------------------------------------------
+# 探測
+# ---------------------------------------------------------------------------
+
+class TcpProbe:
+    """TCP 連線探測（如 SQL Server 1433、RDP 3389）"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = int(port)
+        self.name = f"tcp {host}:{port}"
+
+    def check(self, timeout: float) -> Tuple[bool, str]:
+        try:
+            with socket.create_connection((self.host, self.port), timeout=timeout):
+                return True, "連線成功"
+        except OSError as e:
+            return False, f"連線失敗：{e}"
+
+
+class HttpProbe:
+    """HTTP 探測：回應狀態碼需為 expect_status"""
+
+    def __init__(self, url: str, expect_status: int = 200):
+        self.url = url
+        self.expect_status = int(expect_status)
+        self.name = f"http {url}"
+
+    def check(self, timeout: float) -> Tuple[bool, str]:
+        try:
+            with urllib.request.urlopen(self.url, timeout=timeout) as response:
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except (urllib.error.URLError, OSError) as e:
+            return False, f"無法連線：{getattr(e, 'reason', e)}"
+        if status != self.expect_status:
+            return False, f"HTTP {status}"
+        return True, f"HTTP {status}"
+
+
+class IcmpProbe:
+    """ICMP 探測（呼叫系統 ping，不需要 raw socket 權限）"""
+
+    def __init__(self, host: str):
+        self.host = host
+        self.name = f"icmp {host}"
+
+    def command(self, timeout: float) -> List[str]:
+        if sys.platform.startswith("win"):
+            return ["ping", "-n", "1", "-w", str(int(timeout * 1000)), self.host]
+        return ["ping", "-c", "1", "-W", str(max(1, math.ceil(timeout))), self.host]
+
+    def check(self, timeout: float) -> Tuple[bool, str]:
+        try:
+            result = subprocess.run(self.command(timeout), stdout=subprocess.DEVNULL,
+                                    stderr=subprocess.DEVNULL, timeout=timeout + 1)
+        except FileNotFoundError:
+            return False, "找不到 ping 指令"
+        except subprocess.TimeoutExpired:
+            return False, "ping 逾時"
+        return (True, "ping 成功") if result.returncode == 0 else (False, "ping 無回應")
+
+
+class _SessionExpired(RuntimeError):
+    """session token 已失效（逾時或被登出）"""
+
+
+# Zabbix 回傳的 session 失效訊息（error.data）
+_SESSION_ERROR_RE = re.compile(r"re-login|Not authori[sz]ed|Session terminated", re.IGNORECASE)
+
+
+class ZabbixClient:
+    """
+    Zabbix JSON-RPC 用戶端（api_jsonrpc.php）
+
+    Zabbix 6.4 以上以 Authorization: Bearer 標頭驗證，較舊版本則需要 JSON-RPC 的 auth 欄位，
+    因此第一次驗證呼叫前以 apiinfo.version 取得伺服器版本。
+    以帳號密碼登入的 session 逾時或被登出時，自動重新登入並重試一次。
+    """
+
+    def __init__(self, url: str, token: Optional[str] = None, username: Optional[str] = None,
+                 password: Optional[str] = None):
+        """
+        Args:
+            url: API 端點（如 https://zabbix.example.com/api_jsonrpc.php）
+            token: API token（Zabbix 5.4 以上）；未提供時以帳號密碼登入
+            username: 登入帳號
+            password: 登入密碼
+        """
+        self.url = url
+        self.token = token
+        self.username = username
+        self.password = password
+        self._lock = threading.Lock()
+        self._request_id = 0
+        self._host_ids: Dict[str, str] = {}
+        self._version: Optional[Tuple[int, int]] = None
+
+    @classmethod
+    def from_env(cls) -> Optional["ZabbixClient"]:
+        """從 ZABBIX_API_URL / ZABBIX_API_TOKEN / ZABBIX_USERNAME / ZABBIX_PASSWORD 建立；未設定時回傳 None"""
+        url = os.getenv("ZABBIX_API_URL")
+        if not url:
+            return None
+        return cls(url, os.getenv("ZABBIX_API_TOKEN"), os.getenv("ZABBIX_USERNAME"), os.getenv("ZABBIX_PASSWORD"))
+
+    def call(self, method: str, params: Any, timeout: float = 5.0, auth: bool = True) -> Any:
+        """
+        呼叫 API 方法
+
+        Raises:
+            RuntimeError: API 回傳錯誤
+            OSError: 無法連線
+        """
+        if not auth:
+            return self._request(method, params, timeout, None)
+        if self.token is None:
+            self.login(timeout)
+        try:
+            return self._request(method, params, timeout, self.token)
+        except _SessionExpired:
+            if not self.username:
+                raise
+        # session 逾時或被登出：重新登入後重試一次
+        self.token = None
+        self.login(timeout)
+        return self._request(method, params, timeout, self.token)
+
+    def _request(self, method: str, params: Any, timeout: float, token: Optional[str]) -> Any:
+        with self._lock:
+            self._request_id += 1
+            request_id = self._request_id
+        payload = {"jsonrpc": "2.0", "method": method, "params": params, "id": request_id}
+        headers = {"Content-Type": "application/json-rpc"}
+        if token is not None:
+            if self.version(timeout) < (6, 4):
+                payload["auth"] = token
+            else:
+                headers["Authorization"] = f"Bearer {token}"
+        request = urllib.request.Request(self.url, data=json.dumps(payload).encode("utf-8"), headers=headers)
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = json.loads(response.read())
+        if "error" in body:
+            error = body["error"]
+            message = f"Zabbix API 錯誤：{error.get('message')} {error.get('data', '')}".strip()
+            if token is not None and _SESSION_ERROR_RE.search(str(error.get("data", ""))):
+                raise _SessionExpired(message)
+            raise RuntimeError(message)
+        return body["result"]
+
+    def version(self, timeout: float = 5.0) -> Tuple[int, int]:
+        """伺服器 API 版本 (major, minor)（apiinfo.version 不需驗證；結果快取）"""
+        if self._version is None:
+            version = self._request("apiinfo.version", [], timeout, None)
+            self._version = tuple(int(part) for part in version.split(".")[:2])
+        return self._version
+
+    def login(self, timeout: float = 5.0):
+        """以帳號密碼取得 session token"""
+        if not self.username:
+            raise RuntimeError("未設定 ZABBIX_API_TOKEN 或 ZABBIX_USERNAME")
+        # Zabbix 5.4 將 user.login 的 user 參數更名為 username
+        name_field = "username" if self.version(timeout) >= (5, 4) else "user"
+        self.token = self.call("user.login", {name_field: self.username, "password": self.password},
+                               timeout=timeout, auth=False)
+
+    def host_id(self, host: str, timeout: float = 5.0) -> str:
+        """查詢主機 ID（結果快取）"""
+        if host not in self._host_ids:
+            hosts = self.call("host.get", {"output": ["hostid"], "filter": {"host": [host]}}, timeout)
+            if not hosts:
+                raise RuntimeError(f"Zabbix 中找不到主機 {host}")
+            self._host_ids[host] = hosts[0]["hostid"]
+        return self._host_ids[host]
+
+
+class ZabbixProbe:
+    """Zabbix 探測：主機沒有 min_severity 以上的未解決問題即為正常"""
+
+    def __init__(self, client: ZabbixClient, host: str, min_severity: int = 3):
+        self.client = client
+        self.host = host
+        self.min_severity = int(min_severity)
+        self.name = f"zabbix {host}"
+
+    def check(self, timeout: float) -> Tuple[bool, str]:
+        try:
+            problems = self.client.call("problem.get", {
+                "output": ["eventid", "name", "severity"],
+                "hostids": [self.client.host_id(self.host, timeout)],
+                "severities": list(range(self.min_severity, 6)),
+                "recent": False,
+            }, timeout)
+        except (RuntimeError, OSError, ValueError) as e:
+            return False, f"Zabbix 查詢失敗：{e}"
+        if problems:
+            names = "、".join(problem["name"] for problem in problems[:3])
+            return False, f"{len(problems)} 個未解決問題：{names}"
+        return True, "無未解決問題"
+
+
+def build_probe(spec: Dict[str, Any], zabbix: Optional[ZabbixClient] = None) -> Any:
+    """
+    依設定建立探測
+
+    Raises:
+        ValueError: 不支援的類型，或 zabbix 探測未設定 Zabbix API
+    """
+    kind = spec.get("type")
+    if kind == "tcp":
+        return TcpProbe(spec["host"], spec["port"])
+    if kind == "http":
+        return HttpProbe(spec["url"], spec.get("expect_status", 200))
+    if kind == "icmp":
+        return IcmpProbe(spec["host"])
+    if kind == "zabbix":
+        if zabbix is None:
+            raise ValueError("zabbix 探測需要設定 ZABBIX_API_URL")
+        return ZabbixProbe(zabbix, spec["host"], spec.get("min_severity", 3))
+    raise ValueError(f"不支援的探測類型：{kind}")
+
+
+# ---------------------------------------------------------------------------
+# 輪詢與快取
+# ---------------------------------------------------------------------------
+
+class HealthMonitor:
+    """
+    並行輪詢所有據點並快取結果
+
+    snapshot() 只讀取快取；更新由 refresh()（背景執行緒每 ttl 秒呼叫一次）完成。
+    """
+
+    def __init__(
+        self,
+        sites: Dict[str, List[Any]],
+        ttl: float = 60.0,
+        timeout: float = 3.0,
+        max_workers: int = 16,
+        clock: Callable[[], float] = time.time
+    ):
+        """
+        Args:
+            sites: 據點名稱 -> 探測列表（依顯示順序）
+            ttl: 快取有效時間，亦為背景更新間隔（秒）
+            timeout: 單一探測的逾時（秒）
+            max_workers: 同時執行的探測數上限
+            clock: 時間函數（記錄檢查時間）
+        """
+        self.sites = sites
+        self.ttl = ttl
+        self.timeout = timeout
+        self._clock = clock
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="site-health-probe")
+        self._lock = threading.Lock()
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, path: str, zabbix: Optional[ZabbixClient] = None, **kwargs) -> "HealthMonitor":
+        """
+        從 YAML 設定檔建立
+
+        Raises:
+            FileNotFoundError: 設定檔不存在
+            ValueError: 探測設定錯誤
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            config = yaml.safe_load(f) or {}
+        if zabbix is None:
+            zabbix = ZabbixClient.from_env()
+        sites = {
+            site["name"]: [build_probe(spec, zabbix) for spec in site.get("probes", [])]
+            for site in config.get("sites", [])
+        }
+        return cls(sites, **kwargs)
+
+    def _run_probe(self, probe: Any) -> Tuple[bool, str, float]:
+        start = time.perf_counter()
+        try:
+            ok, detail = probe.check(self.timeout)
+        except Exception as e:  # 探測本身的錯誤不應中斷其他據點
+            ok, detail = False, f"探測錯誤：{e}"
+        return ok, detail, (time.perf_counter() - start) * 1000
+
+    def refresh(self) -> Dict[str, Dict[str, Any]]:
+        """
+        同時執行所有據點的所有探測並更新快取
+
+        Returns:
+            據點名稱 -> {'status', 'checks', 'checked_at'}
+        """
+        futures = {
+            (name, index): self._executor.submit(self._run_probe, probe)
+            for name, probes in self.sites.items()
+            for index, probe in enumerate(probes)
+        }
+        # 探測各自受 timeout 限制；額外的等待上限避免異常的探測拖住整輪更新
+        wait(futures.values(), timeout=self.timeout + 2)
+        checked_at = self._clock()
+        results = {}
+        for name, probes in self.sites.items():
+            checks = []
+            for index, probe in enumerate(probes):
+                future = futures[(name, index)]
+                if future.done():
+                    ok, detail, latency_ms = future.result()
+                else:
+                    ok, detail, latency_ms = False, "逾時", (self.timeout + 2) * 1000
+                checks.append({'probe': probe.name, 'ok': ok, 'detail': detail, 'latency_ms': latency_ms})
+            results[name] = {'status': _site_status(checks), 'checks': checks, 'checked_at': checked_at}
+        with self._lock:
+            self._results = results
+        return results
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        取得快取的狀態（不會等待網路）
+
+        Returns:
+            據點名稱 -> {'status', 'checks', 'checked_at', 'stale'}；尚未檢查的據點為 unknown
+        """
+        now = self._clock()
+        with self._lock:
+            results = self._results
+        snapshot = {}
+        for name in self.sites:
+            result = results.get(name)
+            if result is None:
+                snapshot[name] = {'status': UNKNOWN, 'checks': [], 'checked_at': None, 'stale': True}
+            else:
+                snapshot[name] = dict(result, stale=now - result['checked_at'] > 2 * self.ttl)
+        return snapshot
+
+    def start(self) -> "HealthMonitor":
+        """啟動背景更新執行緒（立即執行第一輪）"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="site-health-poller", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.refresh()
+            self._stop.wait(max(0.0, self.ttl - (time.monotonic() - started)))
+
+    def stop(self):
+        """停止背景更新並關閉執行緒池"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.timeout + 5)
+        self._executor.shutdown(wait=False)
+
+
+def _site_status(checks: List[Dict[str, Any]]) -> str:
+    if not checks:
+        return UNKNOWN
+    passed = sum(1 for check in checks if check['ok'])
+    if passed == len(checks):
+        return UP
+    return DOWN if passed == 0 else DEGRADED
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """主程式入口：執行一輪檢查並輸出結果"""
+    parser = argparse.ArgumentParser(description="據點健康檢查")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(__file__), "sites.yaml"),
+                        help="據點設定檔")
+    parser.add_argument("--timeout", type=float, default=3.0, help="單一探測逾時（秒）")
+    args = parser.parse_args(argv)
+
+    try:
+        monitor = HealthMonitor.from_config(args.config, timeout=args.timeout)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"錯誤: {e}", file=sys.stderr)
+        return 1
+    start = time.perf_counter()
+    results = monitor.refresh()
+    monitor.stop()
+    for name, result in results.items():
+        print(f"{name}: {result['status']}")
+        for check in result['checks']:
+            mark = "✅" if check['ok'] else "❌"
+            print(f"  {mark} {check['probe']} - {check['detail']} ({check['latency_ms']:.0f} ms)")
+    print(f"（{time.perf_counter() - start:.2f}s）")
+    return 0 if all(result['status'] == UP for result in results.values()) else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
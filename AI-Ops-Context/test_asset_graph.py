@@ -0,0 +1,97 @@
+"""
+Tests for the asset dependency graph
+"""
+
+import os
+import time
+
+from asset_graph import AssetGraph, load_graph, parse_edges
+
+REGISTER = """
+## 資產依賴關係
+
+| 上游資產 | 下游資產/服務 | 依賴說明 |
+|--------|------------|--------|
+| Fortigate_60F | Core_Switch | 對外連線 |
+| Core_Switch | SQL_Server | 核心網路 |
+| SQL_Server | MWS_System、Video_System、ERP | 資料庫 |
+| _______ | _______ | _____________ |
+"""
+
+BIA = """
+| 項目 | 內容 |
+|------|------|
+| **流程名稱** | 出貨作業 |
+| **上游流程** | 訂單處理 |
+| **下游流程** | _________________________ |
+
+| IT系統名稱 | 支援業務流程 | 關鍵程度 |
+|-----------|-----------|--------|
+| ERP | 訂單處理、出貨作業 | ☐ 關鍵 ☐ 重要 |
+| _______ | _______ | ☐ 關鍵 ☐ 重要 |
+
+```mermaid
+graph LR
+    Video_System --> 門禁監控
+```
+"""
+
+
+def test_parse_edges_reads_tables_and_diagrams_and_skips_placeholders():
+    edges = parse_edges(REGISTER) | parse_edges(BIA)
+    assert edges == {
+        ('Fortigate_60F', 'Core_Switch'), ('Core_Switch', 'SQL_Server'),
+        ('SQL_Server', 'MWS_System'), ('SQL_Server', 'Video_System'), ('SQL_Server', 'ERP'),
+        ('訂單處理', '出貨作業'), ('ERP', '訂單處理'), ('ERP', '出貨作業'),
+        ('Video_System', '門禁監控'),
+    }
+
+
+def test_impact_and_dependency_queries():
+    graph = AssetGraph(parse_edges(REGISTER) | parse_edges(BIA))
+    assert graph.impacted('Core_Switch') == sorted(
+        ['SQL_Server', 'MWS_System', 'Video_System', 'ERP', '訂單處理', '出貨作業', '門禁監控'])
+    assert graph.dependencies('出貨作業') == sorted(
+        ['ERP', '訂單處理', 'SQL_Server', 'Core_Switch', 'Fortigate_60F'])
+    assert graph.impacted('門禁監控') == []
+    assert graph.impacted('unknown') == []
+
+
+def test_cycles_share_reachability():
+    graph = AssetGraph([('A', 'B'), ('B', 'C'), ('C', 'A'), ('C', 'D')])
+    assert graph.impacted('A') == ['B', 'C', 'D']
+    assert graph.impacted('B') == ['A', 'C', 'D']
+    assert graph.dependencies('D') == ['A', 'B', 'C']
+
+
+def test_subgraph_only_contains_related_assets():
+    graph = AssetGraph([('Core_Switch', 'SQL_Server'), ('SQL_Server', 'ERP'), ('NAS', 'Backup')])
+    dot = graph.subgraph_dot('SQL_Server')
+    assert '"Core_Switch" -> "SQL_Server"' in dot and '"SQL_Server" -> "ERP"' in dot
+    assert 'NAS' not in dot and 'Backup' not in dot
+    assert '"Core_Switch"' not in graph.subgraph_dot('SQL_Server', include_dependencies=False)
+
+
+def test_large_graph_queries_are_precomputed():
+    # 500 個資產的分層樹：建圖後查詢只讀位元集
+    edges = [(f'asset-{i // 3}', f'asset-{i}') for i in range(1, 500)]
+    graph = AssetGraph(edges)
+    assert len(graph.impacted('asset-0')) == 499
+    start = time.perf_counter()
+    for _ in range(100):
+        graph.dependencies('asset-499')
+    assert time.perf_counter() - start < 0.5
+
+
+def test_load_graph_rebuilds_when_sources_change(tmp_path):
+    record = tmp_path / '資產.md'
+    record.write_text(REGISTER, encoding='utf-8')
+    graph = load_graph([tmp_path])
+    assert load_graph([tmp_path]) is graph
+
+    record.write_text(REGISTER + '| ERP | 財務報表 | 報表 |\n', encoding='utf-8')
+    stat = record.stat()
+    os.utime(record, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    rebuilt = load_graph([tmp_path])
+    assert rebuilt is not graph
+    assert '財務報表' in rebuilt.impacted('Core_Switch')
@@ -0,0 +1,164 @@
+"""
+Tests for the dashboard job runner
+"""
+
+import subprocess
+import threading
+import time
+
+import pytest
+
+from jobs import (FAILED, SUCCEEDED, AssetChangeScanner, JobRunner, asset_scan_fingerprint, connect,
+                  monthly_backup_report)
+
+
+@pytest.fixture
+def runner(tmp_path):
+    runner = JobRunner(tmp_path / 'jobs.db')
+    yield runner
+    runner.close()
+
+
+def test_identical_in_flight_jobs_are_deduplicated(runner):
+    release = threading.Event()
+    calls = []
+
+    def slow(params, progress):
+        calls.append(params)
+        progress(0.5, '一半')
+        release.wait(5)
+        return {'value': params['n']}
+
+    runner.register('slow', slow)
+    first = runner.submit('slow', {'n': 1})
+    assert runner.submit('slow', {'n': 1}) == first
+    other = runner.submit('slow', {'n': 2})
+    assert other != first
+
+    deadline = time.monotonic() + 5
+    while runner.get(first)['progress'] < 0.5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert runner.get(first)['message'] == '一半'
+    release.set()
+    assert runner.wait(first)['result'] == {'value': 1}
+    assert runner.wait(other)['status'] == SUCCEEDED
+    assert len(calls) == 2
+
+
+def test_results_are_cached_until_fingerprint_changes(runner):
+    version = ['a']
+    calls = []
+    runner.register('report', lambda params, progress: calls.append(1) or len(calls),
+                    fingerprint=lambda params: version[0])
+    first = runner.wait(runner.submit('report'))
+    assert runner.submit('report') == first['id']
+    assert runner.wait(runner.submit('report', force=True))['result'] == 2
+    version[0] = 'b'
+    assert runner.wait(runner.submit('report'))['result'] == 3
+
+
+def test_failures_and_interrupted_jobs_are_recorded(tmp_path):
+    runner = JobRunner(tmp_path / 'jobs.db')
+    runner.register('broken', lambda params, progress: 1 / 0)
+    job = runner.wait(runner.submit('broken'))
+    assert job['status'] == FAILED and 'division' in job['error']
+    runner.close()
+
+    conn = connect(tmp_path / 'jobs.db')
+    with conn:
+        conn.execute("INSERT INTO jobs (id, kind, job_key, params, status, created_at) "
+                     "VALUES ('x', 'broken', 'broken:{}', '{}', 'running', 0)")
+    conn.close()
+    restarted = JobRunner(tmp_path / 'jobs.db')
+    assert restarted.get('x')['status'] == FAILED
+    restarted.close()
+
+
+def test_only_jobs_of_dead_processes_are_swept(tmp_path):
+    release = threading.Event()
+    dashboard = JobRunner(tmp_path / 'jobs.db')
+    dashboard.register('slow', lambda params, progress: release.wait(5))
+    live = dashboard.submit('slow')
+
+    conn = connect(tmp_path / 'jobs.db')
+    with conn:
+        conn.execute("INSERT INTO jobs (id, kind, job_key, params, status, created_at, owner_boot, owner_pid) "
+                     "SELECT 'dead', 'slow', 'slow:dead', '{}', 'running', 0, owner_boot, 2147483646 "
+                     "FROM jobs WHERE id = ?", (live,))
+    conn.close()
+
+    # 另一個程序（如 python jobs.py list）建立 runner 時不可中斷儀表板的工作
+    other = JobRunner(tmp_path / 'jobs.db')
+    assert other.get(live)['status'] in ('queued', 'running')
+    assert other.get('dead')['status'] == FAILED
+    other.close()
+
+    # 工作已被標記為失敗時，完成後不可改回成功
+    conn = connect(tmp_path / 'jobs.db')
+    with conn:
+        conn.execute("UPDATE jobs SET status = 'failed' WHERE id = ?", (live,))
+    conn.close()
+    release.set()
+    dashboard.close()
+    assert dashboard.get(live)['status'] == FAILED
+
+
+def test_monthly_backup_report_counts_checked_results(tmp_path):
+    month = tmp_path / '2026' / '01'
+    month.mkdir(parents=True)
+    (month / 'a.md').write_text('| DB | ☑ 成功 ☐ 失敗 |\n| ERP | ☐ 成功 ☑ 失敗 |\n| MWS | ■ 成功 ☐ 失敗 |\n',
+                                encoding='utf-8')
+    report = monthly_backup_report({'month': '2026-01'}, lambda *args: None, records=tmp_path)
+    assert (report['success'], report['failure']) == (2, 1)
+    assert '66.7%' in report['report']
+
+
+def git(repo, *args):
+    subprocess.run(['git', *args], cwd=repo, check=True, capture_output=True)
+
+
+def test_asset_scan_reads_only_new_commits(tmp_path, monkeypatch):
+    repo = tmp_path / 'repo'
+    (repo / 'assets').mkdir(parents=True)
+    git(repo, 'init', '-q')
+    git(repo, 'config', 'user.email', 'it@example.com')
+    git(repo, 'config', 'user.name', 'IT')
+    (repo / 'assets' / '清冊.md').write_text('v1', encoding='utf-8')
+    (repo / 'other.md').write_text('x', encoding='utf-8')
+    git(repo, 'add', '.')
+    git(repo, 'commit', '-q', '-m', 'init')
+
+    scanner = AssetChangeScanner(tmp_path / 'jobs.db', repo, paths=['assets'])
+    logs = []
+    original = scanner._log
+    monkeypatch.setattr(scanner, '_log', lambda *revs: logs.append(revs) or original(*revs))
+
+    first = scanner({}, lambda *args: None)
+    assert [(c['status'], c['path']) for c in first['changes']] == [('A', 'assets/清冊.md')]
+
+    (repo / 'assets' / '清冊.md').write_text('v2', encoding='utf-8')
+    git(repo, 'commit', '-q', '-am', 'update')
+    second = scanner({}, lambda *args: None)
+    assert second['new'] == 1
+    assert [c['status'] for c in second['changes']] == ['M', 'A']
+    assert logs[1][0] == f"{first['head']}..{second['head']}"
+
+    assert scanner({}, lambda *args: None)['new'] == 0
+    assert len(logs) == 2
+
+
+def test_asset_scan_fingerprint_changes_daily_with_the_same_head(tmp_path):
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    git(repo, 'init', '-q')
+    git(repo, 'config', 'user.email', 'it@example.com')
+    git(repo, 'config', 'user.name', 'IT')
+    git(repo, 'commit', '-q', '--allow-empty', '-m', 'init')
+
+    # HEAD 相同時同一天沿用結果，隔天重新計算 7 天視窗
+    noon = time.mktime((2026, 10, 19, 12, 0, 0, 0, 0, -1))
+    today = asset_scan_fingerprint({}, repo, clock=lambda: noon)
+    assert asset_scan_fingerprint({}, repo, clock=lambda: noon + 3600) == today
+    assert asset_scan_fingerprint({}, repo, clock=lambda: noon + 86400) != today
+    head = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo, check=True, capture_output=True, text=True)
+    assert today.startswith(head.stdout.strip())
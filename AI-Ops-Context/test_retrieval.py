@@ -0,0 +1,100 @@
+"""
+Tests for the runbook retrieval index
+"""
+
+import os
+
+from retrieval import IndexUpdater, RunbookIndex, build_index, format_context, split_sections, tokenize
+
+
+def write_tree(root):
+    (root / 'runbooks').mkdir()
+    (root / 'runbooks' / 'mws.md').write_text(
+        '# MWS 故障排除\n\n## 連線錯誤\n\nMWS 連線逾時時，先確認 VPN 通道與 port 8443。\n\n'
+        '```bash\n# 不是標題\ncurl -k https://mws.local:8443/health\n```\n\n'
+        '## 列印問題\n\n標籤印表機離線時重新啟動列印佇列。\n',
+        encoding='utf-8')
+    (root / 'runbooks' / 'erp.md').write_text(
+        '# ERP 備份\n\n每日 02:00 執行資料庫備份，失敗時檢查磁碟空間。\n', encoding='utf-8')
+    # 略過的目錄
+    (root / 'node_modules').mkdir()
+    (root / 'node_modules' / 'readme.md').write_text('# MWS 連線錯誤\n', encoding='utf-8')
+
+
+def test_tokenize_and_split_sections():
+    assert tokenize('MWS 連線錯誤 port-8443') == ['mws', '連線', '線錯', '錯誤', 'port-8443']
+    sections = split_sections('# A\n\ntext\n\n```\n# code\n```\n\n## B\n\nmore\n')
+    assert [(section['heading'], section['line']) for section in sections] == [('A', 1), ('A > B', 9)]
+    assert '# code' in sections[0]['text']
+
+
+def test_search_ranks_matching_sections(tmp_path):
+    write_tree(tmp_path)
+    index_dir = tmp_path / '.runbook_index'
+    stats = build_index([tmp_path], index_dir, base=tmp_path)
+    assert stats['files'] == 2 and stats['changed'] == 2
+
+    hits = RunbookIndex(index_dir).search('MWS 連線錯誤', k=2)
+    assert hits[0]['path'] == 'runbooks/mws.md'
+    assert hits[0]['heading'] == 'MWS 故障排除 > 連線錯誤' and hits[0]['line'] == 3
+    assert hits[0]['score'] > hits[1]['score'] > 0
+    assert '來源：runbooks/mws.md § MWS 故障排除 > 連線錯誤' in format_context(hits[:1])
+    assert RunbookIndex(index_dir).search('kubernetes') == []
+
+
+def test_rebuild_only_reprocesses_changed_files(tmp_path):
+    write_tree(tmp_path)
+    index_dir = tmp_path / '.runbook_index'
+    build_index([tmp_path], index_dir, base=tmp_path)
+    assert build_index([tmp_path], index_dir, base=tmp_path)['changed'] == 0
+
+    erp = tmp_path / 'runbooks' / 'erp.md'
+    erp.write_text('# ERP 備份\n\n備份失敗時檢查 NAS 掛載。\n', encoding='utf-8')
+    os.utime(erp, ns=(erp.stat().st_atime_ns, erp.stat().st_mtime_ns + 10 ** 9))
+    (tmp_path / 'runbooks' / 'mws.md').unlink()
+    stats = build_index([tmp_path], index_dir, base=tmp_path)
+    assert (stats['files'], stats['changed'], stats['removed']) == (1, 1, 1)
+
+    index = RunbookIndex(index_dir)
+    assert index.search('NAS')[0]['path'] == 'runbooks/erp.md'
+    assert index.search('MWS 連線') == []
+
+
+def test_old_generation_files_are_removed_while_reader_keeps_its_mmap(tmp_path):
+    write_tree(tmp_path)
+    index_dir = tmp_path / '.runbook_index'
+    build_index([tmp_path], index_dir, base=tmp_path)
+    reader = RunbookIndex(index_dir)
+    before = reader.search('MWS 連線錯誤')
+
+    (tmp_path / 'runbooks' / 'new.md').write_text('# VPN\n\nVPN 通道中斷時重新撥接。\n', encoding='utf-8')
+    build_index([tmp_path], index_dir, base=tmp_path)
+
+    generation = reader.generation + 1
+    if os.name != 'nt':  # Windows 無法刪除仍被 mmap 的檔案，留待下次建立
+        assert sorted(path.name for path in index_dir.glob('*.npy')) == [
+            f'docs-{generation}.npy', f'indptr-{generation}.npy', f'weights-{generation}.npy']
+    # 舊世代的檔案已刪除，既有讀取端仍以原本的 mmap 查詢
+    assert reader.search('MWS 連線錯誤') == before
+    assert RunbookIndex(index_dir).generation == generation
+
+
+def test_updater_builds_in_background_and_swaps_generations(tmp_path):
+    write_tree(tmp_path)
+    index_dir = tmp_path / '.runbook_index'
+    updater = IndexUpdater([tmp_path], index_dir, base=tmp_path, interval=3600)
+    # 尚未建立索引時不會在呼叫端建立
+    assert updater.current() is None and not index_dir.exists()
+
+    updater.start()
+    updater.stop()
+    first = updater.current()
+    assert first.search('MWS 連線錯誤')[0]['path'] == 'runbooks/mws.md'
+
+    # 沒有變更時沿用同一個索引；有變更時切換到新世代
+    updater.refresh()
+    assert updater.current() is first
+    (tmp_path / 'runbooks' / 'vpn.md').write_text('# VPN\n\nVPN 通道中斷時重新撥接。\n', encoding='utf-8')
+    updater.refresh()
+    assert updater.current().generation == first.generation + 1
+    assert updater.current().search('VPN 通道')[0]['path'] == 'runbooks/vpn.md'
@@ -0,0 +1,182 @@
+"""
+Tests for the site health poller (local stand-in endpoints only)
+"""
+
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from site_health import (
+    DEGRADED, DOWN, UNKNOWN, UP, HealthMonitor, HttpProbe, TcpProbe, ZabbixClient, ZabbixProbe, build_probe,
+)
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """/ok 回 200、/fail 回 503、/slow 延遲 2 秒；POST 模擬 Zabbix JSON-RPC"""
+
+    problems = []
+    calls = []
+    version = '7.0.0'
+    # 設為 True 時下一次驗證呼叫回傳 session 逾時
+    expire_session = False
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(2)
+        self.send_response(503 if self.path == '/fail' else 200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.calls.append((request['method'], self.headers.get('Authorization') or request.get('auth')))
+        authenticated = self.headers.get('Authorization') or 'auth' in request
+        if authenticated and StandInHandler.expire_session:
+            StandInHandler.expire_session = False
+            self._reply({'jsonrpc': '2.0', 'id': request['id'], 'error': {
+                'code': -32602, 'message': 'Invalid params.', 'data': 'Session terminated, re-login, please.'}})
+            return
+        if request['method'] == 'apiinfo.version':
+            result = self.version
+        elif request['method'] == 'user.login':
+            result = 'session-token' if 'username' in request['params'] else 'legacy-token'
+        elif request['method'] == 'host.get':
+            host = request['params']['filter']['host'][0]
+            result = [{'hostid': '10084'}] if host == 'HQ-Core' else []
+        else:
+            result = self.problems
+        self._reply({'jsonrpc': '2.0', 'result': result, 'id': request['id']})
+
+    def _reply(self, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    httpd.daemon_threads = True
+    StandInHandler.problems = []
+    StandInHandler.calls = []
+    StandInHandler.version = '7.0.0'
+    StandInHandler.expire_session = False
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_site_status_combines_probe_results(server):
+    port = int(server.rsplit(':', 1)[1])
+    monitor = HealthMonitor({
+        '總部': [TcpProbe('127.0.0.1', port), HttpProbe(server + '/ok')],
+        'ILC 倉庫': [HttpProbe(server + '/ok'), HttpProbe(server + '/fail')],
+        '據點 D': [TcpProbe('127.0.0.1', closed_port())],
+        '據點 E': [],
+    }, timeout=1)
+    try:
+        results = monitor.refresh()
+    finally:
+        monitor.stop()
+    assert [results[name]['status'] for name in results] == [UP, DEGRADED, DOWN, UNKNOWN]
+    assert results['ILC 倉庫']['checks'][1]['detail'] == 'HTTP 503'
+
+
+def test_sites_are_polled_concurrently_with_timeouts(server):
+    # 4 個據點各有一個 2 秒才回應的探測：逾時 0.5 秒，並行時整輪約 0.5 秒
+    monitor = HealthMonitor({f'site-{i}': [HttpProbe(server + '/slow')] for i in range(4)}, timeout=0.5)
+    try:
+        start = time.perf_counter()
+        results = monitor.refresh()
+        elapsed = time.perf_counter() - start
+    finally:
+        monitor.stop()
+    assert elapsed < 1.5
+    assert all(result['status'] == DOWN for result in results.values())
+
+
+def test_snapshot_never_waits_for_the_network(server):
+    monitor = HealthMonitor({'總部': [HttpProbe(server + '/slow')]}, ttl=60, timeout=3)
+    try:
+        monitor.start()
+        start = time.perf_counter()
+        snapshot = monitor.snapshot()
+        assert time.perf_counter() - start < 0.05
+        assert snapshot['總部']['status'] == UNKNOWN
+    finally:
+        monitor.stop()
+
+
+def test_snapshot_marks_stale_results():
+    now = [1000.0]
+    monitor = HealthMonitor({'總部': [TcpProbe('127.0.0.1', closed_port())]}, ttl=10, timeout=0.5,
+                            clock=lambda: now[0])
+    try:
+        monitor.refresh()
+        assert monitor.snapshot()['總部']['stale'] is False
+        now[0] += 21
+        assert monitor.snapshot()['總部']['stale'] is True
+    finally:
+        monitor.stop()
+
+
+def test_zabbix_probe_reports_open_problems(server):
+    client = ZabbixClient(server, username='Admin', password='zabbix')
+    probe = build_probe({'type': 'zabbix', 'host': 'HQ-Core'}, client)
+    assert probe.check(1) == (True, '無未解決問題')
+
+    StandInHandler.problems = [{'eventid': '1', 'name': 'SQL Server is down', 'severity': '4'}]
+    ok, detail = probe.check(1)
+    assert not ok and 'SQL Server is down' in detail
+
+    # 只查詢版本與登入一次、主機 ID 只查詢一次，之後以 Bearer token 呼叫
+    methods = [method for method, _ in StandInHandler.calls]
+    assert methods == ['apiinfo.version', 'user.login', 'host.get', 'problem.get', 'problem.get']
+    assert StandInHandler.calls[-1][1] == 'Bearer session-token'
+
+    missing = ZabbixProbe(client, 'unknown-host')
+    ok, detail = missing.check(1)
+    assert not ok and 'unknown-host' in detail
+
+
+def test_zabbix_client_supports_legacy_auth_and_relogs_in(server):
+    StandInHandler.version = '5.0.30'
+    client = ZabbixClient(server, username='Admin', password='zabbix')
+    assert client.call('problem.get', {}) == []
+    # 5.4 以前以 user 參數登入；6.4 以前 token 放在 JSON-RPC 的 auth 欄位
+    assert StandInHandler.calls[-1] == ('problem.get', 'legacy-token')
+
+    StandInHandler.calls.clear()
+    StandInHandler.expire_session = True
+    assert client.call('problem.get', {}) == []
+    assert [method for method, _ in StandInHandler.calls] == ['problem.get', 'user.login', 'problem.get']
+
+    # API token 無法重新登入，錯誤直接回報
+    token_client = ZabbixClient(server, token='api-token')
+    StandInHandler.expire_session = True
+    with pytest.raises(RuntimeError, match='re-login'):
+        token_client.call('problem.get', {})
+
+
+def test_build_probe_rejects_unknown_types():
+    with pytest.raises(ValueError):
+        build_probe({'type': 'snmp', 'host': '10.0.0.1'})
+    with pytest.raises(ValueError):
+        build_probe({'type': 'zabbix', 'host': 'HQ-Core'})
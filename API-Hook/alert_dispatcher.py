@@ -0,0 +1,368 @@
+"""
+Alert Dispatcher
+在獨立背景執行緒中發送警報，避免網路 I/O 阻塞 API 請求執行緒
+
+- 相同警報（alert_name、severity 與去重鍵）在 cooldown 期間內只發送一次（其餘計入 suppressed）
+- 短時間內的大量警報合併為一則摘要（digest）訊息
+- Webhook 重用 keep-alive 連線；Webhook 與 Email 各自以指數退避重試，一個通道失敗不會重送另一個通道
+- 重試仍失敗的批次連同失敗的通道寫入本地 spool 檔，於下次發送成功時只補送這些通道
+"""
+
+import json
+import os
+import queue
+import smtplib
+import threading
+import time
+import http.client
+from collections import OrderedDict
+from email.message import EmailMessage
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+import logging
+
+logger = logging.getLogger('api_hook.alerts')
+
+
+class WebhookClient:
+    """維持 keep-alive 連線的 Webhook 用戶端"""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        parts = urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        if parts.query:
+            self.path += '?' + parts.query
+        self.timeout = timeout
+        self._connection: Optional[http.client.HTTPConnection] = None
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self._connection is None:
+            connection_class = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+            self._connection = connection_class(self.host, self.port, timeout=self.timeout)
+        return self._connection
+
+    def post(self, payload: Dict[str, Any]):
+        """
+        以 JSON POST 發送內容
+
+        Raises:
+            OSError: 連線失敗或伺服器回應非 2xx
+        """
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        connection = self._connect()
+        try:
+            connection.request('POST', self.path, body=body, headers={
+                'Content-Type': 'application/json; charset=utf-8',
+                'Connection': 'keep-alive',
+            })
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            raise OSError(f"Webhook request failed: {e}") from e
+        if response.will_close:
+            self.close()
+        if not 200 <= response.status < 300:
+            raise OSError(f"Webhook responded {response.status}")
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class AlertDispatcher:
+    """
+    非阻塞警報派送器
+
+    submit() 只做去重判斷與放入佇列；發送、重試與 spool 皆由背景執行緒處理。
+    """
+
+    def __init__(
+        self,
+        webhook_url: Optional[str] = None,
+        email_recipients: Sequence[str] = (),
+        smtp_host: Optional[str] = None,
+        smtp_sender: str = 'api-hook@localhost',
+        spool_path: Optional[str] = None,
+        default_cooldown_seconds: float = 300,
+        batch_window_seconds: float = 2.0,
+        max_batch_size: int = 100,
+        max_queue_size: int = 10000,
+        max_retries: int = 4,
+        backoff_seconds: float = 0.5,
+        max_backoff_seconds: float = 30.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        初始化警報派送器
+
+        Args:
+            webhook_url: Webhook 位址（monitoring.alerting.webhook_url）
+            email_recipients: Email 收件者（需同時設定 smtp_host）
+            smtp_host: SMTP 伺服器（host 或 host:port）
+            smtp_sender: Email 寄件者
+            spool_path: 發送失敗時保存批次的 NDJSON 檔案路徑
+            default_cooldown_seconds: 未指定 cooldown 時的去重時間
+            batch_window_seconds: 收集同一批警報的等待時間
+            max_batch_size: 單一批次的警報上限
+            max_queue_size: 佇列上限（滿時丟棄新警報並計數）
+            max_retries: 單一批次的重試次數
+            backoff_seconds: 第一次重試的等待時間（之後倍增）
+            max_backoff_seconds: 重試等待時間上限
+            clock: 單調時鐘函數（測試時可替換）
+        """
+        self.webhook = WebhookClient(webhook_url) if webhook_url else None
+        self.email_recipients = list(email_recipients)
+        self.smtp_host = smtp_host
+        self.smtp_sender = smtp_sender
+        self.spool_path = spool_path
+        self.default_cooldown_seconds = default_cooldown_seconds
+        self.batch_window_seconds = batch_window_seconds
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._clock = clock
+        self._channels: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+        if self.webhook is not None:
+            self._channels['webhook'] = self.webhook.post
+        if smtp_host and self.email_recipients:
+            self._channels['email'] = self._send_email
+
+        self._queue: 'queue.Queue[Optional[Dict[str, Any]]]' = queue.Queue(maxsize=max_queue_size)
+        self._recent: 'OrderedDict[Tuple[str, str, str], float]' = OrderedDict()
+        self._max_recent = max_queue_size
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.counters = {
+            'submitted': 0, 'suppressed': 0, 'dropped': 0,
+            'sent': 0, 'batches': 0, 'spooled': 0, 'replayed': 0,
+        }
+        self._thread = threading.Thread(target=self._run, name='api-hook-alerts', daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, alerting: Dict[str, Any], **kwargs) -> Optional['AlertDispatcher']:
+        """
+        從 monitoring.alerting 設定建立派送器
+
+        Returns:
+            AlertDispatcher 實例；未啟用或未設定任何通道時回傳 None
+        """
+        if not alerting.get('enabled', False):
+            return None
+        if not alerting.get('webhook_url') and not alerting.get('smtp_host'):
+            return None
+        return cls(
+            webhook_url=alerting.get('webhook_url'),
+            email_recipients=alerting.get('email_recipients', []),
+            smtp_host=alerting.get('smtp_host'),
+            spool_path=alerting.get('spool_path'),
+            **kwargs
+        )
+
+    def submit(
+        self,
+        alert: Dict[str, Any],
+        cooldown_seconds: Optional[float] = None,
+        dedup_key: Optional[str] = None
+    ) -> bool:
+        """
+        提交警報（非阻塞）
+
+        Args:
+            alert: 警報內容（alert_name, message, severity, timestamp）
+            cooldown_seconds: 去重時間，預設使用 default_cooldown_seconds
+            dedup_key: 區分同名警報的鍵（如來源 IP 或端點）；訊息內容不參與去重
+
+        Returns:
+            是否已放入發送佇列（被去重或佇列已滿時回傳 False）
+        """
+        key = (alert.get('alert_name', ''), alert.get('severity', ''), dedup_key or '')
+        cooldown = self.default_cooldown_seconds if cooldown_seconds is None else cooldown_seconds
+        with self._lock:
+            now = self._clock()
+            self.counters['submitted'] += 1
+            # 清除最舊的過期去重紀錄，並限制紀錄數量（攤提 O(1)）
+            recent = self._recent
+            while recent:
+                oldest_key, expires = next(iter(recent.items()))
+                if expires > now and len(recent) <= self._max_recent:
+                    break
+                del recent[oldest_key]
+            expires = recent.get(key)
+            if expires is not None and expires > now:
+                self.counters['suppressed'] += 1
+                return False
+            try:
+                self._queue.put_nowait(alert)
+            except queue.Full:
+                self.counters['dropped'] += 1
+                return False
+            recent[key] = now + cooldown
+            recent.move_to_end(key)
+        return True
+
+    def _run(self):
+        self._replay_spool()
+        closing = False
+        while not closing:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.batch_window_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    alert = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if alert is None:
+                    closing = True
+                    break
+                batch.append(alert)
+            self._deliver(batch)
+            if self._stop.is_set():
+                break
+        # 停止重試後（close 逾時或佇列已滿）佇列中剩餘的警報不再發送，直接寫入 spool
+        remaining = []
+        while True:
+            try:
+                alert = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if alert is not None:
+                remaining.append(alert)
+        for start in range(0, len(remaining), self.max_batch_size):
+            self._spool(self._build_payload(remaining[start:start + self.max_batch_size]), list(self._channels))
+        if self.webhook is not None:
+            self.webhook.close()
+
+    @staticmethod
+    def _build_payload(batch: List[Dict[str, Any]]) -> Dict[str, Any]:
+        if len(batch) == 1:
+            alert = batch[0]
+            text = f"[{alert.get('severity')}] {alert.get('alert_name')}: {alert.get('message')}"
+        else:
+            counts: Dict[str, int] = {}
+            for alert in batch:
+                counts[alert.get('alert_name', '')] = counts.get(alert.get('alert_name', ''), 0) + 1
+            details = ', '.join(f"{name} x{count}" for name, count in counts.items())
+            text = f"{len(batch)} alerts: {details}"
+        return {'text': text, 'count': len(batch), 'alerts': batch}
+
+    def _send_email(self, payload: Dict[str, Any]):
+        message = EmailMessage()
+        message['Subject'] = f"[API Hook] {payload['text'][:120]}"
+        message['From'] = self.smtp_sender
+        message['To'] = ', '.join(self.email_recipients)
+        message.set_content(json.dumps(payload, ensure_ascii=False, indent=2))
+        with smtplib.SMTP(self.smtp_host, timeout=10) as smtp:
+            smtp.send_message(message)
+
+    def _send_with_retry(self, channel: str, payload: Dict[str, Any]) -> bool:
+        send = self._channels[channel]
+        delay = self.backoff_seconds
+        for attempt in range(self.max_retries + 1):
+            try:
+                send(payload)
+                return True
+            except OSError as e:
+                if attempt == self.max_retries:
+                    logger.error(f"Alert delivery to {channel} failed after {attempt + 1} attempts: {e}")
+                    return False
+                logger.warning(f"Alert delivery to {channel} failed ({e}), retrying in {delay:.1f}s")
+                if self._stop.wait(delay):
+                    return False
+                delay = min(delay * 2, self.max_backoff_seconds)
+        return False
+
+    def _deliver(self, batch: List[Dict[str, Any]]):
+        payload = self._build_payload(batch)
+        # 每個通道各自重試，已送達的通道不會因其他通道失敗而重送
+        failed = [channel for channel in self._channels if not self._send_with_retry(channel, payload)]
+        if not failed:
+            self.counters['sent'] += len(batch)
+            self.counters['batches'] += 1
+        else:
+            self._spool(payload, failed)
+        if len(failed) < len(self._channels):
+            self._replay_spool()
+
+    def _spool(self, payload: Dict[str, Any], channels: List[str]):
+        if not self.spool_path:
+            logger.error(f"Dropping {payload['count']} alerts undelivered to {', '.join(channels)} "
+                         f"(no spool configured)")
+            return
+        with open(self.spool_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(dict(payload, channels=channels), ensure_ascii=False) + '\n')
+        self.counters['spooled'] += payload['count']
+
+    def _replay_spool(self):
+        """補送 spool 檔中的批次；通道失敗後本輪不再嘗試該通道，未送達的通道保留於 spool"""
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return
+        with open(self.spool_path, 'r', encoding='utf-8') as f:
+            pending = [json.loads(line) for line in f if line.strip()]
+        unavailable = set()
+        remaining = []
+        for payload in pending:
+            # 未記錄通道的舊 spool 內容送往所有通道；已不再設定的通道直接略過
+            channels = [channel for channel in payload.pop('channels', self._channels)
+                        if channel in self._channels]
+            undelivered = []
+            for channel in channels:
+                if channel not in unavailable:
+                    try:
+                        self._channels[channel](payload)
+                        continue
+                    except OSError as e:
+                        logger.warning(f"Spool replay to {channel} paused: {e}")
+                        unavailable.add(channel)
+                undelivered.append(channel)
+            if undelivered:
+                remaining.append(dict(payload, channels=undelivered))
+                continue
+            self.counters['sent'] += payload['count']
+            self.counters['batches'] += 1
+            self.counters['replayed'] += payload['count']
+        if not remaining:
+            os.remove(self.spool_path)
+            return
+        tmp_path = self.spool_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for payload in remaining:
+                f.write(json.dumps(payload, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.spool_path)
+
+    def close(self, timeout: float = 10.0):
+        """
+        送出佇列中剩餘的警報並停止背景執行緒
+
+        Args:
+            timeout: 等待時間（秒）；逾時後停止重試，未送出的批次寫入 spool
+        """
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            # 佇列已滿且發送端仍在重試：不再等待，停止重試並將剩餘警報寫入 spool
+            self._stop.set()
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """取得派送統計"""
+        with self._lock:
+            stats = dict(self.counters)
+        stats['queued'] = self._queue.qsize()
+        return stats
@@ -0,0 +1,492 @@
+"""
+Sliding-Window Anomaly Engine
+以滑動視窗計數器評估 monitoring.alerting.rules 中的警報規則
+
+規則條件（condition）以簡易運算式撰寫，例如：
+    error_rate > 0.05
+    status_code == 401 AND attempts > 5
+    calls_per_minute > 1000
+
+可用變數：
+    單筆日誌：response_time_ms, status_code (= response_code), result,
+              endpoint, source_ip, user_id, method
+    端點視窗：calls_per_minute, error_rate, errors
+    來源 IP 視窗：attempts（401 次數）, ip_calls_per_minute
+"""
+
+import re
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+# 視窗欄位索引：呼叫數、錯誤數、401 次數
+_CALLS, _ERRORS, _UNAUTHORIZED = 0, 1, 2
+_FIELDS = 3
+
+# 依視窗來源分類的變數（用於決定 cooldown 的鍵）
+ENDPOINT_VARIABLES = frozenset({'calls_per_minute', 'error_rate', 'errors'})
+IP_VARIABLES = frozenset({'attempts', 'ip_calls_per_minute'})
+ENTRY_VARIABLES = frozenset({
+    'response_time_ms', 'status_code', 'response_code', 'result',
+    'endpoint', 'source_ip', 'user_id', 'method',
+})
+KNOWN_VARIABLES = ENDPOINT_VARIABLES | IP_VARIABLES | ENTRY_VARIABLES
+
+# 與 config.example.yaml 相同的預設規則
+DEFAULT_RULES = [
+    {
+        'name': 'High Error Rate',
+        'condition': 'error_rate > 0.05',
+        'severity': 'WARNING',
+        'cooldown_minutes': 15,
+    },
+    {
+        'name': 'Unauthorized Access Attempts',
+        'condition': 'status_code == 401 AND attempts > 5',
+        'severity': 'CRITICAL',
+        'cooldown_minutes': 5,
+    },
+    {
+        'name': 'Abnormal API Call Volume',
+        'condition': 'calls_per_minute > 1000',
+        'severity': 'WARNING',
+        'cooldown_minutes': 10,
+    },
+    {
+        'name': 'Slow Response Time',
+        'condition': 'response_time_ms > 5000',
+        'severity': 'WARNING',
+        'cooldown_minutes': 15,
+    },
+]
+
+
+# ---------------------------------------------------------------------------
+# 條件運算式編譯器
+# ---------------------------------------------------------------------------
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<number>\d+(?:\.\d+)?)
+      | (?P<string>'[^']*'|"[^"]*")
+      | (?P<op>==|!=|>=|<=|>|<|&&|\|\||!|\(|\))
+      | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    )
+""", re.VERBOSE)
+
+_KEYWORDS = {'and': 'AND', 'or': 'OR', 'not': 'NOT', '&&': 'AND', '||': 'OR', '!': 'NOT'}
+
+_COMPARATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+}
+
+
+def _tokenize(expression: str) -> List[Tuple[str, Any]]:
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = _TOKEN_RE.match(expression, pos)
+        if not match or match.end() == pos:
+            raise ValueError(f"無法解析的條件運算式: {expression!r} (位置 {pos})")
+        pos = match.end()
+        if match.group('number'):
+            text = match.group('number')
+            tokens.append(('value', float(text) if '.' in text else int(text)))
+        elif match.group('string'):
+            tokens.append(('value', match.group('string')[1:-1]))
+        elif match.group('op'):
+            op = match.group('op')
+            tokens.append(('keyword', _KEYWORDS[op]) if op in _KEYWORDS else ('op', op))
+        else:
+            name = match.group('name')
+            if name.lower() in _KEYWORDS:
+                tokens.append(('keyword', _KEYWORDS[name.lower()]))
+            elif name.lower() in ('true', 'false'):
+                tokens.append(('value', name.lower() == 'true'))
+            else:
+                tokens.append(('name', name))
+    return tokens
+
+
+class _Parser:
+    """遞迴下降剖析器，將 token 串列編譯為閉包"""
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.tokens = _tokenize(expression)
+        self.pos = 0
+        self.names = set()
+
+    def _peek(self) -> Optional[Tuple[str, Any]]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _take(self) -> Tuple[str, Any]:
+        token = self._peek()
+        if token is None:
+            raise ValueError(f"條件運算式不完整: {self.expression!r}")
+        self.pos += 1
+        return token
+
+    def parse(self) -> Callable[[Dict[str, Any]], bool]:
+        predicate = self._or()
+        if self._peek() is not None:
+            raise ValueError(f"條件運算式有多餘內容: {self.expression!r}")
+        return predicate
+
+    def _or(self):
+        terms = [self._and()]
+        while self._peek() == ('keyword', 'OR'):
+            self._take()
+            terms.append(self._and())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda ctx: any(term(ctx) for term in terms)
+
+    def _and(self):
+        terms = [self._not()]
+        while self._peek() == ('keyword', 'AND'):
+            self._take()
+            terms.append(self._not())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda ctx: all(term(ctx) for term in terms)
+
+    def _not(self):
+        if self._peek() == ('keyword', 'NOT'):
+            self._take()
+            inner = self._not()
+            return lambda ctx: not inner(ctx)
+        return self._comparison()
+
+    def _comparison(self):
+        if self._peek() == ('op', '('):
+            self._take()
+            inner = self._or()
+            if self._take() != ('op', ')'):
+                raise ValueError(f"條件運算式缺少右括號: {self.expression!r}")
+            return inner
+
+        left = self._operand()
+        token = self._peek()
+        if token is None or token[0] != 'op' or token[1] not in _COMPARATORS:
+            # 單一變數視為布林值
+            return lambda ctx: bool(left(ctx))
+        self._take()
+        compare = _COMPARATORS[token[1]]
+        right = self._operand()
+
+        def predicate(ctx):
+            try:
+                return compare(left(ctx), right(ctx))
+            except TypeError:
+                return False
+        return predicate
+
+    def _operand(self) -> Callable[[Dict[str, Any]], Any]:
+        kind, value = self._take()
+        if kind == 'value':
+            return lambda ctx: value
+        if kind == 'name':
+            if value not in KNOWN_VARIABLES:
+                raise ValueError(f"未知的條件變數 {value!r}: {self.expression!r}")
+            self.names.add(value)
+            return lambda ctx: ctx.get(value)
+        raise ValueError(f"條件運算式語法錯誤: {self.expression!r}")
+
+
+def compile_condition(expression: str) -> Tuple[Callable[[Dict[str, Any]], bool], frozenset]:
+    """
+    編譯規則條件字串
+
+    Args:
+        expression: 條件運算式（如 "status_code == 401 AND attempts > 5"）
+
+    Returns:
+        (判斷函數, 運算式使用到的變數集合)
+
+    Raises:
+        ValueError: 運算式語法錯誤或使用未知變數
+    """
+    parser = _Parser(expression)
+    predicate = parser.parse()
+    return predicate, frozenset(parser.names)
+
+
+# ---------------------------------------------------------------------------
+# 環形緩衝區計數器
+# ---------------------------------------------------------------------------
+
+class RingCounter:
+    """
+    固定桶數的滑動視窗計數器
+
+    每個桶涵蓋 bucket_seconds 秒，整體視窗為 size 個桶；
+    新增與查詢皆為 O(1)（推進時最多清除 size 個過期桶）。
+    """
+
+    __slots__ = ('_buckets', '_size', '_head', '_totals', 'last_seen', 'cooldowns')
+
+    def __init__(self, size: int):
+        self._buckets = [0] * (size * _FIELDS)
+        self._size = size
+        self._head = None
+        self._totals = [0] * _FIELDS
+        self.last_seen = 0.0
+        self.cooldowns = None  # 規則索引 -> 最近一次觸發時間
+
+    def _advance(self, tick: int):
+        head = self._head
+        if head is None:
+            self._head = tick
+            return
+        gap = tick - head
+        if gap <= 0:
+            return
+        if gap >= self._size:
+            self._buckets = [0] * (self._size * _FIELDS)
+            self._totals = [0] * _FIELDS
+        else:
+            buckets = self._buckets
+            totals = self._totals
+            for t in range(head + 1, tick + 1):
+                base = (t % self._size) * _FIELDS
+                for field in range(_FIELDS):
+                    totals[field] -= buckets[base + field]
+                    buckets[base + field] = 0
+        self._head = tick
+
+    def add(self, tick: int, calls: int, errors: int, unauthorized: int) -> List[int]:
+        """
+        於指定時間桶累加計數
+
+        Returns:
+            視窗內的 [呼叫數, 錯誤數, 401 次數]
+        """
+        if tick != self._head:
+            self._advance(tick)
+        base = (tick % self._size) * _FIELDS
+        buckets = self._buckets
+        totals = self._totals
+        buckets[base] += calls
+        buckets[base + _ERRORS] += errors
+        buckets[base + _UNAUTHORIZED] += unauthorized
+        totals[_CALLS] += calls
+        totals[_ERRORS] += errors
+        totals[_UNAUTHORIZED] += unauthorized
+        return totals
+
+    def totals(self, tick: int) -> Tuple[int, int, int]:
+        """取得視窗內的 (呼叫數, 錯誤數, 401 次數)"""
+        self._advance(tick)
+        return tuple(self._totals)
+
+
+class _KeyTable:
+    """以 LRU 順序保存各鍵的 RingCounter，並淘汰閒置或超量的鍵"""
+
+    # 每隔多少次存取檢查一次閒置鍵
+    _IDLE_CHECK_INTERVAL = 64
+
+    def __init__(self, size: int, max_keys: int, idle_seconds: float):
+        self._entries: 'OrderedDict[str, RingCounter]' = OrderedDict()
+        self._size = size
+        self.max_keys = max_keys
+        self.idle_seconds = idle_seconds
+        self.evictions = 0
+        self._accesses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str, now: float) -> RingCounter:
+        entries = self._entries
+        counter = entries.get(key)
+        if counter is None:
+            counter = entries[key] = RingCounter(self._size)
+            if len(entries) > self.max_keys:
+                entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            entries.move_to_end(key)
+        counter.last_seen = now
+        self._accesses += 1
+        if self._accesses % self._IDLE_CHECK_INTERVAL == 0:
+            self._evict_idle(now)
+        return counter
+
+    def _evict_idle(self, now: float):
+        # LRU 順序即最後存取順序：從最舊的鍵開始淘汰，遇到仍活躍的鍵即停止
+        entries = self._entries
+        while entries:
+            key, oldest = next(iter(entries.items()))
+            if now - oldest.last_seen <= self.idle_seconds:
+                break
+            del entries[key]
+            self.evictions += 1
+
+
+class AlertRule:
+    """已編譯的警報規則"""
+
+    __slots__ = ('name', 'condition', 'severity', 'cooldown_seconds', 'predicate', 'scope')
+
+    def __init__(self, name: str, condition: str, severity: str = 'WARNING',
+                 cooldown_minutes: float = 0):
+        self.name = name
+        self.condition = condition
+        self.severity = severity.upper()
+        self.cooldown_seconds = float(cooldown_minutes) * 60
+        self.predicate, names = compile_condition(condition)
+        # 規則使用 IP 視窗變數時，以來源 IP 計算 cooldown；否則以端點計算
+        self.scope = 'source_ip' if names & IP_VARIABLES else 'endpoint'
+
+    @classmethod
+    def from_config(cls, rule: Dict[str, Any]) -> 'AlertRule':
+        return cls(
+            name=rule['name'],
+            condition=rule['condition'],
+            severity=rule.get('severity', 'WARNING'),
+            cooldown_minutes=rule.get('cooldown_minutes', 0),
+        )
+
+
+class AnomalyEngine:
+    """
+    滑動視窗異常偵測引擎
+
+    依端點與來源 IP 維護環形緩衝區計數器，逐筆評估已編譯的警報規則，
+    並依各規則的 cooldown_minutes 抑制重複警報。
+    """
+
+    def __init__(
+        self,
+        rules: Optional[Sequence[Dict[str, Any]]] = None,
+        window_seconds: int = 60,
+        bucket_seconds: int = 5,
+        min_calls: int = 20,
+        max_keys: int = 100000,
+        clock: Callable[[], float] = time.monotonic,
+        shared: Optional[Any] = None
+    ):
+        """
+        初始化異常偵測引擎
+
+        Args:
+            rules: 規則設定列表（格式同 monitoring.alerting.rules），預設使用 DEFAULT_RULES
+            window_seconds: 滑動視窗長度（秒）
+            bucket_seconds: 每個計數桶的寬度（秒）
+            min_calls: 計算 error_rate 所需的最少呼叫數，避免少量樣本誤報
+            max_keys: 每張計數表（端點、來源 IP）保存的鍵數上限
+            clock: 單調時鐘函數（測試時可替換）
+            shared: 跨 worker 共用的 SharedCounters（3 個欄位，視窗同 window_seconds）；
+                    設定時視窗計數改由所有行程合計，本地計數表只保存 cooldown
+        """
+        if window_seconds % bucket_seconds:
+            raise ValueError("window_seconds 必須為 bucket_seconds 的整數倍")
+        self.rules = [AlertRule.from_config(rule) for rule in (rules if rules is not None else DEFAULT_RULES)]
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.min_calls = min_calls
+        self._clock = clock
+        self._per_minute = 60.0 / window_seconds
+        size = window_seconds // bucket_seconds
+        self.endpoints = _KeyTable(size, max_keys, window_seconds)
+        self.source_ips = _KeyTable(size, max_keys, window_seconds)
+        self.shared = shared
+        self._lock = threading.Lock()
+
+    def observe(self, log_entry: Dict[str, Any]) -> List[Tuple[AlertRule, str]]:
+        """
+        納入一筆日誌並評估所有規則
+
+        Args:
+            log_entry: 由 APIHook._create_log_entry 產生的日誌條目
+
+        Returns:
+            觸發的 (規則, 警報訊息) 列表（已套用 cooldown）
+        """
+        if not self.rules:
+            return []
+
+        get = log_entry.get
+        endpoint = get('endpoint', '')
+        source_ip = get('source_ip', '0.0.0.0')
+        status_code = get('response_code')
+        result = get('result')
+        is_error = 1 if result == 'error' else 0
+        is_unauthorized = 1 if status_code == 401 else 0
+
+        fired = []
+        with self._lock:
+            now = self._clock()
+            tick = int(now // self.bucket_seconds)
+
+            endpoint_window = self.endpoints.get(endpoint, now)
+            ip_window = self.source_ips.get(source_ip, now)
+            if self.shared is not None:
+                calls, errors, _ = self.shared.add('endpoint:' + endpoint, (1, is_error, is_unauthorized))
+                ip_calls, _, ip_unauthorized = self.shared.add('ip:' + source_ip, (1, is_error, is_unauthorized))
+            else:
+                calls, errors, _ = endpoint_window.add(tick, 1, is_error, is_unauthorized)
+                ip_calls, _, ip_unauthorized = ip_window.add(tick, 1, is_error, is_unauthorized)
+
+            context = {
+                'response_time_ms': get('response_time_ms', 0),
+                'status_code': status_code,
+                'response_code': status_code,
+                'result': result,
+                'endpoint': endpoint,
+                'source_ip': source_ip,
+                'user_id': get('user_id'),
+                'method': get('method'),
+                'calls_per_minute': calls * self._per_minute,
+                'error_rate': errors / calls if calls >= self.min_calls else 0.0,
+                'errors': errors,
+                'attempts': ip_unauthorized,
+                'ip_calls_per_minute': ip_calls * self._per_minute,
+            }
+
+            for index, rule in enumerate(self.rules):
+                if not rule.predicate(context):
+                    continue
+                window = ip_window if rule.scope == 'source_ip' else endpoint_window
+                if window.cooldowns is None:
+                    window.cooldowns = {}
+                last_fired = window.cooldowns.get(index)
+                if last_fired is not None and now - last_fired < rule.cooldown_seconds:
+                    continue
+                window.cooldowns[index] = now
+                fired.append((rule, self._format_message(rule, context)))
+
+        return fired
+
+    @staticmethod
+    def _format_message(rule: AlertRule, context: Dict[str, Any]) -> str:
+        if rule.scope == 'source_ip':
+            subject = f"from {context['source_ip']}"
+        else:
+            subject = f"on {context['endpoint']}"
+        return (
+            f"{rule.name} {subject} ({rule.condition}): "
+            f"calls_per_minute={context['calls_per_minute']:.0f}, "
+            f"error_rate={context['error_rate']:.2%}, "
+            f"attempts={context['attempts']:.0f}, "
+            f"response_time_ms={context['response_time_ms']}"
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """取得引擎狀態（追蹤中的鍵數與淘汰次數）"""
+        with self._lock:
+            return {
+                'tracked_endpoints': len(self.endpoints),
+                'tracked_source_ips': len(self.source_ips),
+                'evicted_keys': self.endpoints.evictions + self.source_ips.evictions,
+            }
@@ -20,6 +20,7 @@ class APIHook {
     this.config = this._loadConfig(options.configPath || 'config.yaml');
     this.sensitiveFields = this.config.security?.sensitive_fields || [];
     this.logs = [];
+    this.stats = { total: 0, success: 0, error: 0, totalResponseTime: 0 };
     console.log('API Hook initialized');
   }
 
@@ -107,6 +108,12 @@ class APIHook {
     console.log('API Log:', JSON.stringify(logEntry));
     this.logs.push(logEntry);
 
+    // 累計統計，避免 getStats 每次掃描整個日誌陣列
+    this.stats.total += 1;
+    if (logEntry.result === 'success') this.stats.success += 1;
+    if (logEntry.result === 'error') this.stats.error += 1;
+    this.stats.totalResponseTime += logEntry.response_time_ms || 0;
+
     // 實際實作範例：
     // if (this.config.logging.storage === 'database') {
     //   await this.db.insert('api_logs', logEntry);
@@ -274,19 +281,13 @@ class APIHook {
    * 取得統計資訊
    */
   getStats() {
-    const stats = {
-      total_logs: this.logs.length,
-      success_count: this.logs.filter(l => l.result === 'success').length,
-      error_count: this.logs.filter(l => l.result === 'error').length,
-      avg_response_time: 0
+    const { total, success, error, totalResponseTime } = this.stats;
+    return {
+      total_logs: total,
+      success_count: success,
+      error_count: error,
+      avg_response_time: total > 0 ? Math.round(totalResponseTime / total * 100) / 100 : 0
     };
-
-    if (this.logs.length > 0) {
-      const totalTime = this.logs.reduce((sum, log) => sum + (log.response_time_ms || 0), 0);
-      stats.avg_response_time = Math.round(totalTime / this.logs.length * 100) / 100;
-    }
-
-    return stats;
   }
 }
 
@@ -8,9 +8,20 @@ import time
 import hashlib
 import logging
 from datetime import datetime
-from typing import Dict, Any, Optional, Callable
+from typing import Dict, Any, Optional, Callable, Union
 from functools import wraps
-import uuid
+
+from anomaly_engine import AnomalyEngine, DEFAULT_RULES
+from rate_limiter import RateLimiter, RateLimitExceeded
+from alert_dispatcher import AlertDispatcher
+from metrics import MetricsRegistry, MetricsServer, PushGatewayThread
+from log_writer import FanoutSink, LogRecord, LogWriter, LoggerSink, SegmentFileSink, next_request_id
+from middleware import ASGIMiddleware, WSGIMiddleware
+from sampler import AdaptiveSampler
+from shared_state import SharedCounters, SharedRateLimiter
+from investigate import SegmentIndexer
+from wazuh_forwarder import WazuhForwarder
+from integrity import HashChain, load_signer
 
 # 配置日誌
 logging.basicConfig(
@@ -39,6 +50,55 @@ class APIHook:
             config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.yaml')
         self.config = self._load_config(config_path)
         self.sensitive_fields = self.config.get('security', {}).get('sensitive_fields', [])
+        alerting = self.config.get('monitoring', {}).get('alerting', {})
+        rules = alerting.get('rules', DEFAULT_RULES) if alerting.get('enabled', True) else []
+        performance = self.config.get('performance', {})
+        rate_limiting = self.config.get('security', {}).get('rate_limiting', {})
+        shared_state = performance.get('shared_state', {})
+        self.shared_counters = None
+        if shared_state.get('enabled', False):
+            # 多 worker 部署：所有行程共用同一組端點 / 來源 IP 視窗與速率限制計數
+            name = shared_state.get('name', 'api-hook')
+            slots = shared_state.get('slots', 8192)
+            self.shared_counters = SharedCounters(f'{name}-anomaly', fields=3, window_seconds=60, slots=slots)
+            self.rate_limiter = SharedRateLimiter.from_config(rate_limiting, name, slots=slots)
+        else:
+            self.rate_limiter = RateLimiter.from_config(rate_limiting)
+        self.anomaly_engine = AnomalyEngine(rules=rules, shared=self.shared_counters)
+        self.alert_dispatcher = AlertDispatcher.from_config(alerting)
+        monitoring = self.config.get('monitoring', {})
+        self.metrics = MetricsRegistry() if monitoring.get('enable_metrics', False) else None
+        logging_config = self.config.get('logging', {})
+        self.segment_indexer = None
+        if logging_config.get('storage') == 'file':
+            # 區段封存後於背景建立調查索引（investigate.py）；前次異常結束遺留的區段亦同
+            self.segment_indexer = SegmentIndexer()
+            sink = SegmentFileSink(
+                logging_config.get('file_path', '/var/log/api-hook/'),
+                max_segment_bytes=logging_config.get('max_file_size_mb', 100) * 1024 * 1024,
+                on_seal=[self.segment_indexer]
+            )
+            # 在遺留區段封存後建立，鏈值從其最後一筆接續
+            integrity = self.config.get('audit', {}).get('integrity', {})
+            if integrity.get('enabled', False):
+                sink.integrity = HashChain(
+                    sink.directory,
+                    signer=load_signer(integrity.get('signing'), integrity.get('key_path'))
+                )
+        else:
+            sink = LoggerSink()
+        self.wazuh = WazuhForwarder.from_config(self.config.get('integrations', {}).get('wazuh', {}))
+        if self.wazuh is not None:
+            sink = FanoutSink([sink, self.wazuh])
+        self.log_writer = LogWriter(
+            sink,
+            sanitize=self._sanitize_data,
+            max_queue_size=performance.get('max_log_queue_size', 10000),
+            batch_size=performance.get('batch_insert_size', 100),
+            flush_interval_seconds=performance.get('batch_flush_interval_seconds', 5),
+            asynchronous=performance.get('async_processing', True)
+        )
+        self.sampler = AdaptiveSampler.from_config(performance.get('sampling', {}))
         logger.info("API Hook initialized")
     
     def _load_config(self, config_path: str) -> Dict[str, Any]:
@@ -48,21 +108,79 @@ class APIHook:
             'security': {
                 'sensitive_fields': ['password', 'api_key', 'token', 'secret'],
                 'encrypt_sensitive_data': True,
-                'hash_algorithm': 'SHA256'
+                'hash_algorithm': 'SHA256',
+                'rate_limiting': {
+                    'enabled': True,
+                    'max_requests_per_minute': 1000,
+                    'max_requests_per_hour': 10000,
+                    'block_duration_seconds': 300
+                }
             },
             'logging': {
                 'level': 'INFO',
                 'storage': 'database'
             },
             'performance': {
-                'async_processing': True
+                'async_processing': True,
+                'max_log_queue_size': 10000,
+                'batch_insert_size': 100,
+                'batch_flush_interval_seconds': 5,
+                'sampling': {
+                    'enabled': False,
+                    'rates': {'low': 0.1},
+                    'target_entries_per_second': 100,
+                    'slow_threshold_ms': 1000
+                },
+                'shared_state': {
+                    'enabled': False,
+                    'name': 'api-hook',
+                    'slots': 8192
+                }
+            },
+            'endpoints': {
+                'monitored': [],
+                'excluded': ['/health', '/metrics', '/favicon.ico']
+            },
+            'monitoring': {
+                'enable_metrics': True,
+                'metrics_port': 9090,
+                'metrics_path': '/metrics',
+                'alerting': {
+                    'enabled': True,
+                    'rules': DEFAULT_RULES
+                }
+            },
+            'audit': {
+                'enabled': True,
+                'retention_years': 7,
+                'auto_archive': True,
+                'archive_format': 'parquet',
+                'archive_path': '/var/archive/api-hook/',
+                'integrity': {
+                    'enabled': True,
+                    'signing': None,
+                    'key_path': None
+                }
+            },
+            'integrations': {
+                'wazuh': {
+                    'enabled': False,
+                    'server': 'wazuh.example.com',
+                    'port': 1514,
+                    'protocol': 'tcp'
+                },
+                'prometheus': {
+                    'enabled': True,
+                    'push_gateway': 'http://prometheus:9091',
+                    'job_name': 'api-hook'
+                }
             }
         }
     
     def _sanitize_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """
         清理敏感資料
-        將敏感欄位替換為雜湊值或遮罩
+        將敏感欄位替換為雜湊值或遮罩（遞迴處理巢狀字典與清單，如中介層的 query）
         
         Args:
             data: 原始資料
@@ -70,14 +188,21 @@ class APIHook:
         Returns:
             清理後的資料
         """
-        sanitized = data.copy()
+        sanitized = {}
         
-        for field in self.sensitive_fields:
-            if field in sanitized:
+        for field, value in data.items():
+            if field in self.sensitive_fields:
                 # 使用雜湊值替代敏感資料
-                value = str(sanitized[field])
-                hash_value = hashlib.sha256(value.encode()).hexdigest()[:16]
+                hash_value = hashlib.sha256(str(value).encode()).hexdigest()[:16]
                 sanitized[field] = f"[REDACTED:{hash_value}]"
+            elif isinstance(value, dict):
+                sanitized[field] = self._sanitize_data(value)
+            elif isinstance(value, list):
+                sanitized[field] = [
+                    self._sanitize_data(item) if isinstance(item, dict) else item for item in value
+                ]
+            else:
+                sanitized[field] = value
         
         return sanitized
     
@@ -93,48 +218,28 @@ class APIHook:
         response_time_ms: float,
         result: str,
         error_message: Optional[str] = None
-    ) -> Dict[str, Any]:
+    ) -> LogRecord:
         """
         創建日誌條目
+        敏感資料清理與時間格式化延後至寫入時處理
         
         Returns:
-            格式化的日誌條目
+            日誌記錄（可用 to_dict() 取得格式化的日誌條目）
         """
-        return {
-            'timestamp': datetime.utcnow().isoformat() + 'Z',
-            'request_id': request_id,
-            'user_id': user_id,
-            'source_ip': source_ip,
-            'method': method,
-            'endpoint': endpoint,
-            'parameters': self._sanitize_data(parameters),
-            'response_code': response_code,
-            'response_time_ms': round(response_time_ms, 2),
-            'security_context': {
-                'authentication_method': 'OAuth2',
-                'authorization_level': 'User',
-                'session_id': request_id
-            },
-            'result': result,
-            'error_message': error_message
-        }
+        return LogRecord(
+            time.time(), request_id, user_id, source_ip, method, endpoint,
+            parameters, response_code, response_time_ms, result, error_message
+        )
     
-    def _save_log(self, log_entry: Dict[str, Any]):
+    def _save_log(self, log_entry: Union[LogRecord, Dict[str, Any]]):
         """
         儲存日誌
-        實際實作應根據配置寫入資料庫、檔案或 Elasticsearch
+        交由背景寫入器批次序列化並輸出，不在請求執行緒中做 JSON 序列化
         
         Args:
             log_entry: 日誌條目
         """
-        # 簡化實作：僅輸出到標準輸出
-        logger.info(f"API Log: {json.dumps(log_entry, ensure_ascii=False)}")
-        
-        # 實際實作範例：
-        # if self.config['logging']['storage'] == 'database':
-        #     self.db.insert('api_logs', log_entry)
-        # elif self.config['logging']['storage'] == 'elasticsearch':
-        #     self.es.index('api-logs', log_entry)
+        self.log_writer.submit(log_entry)
     
     def monitor(
         self,
@@ -155,6 +260,10 @@ class APIHook:
         Returns:
             裝飾器函數
             
+        Raises:
+            RateLimitExceeded: 來源超過 security.rate_limiting 限制（原始函數不會被執行）；
+                未傳入 source_ip 的呼叫不受速率限制
+            
         Example:
             @hook.monitor(endpoint="/api/v1/users", security_level="high")
             def create_user(request):
@@ -163,90 +272,143 @@ class APIHook:
         def decorator(func: Callable) -> Callable:
             @wraps(func)
             def wrapper(*args, **kwargs):
-                request_id = str(uuid.uuid4())
-                start_time = time.time()
+                start_time = time.perf_counter()
+                request_id = next_request_id()
                 
                 # 提取請求資訊（簡化，實際應從框架中提取）
                 user_id = kwargs.get('user_id', 'anonymous')
-                source_ip = kwargs.get('source_ip', '0.0.0.0')
+                source_ip = kwargs.get('source_ip')
                 method = kwargs.get('method', 'GET')
+                # **kwargs 本身即為此次呼叫專屬的字典，無需複製
                 parameters = kwargs if log_params else {}
                 
+                # 速率限制：超限的請求在執行原始函數前即被拒絕
+                # 未提供 source_ip 的呼叫無法識別來源，不套用速率限制（避免所有呼叫共用同一個計數）
+                if self.rate_limiter is not None and source_ip:
+                    try:
+                        self.rate_limiter.check(source_ip)
+                    except RateLimitExceeded as e:
+                        self._process_log_entry(LogRecord(
+                            time.time(), request_id, user_id, source_ip, method, endpoint, parameters,
+                            429, (time.perf_counter() - start_time) * 1000, 'blocked', str(e)
+                        ))
+                        raise
+                
+                if not source_ip:
+                    source_ip = '0.0.0.0'
+                
+                response_code = 200
+                status = 'success'
+                error_message = None
                 try:
                     # 執行原始函數
-                    result = func(*args, **kwargs)
-                    response_code = 200
-                    status = 'success'
-                    error_message = None
+                    return func(*args, **kwargs)
                     
                 except Exception as e:
-                    result = {'error': str(e)}
                     response_code = 500
                     status = 'error'
                     error_message = str(e)
-                    logger.error(f"API Error: {endpoint} - {str(e)}")
+                    logger.error(f"API Error: {endpoint} - {error_message}")
                     raise
                 
                 finally:
-                    # 計算執行時間
-                    response_time_ms = (time.time() - start_time) * 1000
-                    
-                    # 創建並儲存日誌
-                    log_entry = self._create_log_entry(
-                        request_id=request_id,
-                        user_id=user_id,
-                        source_ip=source_ip,
-                        method=method,
-                        endpoint=endpoint,
-                        parameters=parameters,
-                        response_code=response_code,
-                        response_time_ms=response_time_ms,
-                        result=status,
-                        error_message=error_message
-                    )
-                    
-                    self._save_log(log_entry)
-                    
-                    # 檢查異常行為
-                    self._check_anomalies(log_entry)
-                
-                return result
+                    # 計算執行時間（單調時鐘），並交由背景寫入器處理日誌
+                    self.record(LogRecord(
+                        time.time(), request_id, user_id, source_ip, method, endpoint, parameters,
+                        response_code, (time.perf_counter() - start_time) * 1000, status, error_message
+                    ), security_level)
             
             return wrapper
         return decorator
     
-    def _check_anomalies(self, log_entry: Dict[str, Any]):
+    def wsgi_middleware(self, app: Callable, **options) -> WSGIMiddleware:
         """
-        檢查異常行為
+        以 WSGI 中介層監控整個應用程式（Flask、Django 等）
         
         Args:
-            log_entry: 日誌條目
+            app: WSGI 應用程式
+            **options: 傳給 WSGIMiddleware 的選項（如 trusted_proxy_count）
+            
+        Returns:
+            包裝後的 WSGI 應用程式
+            
+        Example:
+            app.wsgi_app = hook.wsgi_middleware(app.wsgi_app)
         """
-        # 檢查回應時間
-        if log_entry['response_time_ms'] > 5000:
-            self._trigger_alert(
-                'Slow Response Time',
-                f"API {log_entry['endpoint']} took {log_entry['response_time_ms']}ms",
-                'WARNING'
-            )
+        return WSGIMiddleware(app, self, **options)
+    
+    def asgi_middleware(self, app: Callable, **options) -> ASGIMiddleware:
+        """
+        以 ASGI 中介層監控整個應用程式（FastAPI、Starlette 等）
+        
+        Args:
+            app: ASGI 應用程式
+            **options: 傳給 ASGIMiddleware 的選項（如 trusted_proxy_count）
+            
+        Returns:
+            包裝後的 ASGI 應用程式
+        """
+        return ASGIMiddleware(app, self, **options)
+    
+    def record(self, log_entry: LogRecord, security_level: str = 'medium'):
+        """
+        記錄一筆已完成的 API 呼叫（裝飾器與中介層共用）
         
-        # 檢查錯誤
-        if log_entry['result'] == 'error':
-            self._trigger_alert(
-                'API Error',
-                f"API {log_entry['endpoint']} failed: {log_entry['error_message']}",
-                'ERROR'
+        Args:
+            log_entry: 日誌記錄
+            security_level: 端點安全等級（決定取樣率）
+        """
+        # 尾端取樣：依安全等級與呼叫結果決定是否寫入日誌
+        if self.sampler is not None:
+            log_entry.sampling_weight = self.sampler.sample(
+                security_level, log_entry.response_code, log_entry.result, log_entry.response_time_ms
             )
+        self._process_log_entry(log_entry)
+    
+    def _process_log_entry(self, log_entry: LogRecord):
+        """
+        處理一筆 API 呼叫日誌：儲存、更新指標並檢查異常行為
+        被取樣捨棄的呼叫（sampling_weight 為 0）不寫入日誌，但仍計入指標與異常偵測
         
-        # 檢查未授權存取
-        if log_entry['response_code'] == 401:
-            self._trigger_alert(
-                'Unauthorized Access',
-                f"Unauthorized access attempt from {log_entry['source_ip']}",
-                'CRITICAL'
+        Args:
+            log_entry: 日誌條目
+        """
+        if log_entry.sampling_weight:
+            self._save_log(log_entry)
+        
+        if self.metrics is not None:
+            self.metrics.observe(
+                log_entry.endpoint,
+                log_entry.method,
+                log_entry.response_code,
+                log_entry.result,
+                log_entry.response_time_ms
             )
+        
+        self._check_anomalies(log_entry)
+    
+    def _check_anomalies(self, log_entry: Dict[str, Any]):
+        """
+        檢查異常行為
+        以滑動視窗評估 monitoring.alerting.rules 中的規則
+        
+        Args:
+            log_entry: 日誌條目
+        """
+        for rule, message in self.anomaly_engine.observe(log_entry):
+            subject = log_entry.get('source_ip') if rule.scope == 'source_ip' else log_entry.get('endpoint')
+            self._trigger_alert(rule.name, message, rule.severity,
+                                cooldown_minutes=rule.cooldown_seconds / 60,
+                                dedup_key=subject)
     
-    def _trigger_alert(self, alert_name: str, message: str, severity: str):
+    def _trigger_alert(
+        self,
+        alert_name: str,
+        message: str,
+        severity: str,
+        cooldown_minutes: Optional[float] = None,
+        dedup_key: Optional[str] = None
+    ):
         """
         觸發警報
         
@@ -254,6 +416,8 @@ class APIHook:
             alert_name: 警報名稱
             message: 警報訊息
             severity: 嚴重程度
+            cooldown_minutes: 相同警報的去重時間（預設: 派送器預設值）
+            dedup_key: 區分同名警報的鍵（如來源 IP 或端點）；訊息內容不參與去重
         """
         alert = {
             'timestamp': datetime.utcnow().isoformat() + 'Z',
@@ -264,9 +428,78 @@ class APIHook:
         
         logger.warning(f"ALERT: {json.dumps(alert, ensure_ascii=False)}")
         
-        # 實際實作：發送到警報系統、Email、Webhook 等
-        # self._send_webhook(alert)
-        # self._send_email(alert)
+        # 發送到 Webhook / Email（由背景執行緒處理，不阻塞請求）
+        if self.alert_dispatcher is not None:
+            self.alert_dispatcher.submit(
+                alert,
+                cooldown_seconds=None if cooldown_minutes is None else cooldown_minutes * 60,
+                dedup_key=dedup_key
+            )
+    
+    def start_metrics_server(self, port: Optional[int] = None) -> MetricsServer:
+        """
+        啟動 Prometheus /metrics 背景 HTTP 伺服器
+        
+        Args:
+            port: 監聽埠號（預設: monitoring.metrics_port）
+            
+        Returns:
+            已啟動的 MetricsServer
+        """
+        if self.metrics is None:
+            raise RuntimeError("monitoring.enable_metrics 未啟用")
+        monitoring = self.config.get('monitoring', {})
+        return MetricsServer(
+            self.metrics,
+            port=monitoring.get('metrics_port', 9090) if port is None else port,
+            path=monitoring.get('metrics_path', '/metrics')
+        ).start()
+    
+    def start_metrics_push(self, interval_seconds: float = 15) -> PushGatewayThread:
+        """
+        定期將指標推送至 integrations.prometheus.push_gateway
+        
+        Args:
+            interval_seconds: 推送間隔（秒）
+            
+        Returns:
+            已啟動的 PushGatewayThread
+        """
+        if self.metrics is None:
+            raise RuntimeError("monitoring.enable_metrics 未啟用")
+        prometheus = self.config.get('integrations', {}).get('prometheus', {})
+        return PushGatewayThread(
+            self.metrics,
+            prometheus['push_gateway'],
+            prometheus.get('job_name', 'api-hook'),
+            interval_seconds=interval_seconds
+        ).start()
+    
+    def get_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        取得各端點統計（呼叫數、錯誤數、平均 / p50 / p99 延遲）
+        
+        Returns:
+            以端點為鍵的統計字典
+        """
+        return self.metrics.summary() if self.metrics is not None else {}
+    
+    def flush(self):
+        """等待所有已提交的日誌寫入完成"""
+        self.log_writer.flush()
+    
+    def close(self):
+        """停止背景工作，寫出剩餘日誌並送出尚未處理的警報"""
+        self.log_writer.close()
+        if self.segment_indexer is not None:
+            self.segment_indexer.close()
+        if self.alert_dispatcher is not None:
+            self.alert_dispatcher.close()
+        # 只中斷連接；共享記憶體由部署端在所有 worker 結束後 unlink()
+        if self.shared_counters is not None:
+            self.shared_counters.close()
+        if isinstance(self.rate_limiter, SharedRateLimiter):
+            self.rate_limiter.close()
     
     def log_event(
         self,
@@ -300,9 +533,7 @@ class APIHook:
             'metadata': metadata or {}
         }
         
-        logger.info(f"Event: {json.dumps(event, ensure_ascii=False)}")
-        
-        # 儲存事件
+        # 儲存事件（由背景寫入器序列化一次）
         self._save_log(event)
         
         # 如果是嚴重事件，觸發警報
@@ -385,4 +616,5 @@ if __name__ == '__main__':
         }
     )
     
+    hook.close()
     print("\n=== API Hook 測試完成 ===")
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+Audit Log Archiver
+將封存的 NDJSON 日誌區段轉換為依日期分區、壓縮的 Parquet 欄式檔案
+
+- 目錄結構：<archive_path>/date=YYYY-MM-DD/<區段名稱>.parquet
+- 查詢時先依日期挑選分區，再只讀取需要的欄位並下推篩選條件（row group 統計）
+- 依 audit.retention_years 刪除過期分區
+
+需要安裝 pyarrow（pip install pyarrow）；僅執行 prune 時不需要。
+
+範例:
+  python audit_archive.py archive --source /var/log/api-hook --archive /var/archive/api-hook
+  python audit_archive.py query --archive /var/archive/api-hook --from 2026-01-01 --to 2026-01-31 \\
+      --source-ip 192.168.1.100 --columns timestamp,endpoint,response_code
+  python audit_archive.py prune --archive /var/archive/api-hook --retention-years 7
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+import logging
+
+from log_writer import sealed_segments
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - 視安裝環境而定
+    pa = None
+
+logger = logging.getLogger('api_hook.audit')
+
+PARTITION_PREFIX = 'date='
+MANIFEST_NAME = '_archived_segments.json'
+
+# 欄位順序與型別；parameters 與 extra 以 JSON 字串保存
+# event_type / severity / message 來自 hook.log_event() 的事件記錄，
+# 其餘不在欄位中的鍵（metadata、details、path 等）保存於 extra，歸檔不遺失內容
+COLUMNS = [
+    'timestamp', 'request_id', 'user_id', 'source_ip', 'method', 'endpoint', 'parameters',
+    'response_code', 'response_time_ms', 'result', 'error_message', 'sampling_weight',
+    'ttfb_ms', 'request_bytes', 'response_bytes', 'event_type', 'severity', 'message', 'extra',
+]
+FILTER_COLUMNS = ('user_id', 'source_ip', 'endpoint', 'result', 'event_type')
+_COLUMN_SET = frozenset(COLUMNS)
+# 由其他欄位即可還原的固定內容（session_id 即 request_id），不存入 extra
+_DERIVED_KEYS = frozenset(['security_context'])
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Parquet 歸檔需要安裝 pyarrow（pip install pyarrow）")
+
+
+def _schema() -> 'pa.Schema':
+    return pa.schema([
+        ('timestamp', pa.timestamp('us', tz='UTC')),
+        ('request_id', pa.string()),
+        ('user_id', pa.string()),
+        ('source_ip', pa.string()),
+        ('method', pa.string()),
+        ('endpoint', pa.string()),
+        ('parameters', pa.string()),
+        ('response_code', pa.int32()),
+        ('response_time_ms', pa.float64()),
+        ('result', pa.string()),
+        ('error_message', pa.string()),
+        ('sampling_weight', pa.float64()),
+        ('ttfb_ms', pa.float64()),
+        ('request_bytes', pa.int64()),
+        ('response_bytes', pa.int64()),
+        ('event_type', pa.string()),
+        ('severity', pa.string()),
+        ('message', pa.string()),
+        ('extra', pa.string()),
+    ])
+
+
+def _parse_timestamp(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def _parse_date(value: str) -> date:
+    return date.fromisoformat(value[:10])
+
+
+class AuditArchiver:
+    """日誌區段的 Parquet 歸檔、查詢與保存期限管理"""
+
+    def __init__(
+        self,
+        archive_path: str,
+        retention_years: int = 7,
+        compression: str = 'zstd',
+        row_group_size: int = 65536
+    ):
+        """
+        初始化歸檔器
+
+        Args:
+            archive_path: 歸檔根目錄（audit.archive_path）
+            retention_years: 保存年限（audit.retention_years）
+            compression: Parquet 壓縮演算法
+            row_group_size: 每個 row group 的最大筆數（影響篩選下推的粒度）
+        """
+        self.archive_path = archive_path
+        self.retention_years = retention_years
+        self.compression = compression
+        self.row_group_size = row_group_size
+
+    # ------------------------------------------------------------------
+    # 歸檔
+    # ------------------------------------------------------------------
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.archive_path, MANIFEST_NAME)
+
+    def _load_manifest(self) -> List[str]:
+        try:
+            with open(self._manifest_path(), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return []
+
+    def _save_manifest(self, names: Iterable[str]):
+        tmp_path = self._manifest_path() + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(sorted(names), f, ensure_ascii=False, indent=0)
+        os.replace(tmp_path, self._manifest_path())
+
+    def archive_segment(self, segment_path: str) -> Dict[str, int]:
+        """
+        將一個封存的 NDJSON 區段依日期拆分寫入 Parquet
+
+        Args:
+            segment_path: 區段檔路徑
+
+        Returns:
+            {日期字串: 筆數}
+        """
+        _require_pyarrow()
+        days: Dict[str, Dict[str, List[Any]]] = {}
+        with open(segment_path, 'rb') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    timestamp = _parse_timestamp(entry['timestamp'])
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"Skipping malformed line {line_number} in {segment_path}: {e}")
+                    continue
+                columns = days.setdefault(timestamp.date().isoformat(), {name: [] for name in COLUMNS})
+                for name in COLUMNS:
+                    value = entry.get(name)
+                    if name == 'timestamp':
+                        value = timestamp
+                    elif name == 'parameters':
+                        value = json.dumps(value, ensure_ascii=False, sort_keys=True) if value else None
+                    elif name == 'extra':
+                        extra = {key: item for key, item in entry.items()
+                                 if key not in _COLUMN_SET and key not in _DERIVED_KEYS}
+                        value = json.dumps(extra, ensure_ascii=False, sort_keys=True) if extra else None
+                    elif name == 'sampling_weight' and value is None:
+                        value = 1.0
+                    columns[name].append(value)
+
+        schema = _schema()
+        stem = os.path.basename(segment_path)
+        stem = stem[:-len('.ndjson')] if stem.endswith('.ndjson') else stem
+        counts = {}
+        for day, columns in sorted(days.items()):
+            partition = os.path.join(self.archive_path, PARTITION_PREFIX + day)
+            os.makedirs(partition, exist_ok=True)
+            table = pa.Table.from_pydict(columns, schema=schema).sort_by('timestamp')
+            target = os.path.join(partition, stem + '.parquet')
+            pq.write_table(
+                table, target + '.tmp',
+                compression=self.compression,
+                row_group_size=self.row_group_size,
+                use_dictionary=['user_id', 'source_ip', 'method', 'endpoint', 'result'],
+            )
+            os.replace(target + '.tmp', target)
+            counts[day] = table.num_rows
+        return counts
+
+    def archive_directory(self, source_dir: str) -> int:
+        """
+        歸檔目錄中所有尚未歸檔的封存區段
+
+        Args:
+            source_dir: 日誌區段目錄（logging.file_path）
+
+        Returns:
+            本次歸檔的區段數
+        """
+        _require_pyarrow()
+        os.makedirs(self.archive_path, exist_ok=True)
+        archived = set(self._load_manifest())
+        count = 0
+        for segment in sealed_segments(source_dir):
+            name = os.path.basename(segment)
+            if name in archived:
+                continue
+            rows = self.archive_segment(segment)
+            archived.add(name)
+            # 每個區段完成後即更新清單，中斷後重跑不會重複歸檔
+            self._save_manifest(archived)
+            count += 1
+            logger.info(f"Archived {name}: {sum(rows.values())} entries in {len(rows)} partitions")
+        return count
+
+    # ------------------------------------------------------------------
+    # 查詢
+    # ------------------------------------------------------------------
+
+    def partitions(self, start: Optional[date] = None, end: Optional[date] = None) -> List[str]:
+        """列出日期落在 [start, end] 內的分區目錄（依日期排序）"""
+        if not os.path.isdir(self.archive_path):
+            return []
+        selected = []
+        for name in sorted(os.listdir(self.archive_path)):
+            if not name.startswith(PARTITION_PREFIX):
+                continue
+            try:
+                day = date.fromisoformat(name[len(PARTITION_PREFIX):])
+            except ValueError:
+                continue
+            if (start is None or day >= start) and (end is None or day <= end):
+                selected.append(os.path.join(self.archive_path, name))
+        return selected
+
+    def query(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        columns: Optional[Sequence[str]] = None,
+        **filters: Optional[str]
+    ) -> 'pa.Table':
+        """
+        查詢歸檔日誌
+
+        只開啟時間範圍內的日期分區，並只讀取所需欄位；其餘篩選條件下推至
+        Parquet 讀取層，以 row group 統計略過不符合的資料。
+
+        Args:
+            start: 起始時間（含）
+            end: 結束時間（含）
+            columns: 要讀取的欄位（預設全部）
+            **filters: user_id, source_ip, endpoint, result 的等值條件
+
+        Returns:
+            依時間排序的 pyarrow.Table
+
+        Raises:
+            ValueError: 欄位或篩選條件名稱不存在
+        """
+        _require_pyarrow()
+        unknown = [name for name in list(columns or []) + list(filters) if name not in COLUMNS]
+        if unknown:
+            raise ValueError(f"未知的欄位: {', '.join(unknown)}")
+        # 日期分區以 UTC 日期命名：先換算為 UTC 再取日期（未帶時區的時間視為 UTC）
+        if start is not None:
+            start = start.replace(tzinfo=timezone.utc) if start.tzinfo is None else start.astimezone(timezone.utc)
+        if end is not None:
+            end = end.replace(tzinfo=timezone.utc) if end.tzinfo is None else end.astimezone(timezone.utc)
+
+        files = []
+        for partition in self.partitions(start.date() if start else None, end.date() if end else None):
+            files.extend(
+                os.path.join(partition, name) for name in sorted(os.listdir(partition))
+                if name.endswith('.parquet')
+            )
+        read_columns = list(columns) if columns else list(COLUMNS)
+        if 'timestamp' not in read_columns:
+            read_columns.append('timestamp')
+        if not files:
+            return _schema().empty_table().select(read_columns)
+
+        expression = None
+        conditions = [ds.field(name) == value for name, value in filters.items() if value is not None]
+        if start is not None:
+            conditions.append(ds.field('timestamp') >= pa.scalar(start, type=pa.timestamp('us', tz='UTC')))
+        if end is not None:
+            conditions.append(ds.field('timestamp') <= pa.scalar(end, type=pa.timestamp('us', tz='UTC')))
+        for condition in conditions:
+            expression = condition if expression is None else expression & condition
+
+        dataset = ds.dataset(files, schema=_schema(), format='parquet')
+        table = dataset.to_table(columns=read_columns, filter=expression)
+        return table.sort_by('timestamp')
+
+    # ------------------------------------------------------------------
+    # 保存期限
+    # ------------------------------------------------------------------
+
+    def prune(self, today: Optional[date] = None) -> List[str]:
+        """
+        刪除超過保存年限的日期分區
+
+        Args:
+            today: 基準日期（預設今天，UTC）
+
+        Returns:
+            已刪除的分區目錄
+        """
+        today = today or datetime.now(timezone.utc).date()
+        try:
+            cutoff = today.replace(year=today.year - self.retention_years)
+        except ValueError:  # 2/29 往前推到非閏年
+            cutoff = today.replace(year=today.year - self.retention_years, day=28)
+        removed = []
+        for partition in self.partitions(end=cutoff):
+            day = date.fromisoformat(os.path.basename(partition)[len(PARTITION_PREFIX):])
+            if day >= cutoff:
+                continue
+            shutil.rmtree(partition)
+            removed.append(partition)
+            logger.info(f"Pruned expired audit partition {partition}")
+        return removed
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """主程式入口"""
+    parser = argparse.ArgumentParser(description='API Hook 稽核日誌歸檔工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用指令')
+
+    archive_parser = subparsers.add_parser('archive', help='將封存的日誌區段轉換為 Parquet')
+    archive_parser.add_argument('--source', required=True, help='日誌區段目錄（logging.file_path）')
+    archive_parser.add_argument('--archive', required=True, help='歸檔目錄（audit.archive_path）')
+
+    query_parser = subparsers.add_parser('query', help='查詢歸檔日誌')
+    query_parser.add_argument('--archive', required=True, help='歸檔目錄')
+    query_parser.add_argument('--from', dest='start', help='起始時間 (YYYY-MM-DD 或 ISO 8601)')
+    query_parser.add_argument('--to', dest='end', help='結束時間 (YYYY-MM-DD 或 ISO 8601，日期表示含當日)')
+    for name in FILTER_COLUMNS:
+        query_parser.add_argument('--' + name.replace('_', '-'), dest=name, help=f'{name} 篩選')
+    query_parser.add_argument('--columns', help='以逗號分隔的輸出欄位')
+    query_parser.add_argument('--limit', type=int, default=0, help='最多輸出筆數（0 表示不限）')
+
+    prune_parser = subparsers.add_parser('prune', help='刪除超過保存年限的分區')
+    prune_parser.add_argument('--archive', required=True, help='歸檔目錄')
+    prune_parser.add_argument('--retention-years', type=int, default=7, help='保存年限')
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return 1
+
+    try:
+        if args.command == 'archive':
+            count = AuditArchiver(args.archive).archive_directory(args.source)
+            print(f"已歸檔 {count} 個區段")
+
+        elif args.command == 'query':
+            start = _parse_timestamp(args.start) if args.start else None
+            end = None
+            if args.end:
+                end = _parse_timestamp(args.end)
+                if len(args.end) == 10:
+                    end = end.replace(hour=23, minute=59, second=59, microsecond=999999)
+            columns = args.columns.split(',') if args.columns else None
+            filters = {name: getattr(args, name) for name in FILTER_COLUMNS}
+            table = AuditArchiver(args.archive).query(start, end, columns=columns, **filters)
+            if args.limit:
+                table = table.slice(0, args.limit)
+            for row in table.to_pylist():
+                print(json.dumps(row, ensure_ascii=False, default=str))
+
+        elif args.command == 'prune':
+            removed = AuditArchiver(args.archive, retention_years=args.retention_years).prune()
+            print(f"已刪除 {len(removed)} 個過期分區")
+
+    except (RuntimeError, ValueError, OSError) as e:
+        print(f"錯誤: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
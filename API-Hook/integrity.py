@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+Log Integrity Chain
+以 Merkle tree 與雜湊鏈保護日誌區段，使任何竄改都可被偵測並定位
+
+- 每次批次寫入：各行雜湊為葉節點，計算 Merkle root
+- root 與前一批的鏈值串接後再雜湊（跨區段延續），可選擇以 HMAC-SHA256 或 Ed25519 簽章
+- 簽章與鏈結每批只做一次；每個區段旁的 <segment>.chain（NDJSON）保存每批的紀錄
+- verify 指令平行驗證多個區段，並指出被修改、增加或刪除的行
+
+範例:
+  python integrity.py keygen --algorithm ed25519 --output /etc/api-hook/integrity.key
+  python integrity.py verify --logs /var/log/api-hook --public-key /etc/api-hook/integrity.pub
+  python integrity.py verify --logs /var/log/api-hook --hmac-key /etc/api-hook/integrity.key --workers 8
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import logging
+
+from log_writer import sealed_segments
+
+try:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+except ImportError:  # pragma: no cover - 視安裝環境而定
+    serialization = None
+
+logger = logging.getLogger('api_hook.integrity')
+
+CHAIN_SUFFIX = '.chain'
+GENESIS = '0' * 64
+# 每行在 .chain 中保存的雜湊前綴長度（位元組），僅用於定位被修改的行
+LEAF_PREFIX_BYTES = 8
+
+
+# ---------------------------------------------------------------------------
+# 雜湊
+# ---------------------------------------------------------------------------
+
+_sha256 = hashlib.sha256
+
+
+def leaf_hash(line: bytes) -> bytes:
+    return _sha256(b'\x00' + line).digest()
+
+
+def merkle_root(leaves: Sequence[bytes]) -> bytes:
+    """計算 Merkle root（葉與內部節點以不同前綴區分；奇數節點直接上提）"""
+    if not leaves:
+        return hashlib.sha256(b'').digest()
+    level = list(leaves)
+    while len(level) > 1:
+        paired = [_sha256(b'\x01' + level[i] + level[i + 1]).digest() for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            paired.append(level[-1])
+        level = paired
+    return level[0]
+
+
+def chain_hash(prev: str, segment: str, first_line: int, count: int, root: str) -> str:
+    """將批次 root 與前一個鏈值串接（區段名稱與行號一併納入，防止批次被搬移）"""
+    message = b''.join((
+        bytes.fromhex(prev),
+        segment.encode('utf-8'), b'\x00',
+        first_line.to_bytes(8, 'big'),
+        count.to_bytes(8, 'big'),
+        bytes.fromhex(root),
+    ))
+    return hashlib.sha256(message).hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# 簽章
+# ---------------------------------------------------------------------------
+
+class HmacSigner:
+    """HMAC-SHA256 簽章（簽章與驗證使用同一把金鑰）"""
+
+    algorithm = 'hmac-sha256'
+
+    def __init__(self, key: bytes):
+        if not key:
+            raise ValueError("HMAC 金鑰不可為空")
+        self.key = key
+
+    def sign(self, data: bytes) -> str:
+        return hmac.new(self.key, data, hashlib.sha256).hexdigest()
+
+    def verify(self, data: bytes, signature: str) -> bool:
+        return hmac.compare_digest(self.sign(data), signature)
+
+
+class Ed25519Signer:
+    """Ed25519 簽章（需安裝 cryptography）；僅提供公鑰時只能驗證"""
+
+    algorithm = 'ed25519'
+
+    def __init__(self, private_key: Optional['Ed25519PrivateKey'] = None,
+                 public_key: Optional['Ed25519PublicKey'] = None):
+        if serialization is None:
+            raise RuntimeError("Ed25519 簽章需要安裝 cryptography（pip install cryptography）")
+        self.private_key = private_key
+        self.public_key = public_key or (private_key.public_key() if private_key else None)
+
+    def sign(self, data: bytes) -> str:
+        if self.private_key is None:
+            raise RuntimeError("未提供 Ed25519 私鑰，無法簽章")
+        return self.private_key.sign(data).hex()
+
+    def verify(self, data: bytes, signature: str) -> bool:
+        try:
+            self.public_key.verify(bytes.fromhex(signature), data)
+            return True
+        except Exception:
+            return False
+
+
+def load_signer(algorithm: Optional[str], key_path: Optional[str] = None,
+                public_key_path: Optional[str] = None) -> Optional[Any]:
+    """
+    依設定建立簽章器
+
+    Args:
+        algorithm: hmac、ed25519 或 None（不簽章）
+        key_path: HMAC 金鑰或 Ed25519 私鑰（PEM）檔案
+        public_key_path: Ed25519 公鑰（PEM）檔案，僅驗證時使用
+
+    Raises:
+        ValueError: 不支援的演算法或缺少金鑰
+    """
+    if not algorithm:
+        return None
+    if algorithm == 'hmac':
+        if not key_path:
+            raise ValueError("HMAC 簽章需要 key_path")
+        with open(key_path, 'rb') as f:
+            return HmacSigner(f.read().strip())
+    if algorithm == 'ed25519':
+        if serialization is None:
+            raise RuntimeError("Ed25519 簽章需要安裝 cryptography（pip install cryptography）")
+        if key_path:
+            with open(key_path, 'rb') as f:
+                return Ed25519Signer(private_key=serialization.load_pem_private_key(f.read(), password=None))
+        if public_key_path:
+            with open(public_key_path, 'rb') as f:
+                return Ed25519Signer(public_key=serialization.load_pem_public_key(f.read()))
+        raise ValueError("Ed25519 簽章需要 key_path 或 public_key_path")
+    raise ValueError(f"不支援的簽章演算法: {algorithm}")
+
+
+# ---------------------------------------------------------------------------
+# 寫入端
+# ---------------------------------------------------------------------------
+
+def chain_path(segment_path: str) -> str:
+    return segment_path + CHAIN_SUFFIX
+
+
+def _last_record(path: str) -> Optional[Dict[str, Any]]:
+    last = None
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    last = line
+    except OSError:
+        return None
+    return json.loads(last) if last else None
+
+
+class HashChain:
+    """
+    為 SegmentFileSink 的每次批次寫入產生 Merkle root 與鏈結紀錄
+
+    以 sink.integrity = HashChain(directory, signer) 掛上後，
+    write_batch() 每批呼叫一次 append()，區段封存時呼叫 end_segment()。
+    """
+
+    def __init__(self, directory: str, signer: Optional[Any] = None):
+        """
+        初始化雜湊鏈
+
+        Args:
+            directory: 日誌區段目錄；從最後一個封存區段的鏈值接續
+            signer: HmacSigner、Ed25519Signer 或 None
+        """
+        self.signer = signer
+        self.prev = GENESIS
+        self.prev_segment: Optional[str] = None
+        self._file = None
+        self._segment: Optional[str] = None
+        self._next_line = 0
+        for segment in reversed(sealed_segments(directory)):
+            record = _last_record(chain_path(segment))
+            if record is not None:
+                self.prev = record['chain']
+                self.prev_segment = record['segment']
+                break
+
+    def append(self, segment_path: str, lines: List[bytes]) -> Dict[str, Any]:
+        """
+        記錄一批寫入的行
+
+        Args:
+            segment_path: 封存後的區段路徑（不含 .open）
+            lines: 本批寫入的行（不含換行）
+
+        Returns:
+            寫入 .chain 的紀錄
+        """
+        segment = os.path.basename(segment_path)
+        if segment != self._segment:
+            self.end_segment()
+            self._segment = segment
+            self._next_line = 0
+            self._file = open(chain_path(segment_path), 'ab')
+
+        leaves = [leaf_hash(line) for line in lines]
+        root = merkle_root(leaves).hex()
+        chain = chain_hash(self.prev, segment, self._next_line, len(lines), root)
+        record = {
+            'segment': segment,
+            'first_line': self._next_line,
+            'count': len(lines),
+            'root': root,
+            'prev': self.prev,
+            'chain': chain,
+            'leaves': b''.join([leaf[:LEAF_PREFIX_BYTES] for leaf in leaves]).hex(),
+        }
+        if self._next_line == 0:
+            record['prev_segment'] = self.prev_segment
+        if self.signer is not None:
+            record['alg'] = self.signer.algorithm
+            record['sig'] = self.signer.sign(bytes.fromhex(chain))
+        self._file.write(json.dumps(record, separators=(',', ':')).encode('utf-8') + b'\n')
+        self._file.flush()
+        self.prev = chain
+        self._next_line += len(lines)
+        return record
+
+    def end_segment(self):
+        """結束目前區段的 .chain 檔；下一批將連結到此區段的最後鏈值"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.prev_segment = self._segment
+        self._segment = None
+
+
+# ---------------------------------------------------------------------------
+# 驗證
+# ---------------------------------------------------------------------------
+
+def verify_segment(segment_path: str, signer: Optional[Any] = None) -> Dict[str, Any]:
+    """
+    驗證單一區段
+
+    Args:
+        segment_path: 區段檔路徑
+        signer: 用於驗證簽章的簽章器；None 表示不檢查簽章
+
+    Returns:
+        {'segment', 'errors', 'lines', 'batches', 'first_prev', 'prev_segment', 'last_chain'}
+    """
+    segment = os.path.basename(segment_path)
+    result: Dict[str, Any] = {
+        'segment': segment, 'errors': [], 'lines': 0, 'batches': 0,
+        'first_prev': None, 'prev_segment': None, 'last_chain': None,
+    }
+    errors = result['errors']
+    with open(segment_path, 'rb') as f:
+        lines = f.read().split(b'\n')
+    if lines and lines[-1] == b'':
+        lines.pop()
+    result['lines'] = len(lines)
+
+    try:
+        with open(chain_path(segment_path), 'rb') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    except OSError:
+        errors.append(f"{segment}: 缺少 {CHAIN_SUFFIX} 檔")
+        return result
+    except ValueError as e:
+        errors.append(f"{segment}: {CHAIN_SUFFIX} 檔格式錯誤 ({e})")
+        return result
+    if not records:
+        errors.append(f"{segment}: {CHAIN_SUFFIX} 檔沒有紀錄")
+        return result
+
+    result['first_prev'] = records[0]['prev']
+    result['prev_segment'] = records[0].get('prev_segment')
+    prev = records[0]['prev']
+    expected_line = 0
+    for record in records:
+        result['batches'] += 1
+        first, count = record['first_line'], record['count']
+        if record['segment'] != segment or first != expected_line:
+            errors.append(f"{segment}: 第 {first + 1} 行起的批次紀錄不連續")
+        if record['prev'] != prev:
+            errors.append(f"{segment}: 第 {first + 1} 行起的批次鏈結中斷")
+        batch = lines[first:first + count]
+        leaves = [leaf_hash(line) for line in batch]
+        if len(batch) != count:
+            errors.append(f"{segment}: 第 {first + len(batch) + 1}–{first + count} 行已被刪除")
+        elif merkle_root(leaves).hex() != record['root']:
+            stored = record.get('leaves', '')
+            width = LEAF_PREFIX_BYTES * 2
+            modified = [
+                first + i + 1 for i, leaf in enumerate(leaves)
+                if leaf[:LEAF_PREFIX_BYTES].hex() != stored[i * width:(i + 1) * width]
+            ]
+            where = ', '.join(str(n) for n in modified[:20]) if modified else f"{first + 1}–{first + count}"
+            errors.append(f"{segment}: 第 {where} 行已被修改")
+        if chain_hash(record['prev'], record['segment'], first, count, record['root']) != record['chain']:
+            errors.append(f"{segment}: 第 {first + 1} 行起的批次鏈值不符")
+        if signer is not None:
+            if record.get('alg') != signer.algorithm or not signer.verify(bytes.fromhex(record['chain']),
+                                                                          record.get('sig', '')):
+                errors.append(f"{segment}: 第 {first + 1} 行起的批次簽章無效")
+        prev = record['chain']
+        expected_line = first + count
+    if expected_line < len(lines):
+        errors.append(f"{segment}: 第 {expected_line + 1}–{len(lines)} 行未受保護（事後附加）")
+    result['last_chain'] = prev
+    return result
+
+
+def _verify_worker(args: Tuple[str, Optional[str], Optional[str], Optional[str]]) -> Dict[str, Any]:
+    segment_path, algorithm, key_path, public_key_path = args
+    signer = load_signer(algorithm, key_path, public_key_path) if algorithm else None
+    return verify_segment(segment_path, signer)
+
+
+def verify_directory(
+    log_dir: str,
+    algorithm: Optional[str] = None,
+    key_path: Optional[str] = None,
+    public_key_path: Optional[str] = None,
+    workers: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    平行驗證目錄中所有封存區段，並檢查區段之間的鏈結
+
+    Args:
+        log_dir: 日誌區段目錄
+        algorithm: 簽章演算法（hmac / ed25519 / None）
+        key_path: HMAC 金鑰檔（或 Ed25519 私鑰）
+        public_key_path: Ed25519 公鑰檔
+        workers: 平行處理的行程數（預設 CPU 數；1 表示在目前行程中執行）
+
+    Returns:
+        {'segments', 'lines', 'batches', 'errors'}
+    """
+    segments = sealed_segments(log_dir)
+    jobs = [(segment, algorithm, key_path, public_key_path) for segment in segments]
+    if workers == 1 or len(jobs) <= 1:
+        results = [_verify_worker(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_verify_worker, jobs, chunksize=max(1, len(jobs) // 64)))
+
+    errors: List[str] = []
+    last_chain = {result['segment']: result['last_chain'] for result in results}
+    for result in results:
+        errors.extend(result['errors'])
+        prev_segment = result['prev_segment']
+        if prev_segment is None:
+            if result['first_prev'] not in (None, GENESIS):
+                errors.append(f"{result['segment']}: 缺少前一個區段的紀錄")
+        elif prev_segment not in last_chain:
+            errors.append(f"{result['segment']}: 前一個區段 {prev_segment} 已遺失")
+        elif last_chain[prev_segment] != result['first_prev']:
+            errors.append(f"{result['segment']}: 與前一個區段 {prev_segment} 的鏈結不符")
+    return {
+        'segments': len(results),
+        'lines': sum(result['lines'] for result in results),
+        'batches': sum(result['batches'] for result in results),
+        'errors': errors,
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """主程式入口"""
+    parser = argparse.ArgumentParser(description='API Hook 日誌完整性工具')
+    subparsers = parser.add_subparsers(dest='command', help='可用指令')
+
+    verify_parser = subparsers.add_parser('verify', help='驗證日誌區段的雜湊鏈與簽章')
+    verify_parser.add_argument('--logs', required=True, help='日誌區段目錄（logging.file_path）')
+    verify_parser.add_argument('--hmac-key', help='HMAC 金鑰檔')
+    verify_parser.add_argument('--public-key', help='Ed25519 公鑰檔（PEM）')
+    verify_parser.add_argument('--workers', type=int, help='平行處理的行程數（預設 CPU 數）')
+
+    keygen_parser = subparsers.add_parser('keygen', help='產生簽章金鑰')
+    keygen_parser.add_argument('--algorithm', choices=['hmac', 'ed25519'], default='ed25519')
+    keygen_parser.add_argument('--output', required=True, help='金鑰檔路徑（Ed25519 另產生 .pub 公鑰）')
+
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.print_help()
+        return 1
+
+    try:
+        if args.command == 'verify':
+            algorithm, key_path = None, None
+            if args.hmac_key:
+                algorithm, key_path = 'hmac', args.hmac_key
+            elif args.public_key:
+                algorithm = 'ed25519'
+            report = verify_directory(args.logs, algorithm, key_path, args.public_key, args.workers)
+            for error in report['errors']:
+                print(f"❌ {error}")
+            status = '✅ 驗證通過' if not report['errors'] else f"發現 {len(report['errors'])} 個問題"
+            print(f"{status}：{report['segments']} 個區段、{report['batches']} 批、{report['lines']} 行")
+            return 0 if not report['errors'] else 2
+
+        if args.command == 'keygen':
+            fd = os.open(args.output, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                if args.algorithm == 'hmac':
+                    f.write(os.urandom(32).hex().encode('ascii'))
+                else:
+                    if serialization is None:
+                        raise RuntimeError("Ed25519 需要安裝 cryptography（pip install cryptography）")
+                    key = Ed25519PrivateKey.generate()
+                    f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                              serialization.NoEncryption()))
+                    with open(args.output + '.pub', 'wb') as pub:
+                        pub.write(key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                                serialization.PublicFormat.SubjectPublicKeyInfo))
+            print(f"已產生金鑰: {args.output}")
+
+    except (RuntimeError, ValueError, OSError) as e:
+        print(f"錯誤: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
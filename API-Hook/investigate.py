@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+"""
+Investigation Index
+事件調查用的日誌區段索引與查詢工具
+
+每個封存的日誌區段旁產生一個 .idx 索引檔：第一行為 JSON 標頭，其後為 Bloom filter 位元。
+- source_ip、user_id、request_id 各一個 Bloom filter，用來略過不含目標值的區段
+- 稀疏時間索引：每 block_lines 行記錄一次位移與該區塊的最小 / 最大時間
+  （時間一律轉為 UTC 的固定寬度字串，不同格式或時區的 timestamp 也能正確比較）
+
+查詢時先以時間範圍與 Bloom filter 排除區段（只讀取 Bloom filter 中需要的幾個位元組），
+再只讀取時間範圍內的區塊。
+寫入中（.open）或尚未建立索引的區段則完整掃描。
+
+範例:
+  python investigate.py --logs /var/log/api-hook --source-ip 192.168.1.100 --from 2026-01-01
+  python investigate.py --logs /var/log/api-hook --request-id 3f2a9c01b7e4-1a2b
+  python investigate.py --logs /var/log/api-hook --field response_code=500 --from 2026-01-24T08:00:00+08:00
+  python investigate.py --logs /var/log/api-hook --build-missing
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+import logging
+
+from log_writer import SegmentFileSink, sealed_segments
+
+logger = logging.getLogger('api_hook.investigate')
+
+INDEX_SUFFIX = '.idx'
+INDEX_VERSION = 2
+INDEXED_FIELDS = ('source_ip', 'user_id', 'request_id')
+
+
+class BloomFilter:
+    """以 blake2b 雙重雜湊實作的 Bloom filter"""
+
+    __slots__ = ('bits', 'size', 'hashes')
+
+    def __init__(self, size: int, hashes: int):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray((size + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, items: int, false_positive_rate: float = 0.01) -> 'BloomFilter':
+        """依預期元素數與誤判率計算位元數與雜湊數"""
+        items = max(items, 1)
+        size = max(64, int(math.ceil(-items * math.log(false_positive_rate) / (math.log(2) ** 2))))
+        hashes = max(1, int(round(size / items * math.log(2))))
+        return cls(size, hashes)
+
+    @staticmethod
+    def positions(value: str, size: int, hashes: int) -> List[int]:
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % size for i in range(hashes)]
+
+    def add(self, value: str):
+        for position in self.positions(value, self.size, self.hashes):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self.positions(value, self.size, self.hashes))
+
+    @classmethod
+    def probe(cls, f: BinaryIO, offset: int, size: int, hashes: int, value: str) -> bool:
+        """直接從檔案讀取所需的位元組判斷 value 是否可能存在，不載入整個 filter"""
+        for position in sorted(cls.positions(value, size, hashes)):
+            f.seek(offset + (position >> 3))
+            byte = f.read(1)
+            if not byte or not byte[0] & (1 << (position & 7)):
+                return False
+        return True
+
+
+# ---------------------------------------------------------------------------
+# 時間與欄位比對
+# ---------------------------------------------------------------------------
+
+def parse_time(value: Any) -> Optional[datetime]:
+    """
+    將 ISO 8601 字串或 datetime 轉為 UTC datetime（未標示時區者視為 UTC）
+
+    Returns:
+        UTC datetime；無法解析時回傳 None
+    """
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def canonical_time(value: Any) -> Optional[str]:
+    """轉為可直接以字串比較的 UTC 時間（YYYY-MM-DDTHH:MM:SS.ffffffZ）；無法解析時回傳 None"""
+    parsed = parse_time(value)
+    return parsed.strftime('%Y-%m-%dT%H:%M:%S.%fZ') if parsed is not None else None
+
+
+def _needles(value: str) -> List[bytes]:
+    """
+    值在 NDJSON 行中可能的位元組形式
+
+    命令列的值一律是字串，日誌中的同一欄位卻可能是數字或布林（如 response_code），
+    因此同時比對 JSON 字串與 JSON 純量兩種寫法。
+    """
+    forms = [json.dumps(value, ensure_ascii=False).encode('utf-8')]
+    try:
+        scalar = json.loads(value)
+    except ValueError:
+        return forms
+    if not isinstance(scalar, (str, list, dict)):
+        forms.append(json.dumps(scalar).encode('utf-8'))
+    return forms
+
+
+def _equals(actual: Any, value: str) -> bool:
+    """以欄位實際的型別比較命令列給定的字串值"""
+    if isinstance(actual, str):
+        return actual == value
+    if isinstance(actual, bool) or actual is None:
+        return json.dumps(actual) == value
+    if isinstance(actual, (int, float)):
+        try:
+            return actual == float(value)
+        except ValueError:
+            return False
+    return str(actual) == value
+
+
+# ---------------------------------------------------------------------------
+# 建立索引
+# ---------------------------------------------------------------------------
+
+def index_path(segment_path: str) -> str:
+    return segment_path + INDEX_SUFFIX
+
+
+def build_index(segment_path: str, block_lines: int = 1024, false_positive_rate: float = 0.01) -> Dict[str, Any]:
+    """
+    為封存的區段建立索引並寫入 <segment>.idx
+
+    Args:
+        segment_path: 區段檔路徑
+        block_lines: 稀疏時間索引的區塊行數
+        false_positive_rate: Bloom filter 的目標誤判率
+
+    Returns:
+        索引內容
+    """
+    values: Dict[str, set] = {name: set() for name in INDEXED_FIELDS}
+    blocks: List[List[Any]] = []
+    block = None
+    block_count = 0
+    lines = 0
+    with open(segment_path, 'rb') as f:
+        offset = 0
+        for line in f:
+            line_offset = offset
+            offset += len(line)
+            if not line.strip():
+                continue
+            if block is None or block_count >= block_lines:
+                # [位移, 位元組數, 最小時間, 最大時間]
+                block = [line_offset, 0, None, None]
+                blocks.append(block)
+                block_count = 0
+            block[1] = offset - block[0]
+            block_count += 1
+            lines += 1
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            timestamp = canonical_time(entry.get('timestamp'))
+            if timestamp is not None:
+                if block[2] is None or timestamp < block[2]:
+                    block[2] = timestamp
+                if block[3] is None or timestamp > block[3]:
+                    block[3] = timestamp
+            for name in INDEXED_FIELDS:
+                value = entry.get(name)
+                if value is not None:
+                    values[name].add(str(value))
+
+    blooms = {}
+    payload = bytearray()
+    for name, seen in values.items():
+        bloom = BloomFilter.for_capacity(len(seen), false_positive_rate)
+        for value in seen:
+            bloom.add(value)
+        blooms[name] = {'size': bloom.size, 'hashes': bloom.hashes, 'offset': len(payload)}
+        payload += bloom.bits
+
+    timestamps = [t for b in blocks for t in (b[2], b[3]) if t is not None]
+    index = {
+        'version': INDEX_VERSION,
+        'segment': os.path.basename(segment_path),
+        'size': offset,
+        'lines': lines,
+        'min_timestamp': min(timestamps) if timestamps else None,
+        'max_timestamp': max(timestamps) if timestamps else None,
+        'blocks': blocks,
+        'blooms': blooms,
+    }
+    tmp_path = index_path(segment_path) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(json.dumps(index, separators=(',', ':')).encode('utf-8') + b'\n')
+        f.write(payload)
+    os.replace(tmp_path, index_path(segment_path))
+    return index
+
+
+def load_index(segment_path: str) -> Optional[Dict[str, Any]]:
+    """
+    讀取區段索引標頭（不含 Bloom filter 位元）
+
+    Returns:
+        索引標頭；'data_offset' 為 Bloom filter 位元在索引檔中的起點。
+        索引不存在、版本不符或區段已變動時回傳 None
+    """
+    try:
+        with open(index_path(segment_path), 'rb') as f:
+            header = f.readline()
+            index = json.loads(header)
+    except (OSError, ValueError):
+        return None
+    if index.get('version') != INDEX_VERSION or index.get('size') != os.path.getsize(segment_path):
+        return None
+    index['data_offset'] = len(header)
+    return index
+
+
+def might_contain(segment_path: str, index: Dict[str, Any], criteria: Dict[str, str]) -> bool:
+    """以 Bloom filter 判斷區段是否可能含有符合所有條件的日誌（只檢查有索引的欄位）"""
+    criteria = {name: value for name, value in criteria.items() if name in index['blooms']}
+    if not criteria:
+        return True
+    with open(index_path(segment_path), 'rb') as f:
+        for name, value in criteria.items():
+            bloom = index['blooms'][name]
+            if not BloomFilter.probe(f, index['data_offset'] + bloom['offset'], bloom['size'], bloom['hashes'], value):
+                return False
+    return True
+
+
+class SegmentIndexer:
+    """在背景執行緒中為新封存的區段建立索引（掛在 SegmentFileSink.on_seal）"""
+
+    def __init__(self, block_lines: int = 1024):
+        self.block_lines = block_lines
+        self._queue: 'queue.Queue[Optional[str]]' = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='api-hook-indexer', daemon=True)
+        self._thread.start()
+
+    def __call__(self, segment_path: str):
+        self._queue.put(segment_path)
+
+    def _run(self):
+        while True:
+            segment_path = self._queue.get()
+            if segment_path is None:
+                break
+            try:
+                build_index(segment_path, self.block_lines)
+            except OSError as e:
+                logger.error(f"Failed to index {segment_path}: {e}")
+
+    def close(self):
+        """建立佇列中剩餘區段的索引並停止背景執行緒"""
+        self._queue.put(None)
+        self._thread.join()
+
+
+def build_missing_indexes(log_dir: str, block_lines: int = 1024) -> int:
+    """為目錄中缺少或過期索引的封存區段建立索引，回傳建立數量"""
+    built = 0
+    for segment in sealed_segments(log_dir):
+        if load_index(segment) is None:
+            build_index(segment, block_lines)
+            built += 1
+    return built
+
+
+# ---------------------------------------------------------------------------
+# 查詢
+# ---------------------------------------------------------------------------
+
+def _open_segments(log_dir: str) -> List[str]:
+    if not os.path.isdir(log_dir):
+        return []
+    suffix = SegmentFileSink.SUFFIX + SegmentFileSink.OPEN_SUFFIX
+    return sorted(
+        os.path.join(log_dir, name) for name in os.listdir(log_dir)
+        if name.startswith(SegmentFileSink.PREFIX) and name.endswith(suffix)
+    )
+
+
+def _overlaps(low: Optional[str], high: Optional[str], start: Optional[str], end: Optional[str]) -> bool:
+    if low is None or high is None:
+        return True
+    return (start is None or high >= start) and (end is None or low <= end)
+
+
+def _read_chunks(f: BinaryIO, ranges: Sequence[Tuple[int, Optional[int]]],
+                 chunk_size: int = 1 << 20) -> Iterator[bytes]:
+    """依 (位移, 位元組數) 讀取區塊；位元組數為 None 時以行為邊界分段讀到檔尾"""
+    for offset, length in ranges:
+        f.seek(offset)
+        if length is not None:
+            yield f.read(length)
+            continue
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk + f.readline()
+
+
+def _contains(data: bytes, needles: List[List[bytes]]) -> bool:
+    return all(any(form in data for form in forms) for forms in needles)
+
+
+def _scan(segment_path: str, ranges: Sequence[Tuple[int, Optional[int]]], criteria: Dict[str, str],
+          needles: List[List[bytes]], start: Optional[str], end: Optional[str]) -> Iterator[Dict[str, Any]]:
+    with open(segment_path, 'rb') as f:
+        for chunk in _read_chunks(f, ranges):
+            # 先以位元組比對排除整個區塊與大部分行，再做 JSON 解析
+            if not _contains(chunk, needles):
+                continue
+            for line in chunk.splitlines():
+                if not line.strip() or not _contains(line, needles):
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if start is not None or end is not None:
+                    timestamp = canonical_time(entry.get('timestamp'))
+                    if timestamp is None:
+                        continue
+                    if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+                        continue
+                if all(_equals(entry.get(name), value) for name, value in criteria.items()):
+                    yield entry
+
+
+def investigate(
+    log_dir: str,
+    source_ip: Optional[str] = None,
+    user_id: Optional[str] = None,
+    request_id: Optional[str] = None,
+    start: Optional[Union[str, datetime]] = None,
+    end: Optional[Union[str, datetime]] = None,
+    stats: Optional[Dict[str, int]] = None,
+    fields: Optional[Dict[str, str]] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    查詢符合條件的日誌
+
+    Args:
+        log_dir: 日誌區段目錄（logging.file_path）
+        source_ip: 來源 IP
+        user_id: 使用者 ID
+        request_id: 請求 ID
+        start: 起始時間（ISO 8601 字串或 datetime，含；未標示時區者視為 UTC）
+        end: 結束時間（ISO 8601 字串或 datetime，含）
+        stats: 若提供，累加 segments / skipped / scanned_blocks 統計
+        fields: 其他欄位條件 {欄位: 值}；值以欄位實際型別比較（'200' 符合數字 200）
+
+    Yields:
+        符合條件的日誌條目（依區段順序）
+    """
+    criteria = {name: value for name, value in
+                (('source_ip', source_ip), ('user_id', user_id), ('request_id', request_id))
+                if value is not None}
+    criteria.update(fields or {})
+    needles = [_needles(value) for value in criteria.values()]
+    start, end = _time_bound(start), _time_bound(end)
+    counters = stats if stats is not None else {}
+    for name in ('segments', 'skipped', 'scanned_blocks'):
+        counters.setdefault(name, 0)
+
+    for segment in sealed_segments(log_dir) + _open_segments(log_dir):
+        counters['segments'] += 1
+        index = load_index(segment) if not segment.endswith(SegmentFileSink.OPEN_SUFFIX) else None
+        if index is None:
+            counters['scanned_blocks'] += 1
+            yield from _scan(segment, [(0, None)], criteria, needles, start, end)
+            continue
+
+        if (not _overlaps(index['min_timestamp'], index['max_timestamp'], start, end)
+                or not might_contain(segment, index, criteria)):
+            counters['skipped'] += 1
+            continue
+
+        ranges = [(offset, length) for offset, length, low, high in index['blocks'] if _overlaps(low, high, start, end)]
+        counters['scanned_blocks'] += len(ranges)
+        yield from _scan(segment, ranges, criteria, needles, start, end)
+
+
+def _time_bound(value: Optional[Union[str, datetime]]) -> Optional[str]:
+    if value is None:
+        return None
+    bound = canonical_time(value)
+    if bound is None:
+        raise ValueError(f"無法解析的時間: {value}")
+    return bound
+
+
+def _normalize_time(value: Optional[str], end_of_day: bool = False) -> Optional[str]:
+    """將命令列的 YYYY-MM-DD 展開為當日的起點或終點，其餘 ISO 8601 原樣傳回"""
+    if value is not None and len(value) == 10:
+        value += 'T23:59:59.999999' if end_of_day else 'T00:00:00'
+    return value
+
+
+def _parse_field(value: str) -> Tuple[str, str]:
+    name, sep, field_value = value.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(f"格式應為 欄位=值: {value}")
+    return name, field_value
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """主程式入口"""
+    parser = argparse.ArgumentParser(description='API Hook 事件調查工具')
+    parser.add_argument('--logs', required=True, help='日誌區段目錄（logging.file_path）')
+    parser.add_argument('--source-ip', help='來源 IP')
+    parser.add_argument('--user-id', help='使用者 ID')
+    parser.add_argument('--request-id', help='請求 ID')
+    parser.add_argument('--field', action='append', type=_parse_field, default=[], metavar='NAME=VALUE',
+                        help='其他欄位條件（可重複，如 response_code=500）')
+    parser.add_argument('--from', dest='start', help='起始時間 (YYYY-MM-DD 或 ISO 8601)')
+    parser.add_argument('--to', dest='end', help='結束時間 (YYYY-MM-DD 或 ISO 8601，日期表示含當日)')
+    parser.add_argument('--limit', type=int, default=0, help='最多輸出筆數（0 表示不限）')
+    parser.add_argument('--build-missing', action='store_true', help='為缺少索引的封存區段建立索引')
+    args = parser.parse_args(argv)
+
+    if args.build_missing:
+        print(f"已建立 {build_missing_indexes(args.logs)} 個索引", file=sys.stderr)
+    if not (args.source_ip or args.user_id or args.request_id or args.field or args.start or args.end):
+        if args.build_missing:
+            return 0
+        parser.error('至少需要一個查詢條件')
+
+    stats: Dict[str, int] = {}
+    count = 0
+    try:
+        for entry in investigate(args.logs, args.source_ip, args.user_id, args.request_id,
+                                 _normalize_time(args.start), _normalize_time(args.end, end_of_day=True), stats,
+                                 dict(args.field)):
+            print(json.dumps(entry, ensure_ascii=False))
+            count += 1
+            if args.limit and count >= args.limit:
+                break
+    except ValueError as e:
+        print(f"錯誤: {e}", file=sys.stderr)
+        return 1
+    print(f"{count} 筆符合；{stats['segments']} 個區段，略過 {stats['skipped']} 個，"
+          f"讀取 {stats['scanned_blocks']} 個區塊", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
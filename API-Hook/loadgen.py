@@ -0,0 +1,674 @@
+#!/usr/bin/env python3
+"""
+Load Generator
+以錄製或合成的 NDJSON 流量重播經 APIHook.monitor 裝飾的處理函數，量測端到端負載下的表現
+
+- 流量格式與 API Hook 日誌相同（SegmentFileSink 的區段檔可直接重播）；
+  endpoint、method、user_id、source_ip、parameters 原樣傳入，result 為 error 的呼叫由處理函數拋出例外，
+  response_time_ms 乘上 --service-time 倍率作為處理函數本身的耗時
+- 以固定速率（開放迴圈：第 i 筆排定於 i / rate 秒）或全速送出，並行方式可選 threads、asyncio、processes
+- 報告吞吐量、Hook 額外延遲（總耗時減去處理函數本身耗時）的百分位數、日誌緩衝區深度與記憶體用量；
+  --stages 另外量測 _save_log 與 _check_anomalies 各自的耗時
+- check 指令以 loadgen_baseline.json 中的情境重跑，吞吐量或延遲退步超過容許範圍時回傳非零值；
+  基準值是絕對數字，只能與同一台機器比較：基準檔記錄錄製時的機器，在其他機器上 check 會直接失敗，
+  須先在該機器（如 CI runner）以 --update 重新錄製
+
+使用方式：
+    python loadgen.py generate --requests 100000 --output traffic.ndjson
+    python loadgen.py run --traffic traffic.ndjson --mode threads --concurrency 8 --rate 5000
+    python loadgen.py check --baseline loadgen_baseline.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+import logging
+
+from log_writer import SegmentFileSink
+from rate_limiter import RateLimitExceeded
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - Windows
+    resource = None
+
+logger = logging.getLogger('api_hook.loadgen')
+
+MODES = ('threads', 'asyncio', 'processes')
+SINKS = ('file', 'null', 'logger')
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'loadgen_baseline.json')
+# 與基準比較的指標：(名稱, 越大越好)
+BASELINE_METRICS = (('throughput_rps', True), ('p50_us', False), ('p99_us', False))
+
+_SYNTHETIC_ENDPOINTS = (
+    ('/api/v1/users', 'GET', 'medium'),
+    ('/api/v1/users', 'POST', 'high'),
+    ('/api/v1/orders', 'GET', 'low'),
+    ('/api/v1/orders', 'POST', 'medium'),
+    ('/api/v1/auth/login', 'POST', 'critical'),
+    ('/api/v1/reports', 'GET', 'low'),
+)
+
+
+# ---------------------------------------------------------------------------
+# 流量
+# ---------------------------------------------------------------------------
+
+def synthesize(requests: int, seed: int = 1, sources: int = 2000, users: int = 500,
+               error_rate: float = 0.02, unauthorized_rate: float = 0.01) -> List[Dict[str, Any]]:
+    """
+    產生合成流量（與 API Hook 日誌相同的欄位）
+
+    Args:
+        requests: 筆數
+        seed: 亂數種子（相同參數產生相同流量）
+        sources: 不同來源 IP 數
+        users: 不同使用者數
+        error_rate: 處理函數拋出例外的比例
+        unauthorized_rate: 回應 401 的比例
+
+    Returns:
+        流量記錄列表
+    """
+    rng = random.Random(seed)
+    traffic = []
+    for i in range(requests):
+        endpoint, method, level = rng.choice(_SYNTHETIC_ENDPOINTS)
+        roll = rng.random()
+        if roll < error_rate:
+            code, result = 500, 'error'
+        elif roll < error_rate + unauthorized_rate:
+            code, result = 401, 'success'
+        else:
+            code, result = 200, 'success'
+        source = rng.randrange(sources)
+        traffic.append({
+            'user_id': f'user{rng.randrange(users)}',
+            'source_ip': f'10.{source // 65536 % 256}.{source // 256 % 256}.{source % 256}',
+            'method': method,
+            'endpoint': endpoint,
+            'parameters': {'page': rng.randrange(1, 20), 'token': f'tok-{i}'} if method == 'GET'
+            else {'name': f'item-{i}', 'password': 'x' * 12},
+            'response_code': code,
+            'response_time_ms': round(rng.lognormvariate(1.5, 0.8), 2),
+            'result': result,
+            'security_level': level,
+        })
+    return traffic
+
+
+def load_traffic(path: str) -> List[Dict[str, Any]]:
+    """
+    讀取 NDJSON 流量；略過空行與沒有 endpoint 的事件記錄（log_event）
+
+    Raises:
+        ValueError: 某一行不是合法的 JSON
+    """
+    traffic = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path}:{number}: {e}") from None
+            if entry.get('endpoint'):
+                traffic.append(entry)
+    return traffic
+
+
+def write_traffic(traffic: Iterable[Dict[str, Any]], path: str):
+    """將流量寫成 NDJSON"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for entry in traffic:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+# ---------------------------------------------------------------------------
+# 量測
+# ---------------------------------------------------------------------------
+
+class _NullSink:
+    """丟棄所有日誌（只量測 Hook 本身，不含磁碟寫入）"""
+
+    def write_batch(self, lines: List[bytes]):
+        pass
+
+    def close(self):
+        pass
+
+
+class _ReplayError(Exception):
+    """重播錄製的失敗呼叫"""
+
+
+# monitor 將整個 kwargs 記為 parameters，錄製的日誌中已含這些由 call() 另外傳入的參數
+_CALL_KEYWORDS = frozenset(('user_id', 'source_ip', 'method', 'service', 'fail'))
+
+
+def _rss_mb() -> Optional[float]:
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1048576
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB、macOS 以 bytes 回報
+    return peak / 1048576 if sys.platform == 'darwin' else peak / 1024
+
+
+def _percentile(ordered: Sequence[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _summary_us(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        'mean_us': sum(ordered) / len(ordered) * 1e6 if ordered else 0.0,
+        'p50_us': _percentile(ordered, 0.50) * 1e6,
+        'p90_us': _percentile(ordered, 0.90) * 1e6,
+        'p99_us': _percentile(ordered, 0.99) * 1e6,
+        'p999_us': _percentile(ordered, 0.999) * 1e6,
+        'max_us': ordered[-1] * 1e6 if ordered else 0.0,
+    }
+
+
+class _QueueSampler:
+    """每 interval 秒取樣一次日誌緩衝區深度"""
+
+    def __init__(self, hook: Any, interval: float = 0.01):
+        self.hook = hook
+        self.interval = interval
+        self.samples: List[int] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='api-hook-loadgen-sampler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.samples.append(self.hook.log_writer.queue_depth())
+
+    def __enter__(self) -> '_QueueSampler':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class Replayer:
+    """
+    建立 APIHook 與各端點的裝飾處理函數，並記錄每次呼叫的額外延遲
+
+    處理函數以 thread-local 回報本身耗時，額外延遲 = 呼叫總耗時 - 處理函數耗時；
+    被速率限制拒絕的呼叫沒有執行處理函數，總耗時即為額外延遲。
+    """
+
+    def __init__(self, sink: str = 'file', service_time: float = 0.0, rate_limit: bool = True,
+                 stages: bool = False, hook_factory: Optional[Callable[[], Any]] = None):
+        """
+        Args:
+            sink: 日誌輸出（file：暫存目錄中的區段檔、null：丟棄、logger：APIHook 預設的 logging 輸出）
+            service_time: 處理函數耗時倍率（乘上記錄中的 response_time_ms；0 表示不模擬）
+            rate_limit: 是否保留 security.rate_limiting 的速率限制
+            stages: 是否量測 _save_log 與 _check_anomalies 各自的耗時
+            hook_factory: 建立 APIHook 的函數（預設使用內建設定）
+        """
+        if hook_factory is None:
+            from api_hook import APIHook
+            hook_factory = APIHook
+        self.hook = hook_factory()
+        self.directory = None
+        if sink == 'file':
+            self.directory = tempfile.mkdtemp(prefix='api-hook-loadgen-')
+            self.hook.log_writer.sink = SegmentFileSink(self.directory)
+        elif sink == 'null':
+            self.hook.log_writer.sink = _NullSink()
+        if not rate_limit:
+            self.hook.rate_limiter = None
+        self.service_time = service_time
+        self.latencies: List[float] = []
+        self.counts = {'completed': 0, 'errors': 0, 'blocked': 0}
+        self.stage_samples: Dict[str, List[float]] = {}
+        if stages:
+            self._instrument('_save_log')
+            self._instrument('_check_anomalies')
+        self._local = threading.local()
+        self._handlers: Dict[Any, Callable] = {}
+        self._lock = threading.Lock()
+
+    def _instrument(self, name: str):
+        original = getattr(self.hook, name)
+        samples = self.stage_samples[name] = []
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                samples.append(time.perf_counter() - start)
+
+        setattr(self.hook, name, timed)
+
+    def handler(self, endpoint: str, level: str) -> Callable:
+        """取得（必要時建立）端點的裝飾處理函數"""
+        key = (endpoint, level)
+        handler = self._handlers.get(key)
+        if handler is None:
+            local = self._local
+
+            @self.hook.monitor(endpoint=endpoint, security_level=level)
+            def handle(service=0.0, fail=False, **kwargs):
+                start = time.perf_counter()
+                if service:
+                    time.sleep(service)
+                local.inner = time.perf_counter() - start
+                if fail:
+                    raise _ReplayError('replayed error')
+                return {'status': 'success'}
+
+            with self._lock:
+                handler = self._handlers.setdefault(key, handle)
+        return handler
+
+    def call(self, entry: Dict[str, Any], service: Optional[float] = None,
+             latencies: Optional[List[float]] = None, counts: Optional[Dict[str, int]] = None):
+        """
+        重播一筆流量
+
+        Args:
+            entry: 流量記錄
+            service: 處理函數耗時（秒）；None 時依 response_time_ms 與倍率計算
+            latencies: 額外延遲的輸出列表（各執行緒各自一份，避免共用）
+            counts: 結果計數（completed / errors / blocked，同上）
+        """
+        if service is None:
+            service = entry.get('response_time_ms', 0) * self.service_time / 1000
+        handle = self.handler(entry['endpoint'], entry.get('security_level', 'medium'))
+        parameters = {key: value for key, value in (entry.get('parameters') or {}).items()
+                      if key not in _CALL_KEYWORDS}
+        local = self._local
+        local.inner = 0.0
+        start = time.perf_counter()
+        try:
+            handle(
+                service=service, fail=entry.get('result') == 'error',
+                user_id=entry.get('user_id', 'anonymous'), source_ip=entry.get('source_ip', '0.0.0.0'),
+                method=entry.get('method', 'GET'), **parameters
+            )
+            outcome = 'completed'
+        except RateLimitExceeded:
+            outcome = 'blocked'
+        except _ReplayError:
+            outcome = 'errors'
+        elapsed = time.perf_counter() - start
+        (self.latencies if latencies is None else latencies).append(elapsed - local.inner)
+        (self.counts if counts is None else counts)[outcome] += 1
+
+    def close(self):
+        self.hook.close()
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _pace(index: int, start: float, rate: float) -> float:
+    """開放迴圈排程：回傳第 index 筆距排定時間還需等待的秒數"""
+    if not rate:
+        return 0.0
+    return start + index / rate - time.perf_counter()
+
+
+def _run_threads(replayer: Replayer, traffic: List[Dict[str, Any]], concurrency: int, rate: float):
+    counter = itertools.count()
+    start = time.perf_counter()
+    shards = []
+    failures: List[BaseException] = []
+
+    def worker():
+        latencies: List[float] = []
+        counts = dict.fromkeys(replayer.counts, 0)
+        shards.append((latencies, counts))
+        try:
+            for index in iter(counter.__next__, None):
+                if index >= len(traffic) or failures:
+                    return
+                delay = _pace(index, start, rate)
+                if delay > 0:
+                    time.sleep(delay)
+                replayer.call(traffic[index], latencies=latencies, counts=counts)
+        except Exception as e:
+            failures.append(e)
+
+    threads = [threading.Thread(target=worker, name=f'api-hook-loadgen-{i}') for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 重播本身出錯（非處理函數的預期結果）時讓 run() 直接失敗，而非回報空結果
+    if failures:
+        raise failures[0]
+    for latencies, counts in shards:
+        replayer.latencies.extend(latencies)
+        for outcome, count in counts.items():
+            replayer.counts[outcome] += count
+
+
+def _run_asyncio(replayer: Replayer, traffic: List[Dict[str, Any]], concurrency: int, rate: float):
+    # 裝飾器為同步函數：於事件迴圈執行緒內呼叫（與 async 框架呼叫同步處理函數相同），
+    # 處理函數本身的耗時以 asyncio.sleep 在呼叫前模擬，不佔用事件迴圈
+    async def main():
+        counter = itertools.count()
+        start = time.perf_counter()
+
+        async def worker():
+            for index in iter(counter.__next__, None):
+                if index >= len(traffic):
+                    return
+                entry = traffic[index]
+                delay = _pace(index, start, rate)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if replayer.service_time:
+                    await asyncio.sleep(entry.get('response_time_ms', 0) * replayer.service_time / 1000)
+                replayer.call(entry, service=0.0)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    asyncio.run(main())
+
+
+def _replay(traffic: List[Dict[str, Any]], mode: str, concurrency: int, rate: float,
+            options: Dict[str, Any]) -> Dict[str, Any]:
+    """在目前行程中重播並回傳原始量測（供 run 與 processes 模式的子行程共用）"""
+    rss_before = _rss_mb()
+    replayer = Replayer(**options)
+    try:
+        with _QueueSampler(replayer.hook) as sampler:
+            start = time.perf_counter()
+            if mode == 'asyncio':
+                _run_asyncio(replayer, traffic, concurrency, rate)
+            else:
+                _run_threads(replayer, traffic, concurrency, rate)
+            duration = time.perf_counter() - start
+            # 重播結束後寫出緩衝區所需的時間：大於零表示寫入跟不上請求速率
+            replayer.hook.flush()
+            drain = time.perf_counter() - start - duration
+        rss_after = _rss_mb()
+        return {
+            'duration_s': duration,
+            'drain_s': drain,
+            'latencies': replayer.latencies,
+            'counts': dict(replayer.counts),
+            'queue_samples': sampler.samples,
+            'overflow': replayer.hook.log_writer.counters['overflow'],
+            'written': replayer.hook.log_writer.counters['written'],
+            'stages': replayer.stage_samples,
+            'peak_rss_mb': _peak_rss_mb(),
+            'rss_growth_mb': None if rss_before is None or rss_after is None else rss_after - rss_before,
+        }
+    finally:
+        replayer.close()
+
+
+def _replay_shard(args) -> Dict[str, Any]:
+    return _replay(*args)
+
+
+def run(traffic: List[Dict[str, Any]], mode: str = 'threads', concurrency: int = 4, rate: float = 0.0,
+        processes: int = 2, **options) -> Dict[str, Any]:
+    """
+    重播流量並彙總結果
+
+    Args:
+        traffic: 流量記錄
+        mode: threads、asyncio 或 processes
+        concurrency: 並行數（processes 模式為每個行程的執行緒數）
+        rate: 目標每秒請求數（0 表示全速）
+        processes: processes 模式的行程數（每個行程各自建立 APIHook，如 prefork worker）
+        **options: 傳給 Replayer 的選項（sink、service_time、rate_limit、stages）
+
+    Returns:
+        吞吐量、額外延遲百分位數、緩衝區深度、記憶體與（可選的）各階段耗時
+
+    Raises:
+        ValueError: mode 不正確或沒有流量
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode 必須是 {', '.join(MODES)} 之一")
+    if not traffic:
+        raise ValueError("沒有可重播的流量")
+
+    start = time.perf_counter()
+    if mode == 'processes':
+        import multiprocessing
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods()
+                                              else 'spawn')
+        shards = [(traffic[i::processes], 'threads', concurrency, rate / processes, options)
+                  for i in range(processes)]
+        with context.Pool(processes) as pool:
+            parts = pool.map(_replay_shard, shards)
+    else:
+        parts = [_replay(traffic, mode, concurrency, rate, options)]
+    wall = max(part['duration_s'] for part in parts) or time.perf_counter() - start
+
+    latencies = [value for part in parts for value in part['latencies']]
+    queue = [value for part in parts for value in part['queue_samples']]
+    counts = {key: sum(part['counts'][key] for part in parts) for key in ('completed', 'errors', 'blocked')}
+    total = sum(counts.values())
+    peaks = [part['peak_rss_mb'] for part in parts if part['peak_rss_mb'] is not None]
+    growth = [part['rss_growth_mb'] for part in parts if part['rss_growth_mb'] is not None]
+    result = {
+        'mode': mode,
+        'requests': total,
+        **counts,
+        'concurrency': concurrency,
+        'processes': processes if mode == 'processes' else 1,
+        'target_rps': rate,
+        'duration_s': wall,
+        'drain_s': max(part['drain_s'] for part in parts),
+        'throughput_rps': total / wall if wall else 0.0,
+        **_summary_us(latencies),
+        'queue_depth_max': max(queue, default=0),
+        'queue_depth_mean': sum(queue) / len(queue) if queue else 0.0,
+        'queue_overflow': sum(part['overflow'] for part in parts),
+        'written': sum(part['written'] for part in parts),
+        'peak_rss_mb': max(peaks) if peaks else None,
+        'rss_growth_mb': max(growth) if growth else None,
+    }
+    stages = {}
+    for name in parts[0]['stages']:
+        samples = [value for part in parts for value in part['stages'][name]]
+        stages[name] = {key: value for key, value in _summary_us(samples).items()
+                        if key in ('mean_us', 'p99_us')}
+    if stages:
+        result['stages'] = stages
+    return result
+
+
+# ---------------------------------------------------------------------------
+# 基準比較
+# ---------------------------------------------------------------------------
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """
+    與基準值比較
+
+    Args:
+        result: run() 的結果
+        baseline: 基準值（BASELINE_METRICS 中的欄位）
+        tolerance: 容許的相對退步比例（0.3 表示 30%）
+
+    Returns:
+        退步說明列表；空列表表示通過
+    """
+    regressions = []
+    for metric, higher_is_better in BASELINE_METRICS:
+        if metric not in baseline:
+            continue
+        expected, actual = baseline[metric], result[metric]
+        if higher_is_better and actual < expected * (1 - tolerance):
+            regressions.append(f"{metric} {actual:.1f} < {expected:.1f} (-{tolerance:.0%})")
+        elif not higher_is_better and actual > expected * (1 + tolerance):
+            regressions.append(f"{metric} {actual:.1f} > {expected:.1f} (+{tolerance:.0%})")
+    return regressions
+
+
+def machine_fingerprint() -> Dict[str, Any]:
+    """足以判斷基準值是否可比較的機器特徵（不含會隨系統更新變動的核心版本）"""
+    processor = platform.processor()
+    try:
+        with open('/proc/cpuinfo', 'r', encoding='utf-8') as f:
+            processor = next((line.split(':', 1)[1].strip() for line in f if line.startswith('model name')),
+                             processor)
+    except OSError:
+        pass
+    return {
+        'system': platform.system(),
+        'machine': platform.machine(),
+        'processor': processor,
+        'cpu_count': os.cpu_count(),
+        'python': '.'.join(platform.python_version_tuple()[:2]),
+    }
+
+
+def check(baseline_path: str = DEFAULT_BASELINE, update: bool = False,
+          tolerance: Optional[float] = None) -> Dict[str, List[str]]:
+    """
+    依基準檔中的情境重跑並比較；update 為 True 時以本次結果覆寫基準值並記錄目前的機器
+
+    Returns:
+        {情境名稱: 退步說明列表}
+
+    Raises:
+        ValueError: 基準值不是在目前的機器上錄製（須先以 update 重新錄製）
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    machine = machine_fingerprint()
+    if not update and baseline.get('machine') != machine:
+        raise ValueError(f"基準值錄製於 {baseline.get('machine')}，與目前機器 {machine} 不同；"
+                         f"請先在此機器以 check --update 重新錄製")
+    if tolerance is None:
+        tolerance = baseline.get('tolerance', 0.3)
+
+    report = {}
+    for name, scenario in baseline['scenarios'].items():
+        options = dict(scenario['options'])
+        traffic = synthesize(options.pop('requests'), seed=options.pop('seed', 1))
+        result = run(traffic, **options)
+        if update:
+            # 只更新情境原本比較的指標（未列出任何指標時寫入全部）
+            metrics = [metric for metric, _ in BASELINE_METRICS if metric in scenario]
+            for metric in metrics or [metric for metric, _ in BASELINE_METRICS]:
+                scenario[metric] = round(result[metric], 1)
+            report[name] = []
+        else:
+            report[name] = compare(result, scenario, tolerance)
+        _print_result(name, result)
+
+    if update:
+        baseline['machine'] = machine
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+    return report
+
+
+def _print_result(name: str, result: Dict[str, Any]):
+    memory = '' if result['peak_rss_mb'] is None else f" peak_rss={result['peak_rss_mb']:.0f}MB"
+    print(f"[{name}] {result['requests']} 筆 ({result['errors']} 錯誤, {result['blocked']} 封鎖) "
+          f"{result['duration_s']:.2f}s, {result['throughput_rps']:.0f} req/s, drain {result['drain_s'] * 1000:.0f}ms")
+    print(f"    額外延遲 us: p50={result['p50_us']:.1f} p90={result['p90_us']:.1f} "
+          f"p99={result['p99_us']:.1f} p99.9={result['p999_us']:.1f} max={result['max_us']:.1f}")
+    print(f"    日誌緩衝區: max={result['queue_depth_max']} mean={result['queue_depth_mean']:.1f} "
+          f"overflow={result['queue_overflow']}{memory}")
+    for stage, summary in result.get('stages', {}).items():
+        print(f"    {stage}: mean={summary['mean_us']:.1f}us p99={summary['p99_us']:.1f}us")
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """主程式入口"""
+    parser = argparse.ArgumentParser(description='APIHook 負載產生器（重播 NDJSON 流量）')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help='產生合成流量')
+    generate_parser.add_argument('--requests', type=int, default=100000, help='筆數')
+    generate_parser.add_argument('--seed', type=int, default=1, help='亂數種子')
+    generate_parser.add_argument('--error-rate', type=float, default=0.02, help='錯誤比例')
+    generate_parser.add_argument('--output', required=True, help='輸出 NDJSON 路徑')
+
+    run_parser = subparsers.add_parser('run', help='重播流量')
+    run_parser.add_argument('--traffic', help='NDJSON 流量檔（錄製的日誌區段或 generate 的輸出；預設產生合成流量）')
+    run_parser.add_argument('--requests', type=int, default=20000, help='未指定 --traffic 時的合成筆數')
+    run_parser.add_argument('--mode', choices=MODES, default='threads', help='並行方式')
+    run_parser.add_argument('--concurrency', type=int, default=4, help='並行數（processes 模式為每個行程）')
+    run_parser.add_argument('--processes', type=int, default=2, help='processes 模式的行程數')
+    run_parser.add_argument('--rate', type=float, default=0.0, help='目標每秒請求數（0 為全速）')
+    run_parser.add_argument('--service-time', type=float, default=0.0,
+                            help='處理函數耗時倍率（乘上記錄的 response_time_ms）')
+    run_parser.add_argument('--sink', choices=SINKS, default='file', help='日誌輸出')
+    run_parser.add_argument('--no-rate-limit', action='store_true', help='停用速率限制')
+    run_parser.add_argument('--stages', action='store_true', help='量測 _save_log 與 _check_anomalies 的耗時')
+    run_parser.add_argument('--json', action='store_true', help='以 JSON 輸出結果')
+
+    check_parser = subparsers.add_parser('check', help='與基準比較（退步時回傳 1）')
+    check_parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基準檔路徑')
+    check_parser.add_argument('--tolerance', type=float, help='容許退步比例（預設讀取基準檔）')
+    check_parser.add_argument('--update', action='store_true', help='以本次結果更新基準檔')
+    args = parser.parse_args(argv)
+
+    # 主控台日誌輸出會主導量測結果
+    logging.getLogger('api_hook').setLevel(logging.CRITICAL)
+    try:
+        if args.command == 'generate':
+            write_traffic(synthesize(args.requests, seed=args.seed, error_rate=args.error_rate), args.output)
+            print(f"✅ 已產生 {args.requests} 筆流量: {args.output}")
+            return 0
+
+        if args.command == 'run':
+            traffic = load_traffic(args.traffic) if args.traffic else synthesize(args.requests)
+            result = run(
+                traffic, mode=args.mode, concurrency=args.concurrency, rate=args.rate, processes=args.processes,
+                sink=args.sink, service_time=args.service_time, rate_limit=not args.no_rate_limit,
+                stages=args.stages
+            )
+            if args.json:
+                print(json.dumps(result, ensure_ascii=False, indent=2))
+            else:
+                _print_result(args.mode, result)
+            return 0
+
+        report = check(args.baseline, update=args.update, tolerance=args.tolerance)
+    except (OSError, ValueError) as e:
+        print(f"錯誤: {e}", file=sys.stderr)
+        return 1
+
+    failed = {name: regressions for name, regressions in report.items() if regressions}
+    for name, regressions in failed.items():
+        print(f"❌ {name}: {'; '.join(regressions)}")
+    if failed:
+        return 1
+    print("✅ 基準已更新" if args.update else "✅ 未超出基準")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
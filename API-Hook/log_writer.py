@@ -0,0 +1,578 @@
+"""
+Log Record & Background Writer
+API 呼叫日誌的精簡記錄型別與背景寫入器
+
+熱路徑只建立 LogRecord（__slots__，不複製參數、不格式化時間）；
+敏感資料清理、JSON 序列化與寫入延後至背景執行緒批次處理。
+安裝 orjson 時使用 orjson 序列化，否則退回標準 json 模組。
+"""
+
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+import logging
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 視安裝環境而定
+    orjson = None
+
+logger = logging.getLogger('api_hook')
+
+
+# ---------------------------------------------------------------------------
+# Request ID
+# ---------------------------------------------------------------------------
+
+_request_prefix = uuid.uuid4().hex[:12]
+_request_counter = itertools.count(1)
+
+
+def _reset_request_ids():
+    """fork 後重新產生前綴，避免多個 worker 產生相同的 request_id"""
+    global _request_prefix, _request_counter
+    _request_prefix = uuid.uuid4().hex[:12]
+    _request_counter = itertools.count(1)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_request_ids)
+
+
+def next_request_id() -> str:
+    """
+    產生 request_id：行程隨機前綴 + 遞增序號
+
+    比 uuid4 便宜許多，且在同一行程內保證唯一、跨行程以前綴區分。
+    """
+    return f"{_request_prefix}-{next(_request_counter):x}"
+
+
+def format_timestamp(epoch: float) -> str:
+    """將 epoch 秒數格式化為 ISO 8601 UTC 字串（如 2026-01-24T15:58:58.442000Z）"""
+    seconds = int(epoch)
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds)) + f".{int((epoch - seconds) * 1e6):06d}Z"
+
+
+# ---------------------------------------------------------------------------
+# JSON 序列化
+# ---------------------------------------------------------------------------
+
+if orjson is not None:
+    def dumps(obj: Any) -> bytes:
+        """序列化為 UTF-8 JSON bytes"""
+        # OPT_NON_STR_KEYS：與 json 相同，非字串的字典鍵轉為字串
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def dumps(obj: Any) -> bytes:
+        """序列化為 UTF-8 JSON bytes"""
+        return json.dumps(obj, ensure_ascii=False, default=str).encode('utf-8')
+
+
+# ---------------------------------------------------------------------------
+# LogRecord
+# ---------------------------------------------------------------------------
+
+class LogRecord:
+    """
+    精簡的 API 呼叫日誌記錄
+
+    支援 record['endpoint'] 與 record.get('endpoint') 的字典式讀取，
+    完整的巢狀日誌結構由 to_dict() 在序列化時才產生。
+    """
+
+    __slots__ = (
+        'timestamp', 'request_id', 'user_id', 'source_ip', 'method', 'endpoint',
+        'parameters', 'response_code', 'response_time_ms', 'result', 'error_message', 'sampling_weight',
+        'ttfb_ms', 'request_bytes', 'response_bytes', 'path',
+    )
+
+    def __init__(
+        self,
+        timestamp: float,
+        request_id: str,
+        user_id: str,
+        source_ip: str,
+        method: str,
+        endpoint: str,
+        parameters: Dict[str, Any],
+        response_code: int,
+        response_time_ms: float,
+        result: str,
+        error_message: Optional[str] = None,
+        sampling_weight: float = 1.0,
+        ttfb_ms: Optional[float] = None,
+        request_bytes: Optional[int] = None,
+        response_bytes: Optional[int] = None,
+        path: Optional[str] = None
+    ):
+        self.timestamp = timestamp
+        self.request_id = request_id
+        self.user_id = user_id
+        self.source_ip = source_ip
+        self.method = method
+        self.endpoint = endpoint
+        self.parameters = parameters
+        self.response_code = response_code
+        self.response_time_ms = response_time_ms
+        self.result = result
+        self.error_message = error_message
+        self.sampling_weight = sampling_weight
+        # 僅由 WSGI / ASGI 中介層填入（middleware.py）
+        self.ttfb_ms = ttfb_ms
+        self.request_bytes = request_bytes
+        self.response_bytes = response_bytes
+        # endpoint 為路由樣式時的實際請求路徑
+        self.path = path
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def to_dict(self, sanitize: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None) -> Dict[str, Any]:
+        """
+        轉換為標準日誌格式
+
+        Args:
+            sanitize: 敏感資料清理函數（套用於 parameters）
+
+        Returns:
+            與 README「日誌格式」相同結構的字典
+        """
+        parameters = self.parameters
+        if sanitize is not None and parameters:
+            parameters = sanitize(parameters)
+        entry = {
+            'timestamp': format_timestamp(self.timestamp),
+            'request_id': self.request_id,
+            'user_id': self.user_id,
+            'source_ip': self.source_ip,
+            'method': self.method,
+            'endpoint': self.endpoint,
+            'parameters': parameters,
+            'response_code': self.response_code,
+            'response_time_ms': round(self.response_time_ms, 2),
+            'security_context': {
+                'authentication_method': 'OAuth2',
+                'authorization_level': 'User',
+                'session_id': self.request_id
+            },
+            'result': self.result,
+            'error_message': self.error_message,
+            'sampling_weight': self.sampling_weight
+        }
+        if self.ttfb_ms is not None:
+            entry['ttfb_ms'] = round(self.ttfb_ms, 2)
+            entry['request_bytes'] = self.request_bytes
+            entry['response_bytes'] = self.response_bytes
+        if self.path is not None:
+            entry['path'] = self.path
+        return entry
+
+
+# ---------------------------------------------------------------------------
+# 背景寫入器
+# ---------------------------------------------------------------------------
+
+class LoggerSink:
+    """將日誌行輸出至 Python logging（預設行為）"""
+
+    def write_batch(self, lines: List[bytes]):
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        for line in lines:
+            logger.info("API Log: %s", line.decode('utf-8'))
+
+    def close(self):
+        pass
+
+
+class FanoutSink:
+    """將同一批日誌依序寫入多個輸出目標（如本地檔案 + SIEM 轉發）"""
+
+    def __init__(self, sinks: List[Any]):
+        self.sinks = list(sinks)
+
+    def write_batch(self, lines: List[bytes]):
+        for sink in self.sinks:
+            sink.write_batch(lines)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+# 本行程中開啟中的區段（.open 路徑），封存遺留區段時略過
+_open_segments = set()
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class SegmentFileSink:
+    """
+    將日誌寫入 NDJSON 區段檔（logging.storage = file）
+
+    寫入中的區段檔名為 api-hook-<開始時間>-<序號>.ndjson.open；
+    超過 max_segment_bytes 或 max_segment_seconds 時封存（更名去掉 .open），
+    封存後的區段不再變動，可安全地交由歸檔、索引等後續流程處理。
+    建立時先封存目錄中前次異常結束而遺留的 .open 區段（寫入者行程已不存在者）。
+    """
+
+    PREFIX = 'api-hook-'
+    SUFFIX = '.ndjson'
+    OPEN_SUFFIX = '.open'
+
+    def __init__(
+        self,
+        directory: str,
+        max_segment_bytes: int = 100 * 1024 * 1024,
+        max_segment_seconds: float = 3600,
+        clock: Callable[[], float] = time.time,
+        on_seal: Sequence[Callable[[str], None]] = ()
+    ):
+        """
+        初始化區段檔輸出
+
+        Args:
+            directory: 區段檔目錄（logging.file_path）
+            max_segment_bytes: 單一區段的大小上限（logging.max_file_size_mb）
+            max_segment_seconds: 單一區段涵蓋的最長時間
+            clock: 時間函數（測試時可替換）
+            on_seal: 區段封存後的回呼（亦套用於建立時封存的遺留區段）
+        """
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.max_segment_seconds = max_segment_seconds
+        self._clock = clock
+        self._file = None
+        self._path: Optional[str] = None
+        self._opened_at = 0.0
+        self._sequence = itertools.count(1)
+        # 區段封存後的回呼：callback(sealed_path)
+        self.on_seal: List[Callable[[str], None]] = list(on_seal)
+        # 完整性保護（integrity.HashChain）：每批寫入後記錄 Merkle root 與鏈值
+        self.integrity = None
+        os.makedirs(directory, exist_ok=True)
+        self.recovered = self._seal_orphans()
+
+    def _seal_orphans(self) -> List[str]:
+        """
+        封存前次異常結束而遺留的 .open 區段
+
+        檔名中的 pid 仍在執行（其他 worker）或由本行程其他 sink 開啟中的區段不處理。
+
+        Returns:
+            封存後的區段路徑
+        """
+        recovered = []
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith(self.PREFIX) and name.endswith(self.SUFFIX + self.OPEN_SUFFIX)):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                pid = int(name[len(self.PREFIX):].split('-')[1])
+            except (IndexError, ValueError):
+                continue
+            if path in _open_segments or (pid != os.getpid() and _pid_alive(pid)):
+                continue
+            sealed = path[:-len(self.OPEN_SUFFIX)]
+            try:
+                os.replace(path, sealed)
+            except FileNotFoundError:
+                # 另一個 worker 同時封存
+                continue
+            logger.warning(f"Sealed orphaned log segment {sealed}")
+            self._notify(sealed)
+            recovered.append(sealed)
+        return recovered
+
+    def _notify(self, sealed: str):
+        for callback in self.on_seal:
+            try:
+                callback(sealed)
+            except Exception as e:
+                logger.error(f"Segment seal callback failed for {sealed}: {e}")
+
+    def _open(self):
+        now = self._clock()
+        stamp = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(now))
+        while True:
+            name = f"{self.PREFIX}{stamp}-{os.getpid()}-{next(self._sequence):04d}{self.SUFFIX}"
+            sealed = os.path.join(self.directory, name)
+            # 同一秒內重新啟動或有多個 sink 時，避免覆寫既有的區段
+            if os.path.exists(sealed):
+                continue
+            try:
+                self._file = open(sealed + self.OPEN_SUFFIX, 'xb')
+            except FileExistsError:
+                continue
+            break
+        self._path = sealed + self.OPEN_SUFFIX
+        _open_segments.add(self._path)
+        self._opened_at = now
+
+    def write_batch(self, lines: List[bytes]):
+        if self._file is not None and (
+            self._file.tell() >= self.max_segment_bytes
+            or self._clock() - self._opened_at >= self.max_segment_seconds
+        ):
+            self.seal()
+        if self._file is None:
+            self._open()
+        self._file.write(b'\n'.join(lines) + b'\n')
+        self._file.flush()
+        if self.integrity is not None:
+            self.integrity.append(self._path[:-len(self.OPEN_SUFFIX)], lines)
+
+    def seal(self) -> Optional[str]:
+        """
+        封存目前的區段
+
+        Returns:
+            封存後的區段路徑；沒有開啟中的區段時回傳 None
+        """
+        if self._file is None:
+            return None
+        self._file.close()
+        self._file = None
+        if self.integrity is not None:
+            self.integrity.end_segment()
+        sealed = self._path[:-len(self.OPEN_SUFFIX)]
+        os.replace(self._path, sealed)
+        _open_segments.discard(self._path)
+        self._notify(sealed)
+        return sealed
+
+    def close(self):
+        self.seal()
+
+
+def sealed_segments(directory: str) -> List[str]:
+    """依時間順序列出目錄中已封存的區段檔"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith(SegmentFileSink.PREFIX) and name.endswith(SegmentFileSink.SUFFIX)
+    )
+
+
+# 行程結束前寫出所有仍在運作的寫入器的緩衝區（只註冊一次 atexit）
+_live_writers: 'weakref.WeakSet[LogWriter]' = weakref.WeakSet()
+
+
+def _flush_live_writers():
+    for writer in list(_live_writers):
+        writer.flush()
+
+
+atexit.register(_flush_live_writers)
+
+
+class LogWriter:
+    """
+    批次序列化並寫入日誌的背景執行緒
+
+    請求執行緒只將記錄附加到 deque（不取鎖、不喚醒寫入執行緒）；
+    累積達 batch_size 筆或經過 flush_interval_seconds 時才喚醒寫入執行緒，
+    避免每筆日誌都觸發執行緒切換。緩衝區超過 max_queue_size 時呼叫端會等待，
+    確保稽核日誌不遺失。
+    """
+
+    def __init__(
+        self,
+        sink: Any,
+        sanitize: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+        max_queue_size: int = 10000,
+        batch_size: int = 100,
+        flush_interval_seconds: float = 5.0,
+        asynchronous: bool = True
+    ):
+        """
+        初始化背景寫入器
+
+        Args:
+            sink: 具有 write_batch(lines) 與 close() 的輸出目標
+            sanitize: 敏感資料清理函數
+            max_queue_size: 緩衝區上限（performance.max_log_queue_size）
+            batch_size: 每批寫入的最大筆數（performance.batch_insert_size）
+            flush_interval_seconds: 批次未滿時的最長等待時間
+            asynchronous: False 時於呼叫端同步寫入（performance.async_processing）
+        """
+        self.sink = sink
+        self.sanitize = sanitize
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.asynchronous = asynchronous
+        self.counters = {'written': 0, 'batches': 0, 'overflow': 0, 'dropped': 0, 'restarts': 0}
+        self._buffer: 'deque[Any]' = deque()
+        self._wake = threading.Event()
+        self._flush_waiters: List[threading.Event] = []
+        self._waiters_lock = threading.Lock()
+        self._closing = False
+        self._closed = False
+        self._write_lock = threading.Lock()
+        self._thread = None
+        if asynchronous:
+            self._start()
+            _live_writers.add(self)
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='api-hook-writer', daemon=True)
+        self._thread.start()
+
+    def _ensure_running(self) -> bool:
+        """
+        寫入執行緒意外結束時重新啟動
+
+        Returns:
+            寫入執行緒是否可用（已關閉時為 False，呼叫端應同步寫入）
+        """
+        if self._closed:
+            return False
+        if not self._thread.is_alive() and not self._closing:
+            with self._waiters_lock:
+                if not self._thread.is_alive():
+                    logger.error("Log writer thread stopped unexpectedly; restarting")
+                    self.counters['restarts'] += 1
+                    self._start()
+        return True
+
+    def serialize(self, item: Union[LogRecord, Dict[str, Any]]) -> bytes:
+        """將 LogRecord 或事件字典序列化為一行 JSON"""
+        if isinstance(item, LogRecord):
+            item = item.to_dict(self.sanitize)
+        return dumps(item)
+
+    def submit(self, item: Union[LogRecord, Dict[str, Any]]):
+        """提交一筆日誌（非同步模式下僅附加至緩衝區）"""
+        if not self.asynchronous or self._closed:
+            with self._write_lock:
+                self._write([item])
+            return
+        buffer = self._buffer
+        buffer.append(item)
+        pending = len(buffer)
+        if pending >= self.batch_size and not self._wake.is_set():
+            self._ensure_running()
+            self._wake.set()
+        if pending > self.max_queue_size:
+            self.counters['overflow'] += 1
+            while len(buffer) > self.max_queue_size:
+                if not self._ensure_running():
+                    self._drain()
+                    break
+                self._wake.set()
+                time.sleep(0.001)
+
+    def _write(self, items: List[Any]):
+        lines = []
+        for item in items:
+            # 單筆無法序列化的記錄只丟棄該筆，不影響同批其他記錄與寫入執行緒
+            try:
+                lines.append(self.serialize(item))
+            except Exception as e:
+                self.counters['dropped'] += 1
+                logger.error(f"Dropped unserializable log entry: {e!r}")
+        if not lines:
+            return
+        try:
+            self.sink.write_batch(lines)
+        except OSError as e:
+            logger.error(f"Failed to write {len(lines)} log entries: {e}")
+            return
+        self.counters['written'] += len(lines)
+        self.counters['batches'] += 1
+
+    def _drain(self):
+        buffer = self._buffer
+        while buffer:
+            batch = []
+            try:
+                for _ in range(self.batch_size):
+                    batch.append(buffer.popleft())
+            except IndexError:
+                pass
+            with self._write_lock:
+                self._write(batch)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval_seconds)
+            self._wake.clear()
+            with self._waiters_lock:
+                waiters, self._flush_waiters = self._flush_waiters, []
+            closing = self._closing
+            try:
+                self._drain()
+            except Exception:
+                # 任何例外都不可結束寫入執行緒，否則之後的日誌只會堆積在緩衝區
+                logger.exception("Log writer batch failed")
+            finally:
+                for waiter in waiters:
+                    waiter.set()
+            if closing:
+                break
+
+    def flush(self):
+        """立即寫出緩衝區，並等待寫入完成"""
+        if self._thread is None:
+            return
+        if not self._ensure_running():
+            self._drain()
+            return
+        done = threading.Event()
+        with self._waiters_lock:
+            self._flush_waiters.append(done)
+        self._wake.set()
+        while not done.wait(0.1):
+            if not self._ensure_running():
+                self._drain()
+                break
+
+    def close(self):
+        """寫出剩餘日誌並停止背景執行緒；之後提交的日誌於呼叫端同步寫入"""
+        if self._thread is not None:
+            self._closing = True
+            self._wake.set()
+            self._thread.join()
+            self._closed = True
+            _live_writers.discard(self)
+            # 寫入執行緒最後一次處理後才附加的記錄
+            self._drain()
+        self.sink.close()
+
+    def queue_depth(self) -> int:
+        """目前等待寫入的日誌筆數"""
+        return len(self._buffer)
+
+    def stats(self) -> Dict[str, int]:
+        """取得寫入統計"""
+        stats = dict(self.counters)
+        stats['queued'] = self.queue_depth()
+        return stats
@@ -0,0 +1,272 @@
+"""
+Prometheus Metrics Exporter
+以 Prometheus 文字格式輸出 API Hook 的請求計數與延遲直方圖
+
+- 每個端點的請求計數（依方法、狀態碼、結果分類）
+- 以 2 的次方分桶的延遲直方圖（0.25ms ~ 32s），更新為 O(1)
+- 內建輕量 HTTP 執行緒提供 /metrics，或定期推送至 Pushgateway
+"""
+
+import math
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+import logging
+
+logger = logging.getLogger('api_hook.metrics')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 直方圖上界：2^-2 ms ~ 2^15 ms
+_MIN_EXPONENT = -2
+_MAX_EXPONENT = 15
+BUCKET_BOUNDS_MS = [2.0 ** e for e in range(_MIN_EXPONENT, _MAX_EXPONENT + 1)]
+
+
+def _bucket_index(value_ms: float) -> int:
+    """回傳 value_ms 所屬的桶索引（最後一個索引為 +Inf）"""
+    if value_ms <= BUCKET_BOUNDS_MS[0]:
+        return 0
+    mantissa, exponent = math.frexp(value_ms)
+    # value = mantissa * 2^exponent，0.5 <= mantissa < 1；剛好為 2 的次方時歸入較小的桶
+    if mantissa == 0.5:
+        exponent -= 1
+    index = exponent - _MIN_EXPONENT
+    return min(index, len(BUCKET_BOUNDS_MS))
+
+
+class LatencyHistogram:
+    """對數分桶的延遲直方圖"""
+
+    __slots__ = ('counts', 'total', 'sum_ms')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+
+    def observe(self, value_ms: float):
+        self.counts[_bucket_index(value_ms)] += 1
+        self.total += 1
+        self.sum_ms += value_ms
+
+    def quantile(self, q: float) -> float:
+        """
+        以桶內線性內插估算分位數（與 Prometheus histogram_quantile 相同算法）
+
+        Args:
+            q: 分位數 (0 ~ 1)
+
+        Returns:
+            估算的延遲（毫秒）；無資料時回傳 0
+        """
+        if self.total == 0:
+            return 0.0
+        rank = q * self.total
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                if index >= len(BUCKET_BOUNDS_MS):
+                    return BUCKET_BOUNDS_MS[-1]
+                lower = BUCKET_BOUNDS_MS[index - 1] if index else 0.0
+                upper = BUCKET_BOUNDS_MS[index]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return BUCKET_BOUNDS_MS[-1]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_bound(bound_ms: float) -> str:
+    return repr(bound_ms / 1000.0)
+
+
+class MetricsRegistry:
+    """
+    API Hook 指標登錄表
+
+    熱路徑（observe）僅做字典查詢與整數累加；文字格式在匯出時才產生。
+    """
+
+    def __init__(self, namespace: str = 'api_hook'):
+        self.namespace = namespace
+        self._requests: Dict[Tuple[str, str, int, str], int] = {}
+        self._latency: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint: str, method: str, status_code: int, result: str, response_time_ms: float):
+        """
+        記錄一次 API 呼叫
+
+        Args:
+            endpoint: API 端點路徑
+            method: HTTP 方法
+            status_code: 回應狀態碼
+            result: 呼叫結果 (success, error, blocked)
+            response_time_ms: 回應時間（毫秒）
+        """
+        key = (endpoint, method, status_code, result)
+        with self._lock:
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histogram = self._latency.get(endpoint)
+            if histogram is None:
+                histogram = self._latency[endpoint] = LatencyHistogram()
+            histogram.observe(response_time_ms)
+
+    def quantile(self, endpoint: str, q: float) -> float:
+        """估算端點延遲分位數（毫秒）"""
+        with self._lock:
+            histogram = self._latency.get(endpoint)
+            return histogram.quantile(q) if histogram else 0.0
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        取得各端點統計摘要
+
+        Returns:
+            {endpoint: {'count', 'errors', 'avg_ms', 'p50_ms', 'p99_ms'}}
+        """
+        with self._lock:
+            errors: Dict[str, int] = {}
+            for (endpoint, _, _, result), count in self._requests.items():
+                if result != 'success':
+                    errors[endpoint] = errors.get(endpoint, 0) + count
+            return {
+                endpoint: {
+                    'count': histogram.total,
+                    'errors': errors.get(endpoint, 0),
+                    'avg_ms': round(histogram.sum_ms / histogram.total, 2) if histogram.total else 0.0,
+                    'p50_ms': round(histogram.quantile(0.5), 2),
+                    'p99_ms': round(histogram.quantile(0.99), 2),
+                }
+                for endpoint, histogram in self._latency.items()
+            }
+
+    def render(self) -> str:
+        """以 Prometheus 文字格式 (0.0.4) 輸出所有指標"""
+        with self._lock:
+            requests = sorted(self._requests.items())
+            latency = sorted(
+                (endpoint, list(h.counts), h.total, h.sum_ms) for endpoint, h in self._latency.items()
+            )
+
+        ns = self.namespace
+        lines: List[str] = [
+            f'# HELP {ns}_requests_total Total monitored API calls.',
+            f'# TYPE {ns}_requests_total counter',
+        ]
+        for (endpoint, method, status_code, result), count in requests:
+            lines.append(
+                f'{ns}_requests_total{{endpoint="{_escape(endpoint)}",method="{_escape(method)}",'
+                f'code="{status_code}",result="{_escape(result)}"}} {count}'
+            )
+
+        lines.append(f'# HELP {ns}_request_duration_seconds API call latency.')
+        lines.append(f'# TYPE {ns}_request_duration_seconds histogram')
+        for endpoint, counts, total, sum_ms in latency:
+            label = f'endpoint="{_escape(endpoint)}"'
+            cumulative = 0
+            for bound, count in zip(BUCKET_BOUNDS_MS, counts):
+                cumulative += count
+                lines.append(
+                    f'{ns}_request_duration_seconds_bucket{{{label},le="{_format_bound(bound)}"}} {cumulative}'
+                )
+            lines.append(f'{ns}_request_duration_seconds_bucket{{{label},le="+Inf"}} {total}')
+            lines.append(f'{ns}_request_duration_seconds_sum{{{label}}} {sum_ms / 1000.0!r}')
+            lines.append(f'{ns}_request_duration_seconds_count{{{label}}} {total}')
+
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """在背景執行緒中提供 /metrics 的輕量 HTTP 伺服器"""
+
+    def __init__(self, registry: MetricsRegistry, port: int = 9090,
+                 path: str = '/metrics', host: str = '0.0.0.0'):
+        self.registry = registry
+        self.path = path
+
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != exporter.path:
+                    self.send_error(404)
+                    return
+                body = exporter.registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='api-hook-metrics', daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> 'MetricsServer':
+        self._thread.start()
+        logger.info(f"Metrics exporter listening on :{self.port}{self.path}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def push_to_gateway(registry: MetricsRegistry, gateway_url: str, job: str, timeout: float = 5.0):
+    """
+    將目前的指標推送至 Prometheus Pushgateway
+
+    Args:
+        registry: 指標登錄表
+        gateway_url: Pushgateway 位址（如 http://prometheus:9091）
+        job: Pushgateway job 名稱
+        timeout: 連線逾時（秒）
+    """
+    url = f"{gateway_url.rstrip('/')}/metrics/job/{job}"
+    request = urllib.request.Request(
+        url,
+        data=registry.render().encode('utf-8'),
+        method='PUT',
+        headers={'Content-Type': CONTENT_TYPE},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+
+
+class PushGatewayThread:
+    """定期推送指標至 Pushgateway 的背景執行緒"""
+
+    def __init__(self, registry: MetricsRegistry, gateway_url: str, job: str, interval_seconds: float = 15):
+        self.registry = registry
+        self.gateway_url = gateway_url
+        self.job = job
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='api-hook-pushgateway', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                push_to_gateway(self.registry, self.gateway_url, self.job)
+            except OSError as e:
+                logger.warning(f"Pushgateway push failed: {e}")
+
+    def start(self) -> 'PushGatewayThread':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+"""
+WSGI / ASGI Middleware
+以中介層監控整個 Python Web 應用程式（對應 api_hook.js 的 Express middleware）
+
+- 請求資訊取自 WSGI environ / ASGI scope（REMOTE_ADDR、client、X-Forwarded-For、REMOTE_USER 等）
+- 分別量測首位元組時間（ttfb_ms）與完整串流時間（response_time_ms）
+- 以包裝 wsgi.input / receive 與回應迭代器 / send 的方式計算請求與回應位元組數，不緩衝內容
+- endpoints.excluded 中的路徑直接交給應用程式，不做任何處理；
+  endpoints.monitored 的 path 樣式決定安全等級（影響取樣）
+- 日誌、指標與異常偵測的 endpoint 為符合的 monitored 樣式（未符合者為 other），
+  實際路徑另記於 path，避免含 ID 的路徑使指標與視窗數量無限增長
+
+python middleware.py --requests 20000 可比較中介層與未包裝應用程式的每次請求耗時。
+"""
+
+import argparse
+import asyncio
+import math
+import sys
+import time
+from fnmatch import fnmatchcase
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl
+
+from log_writer import LogRecord, next_request_id
+from rate_limiter import RateLimitExceeded
+
+_MISSING = object()
+_TOO_MANY_REQUESTS = b'Too Many Requests'
+
+# 未符合任何 monitored 樣式的路徑所使用的 endpoint 名稱
+UNMATCHED_ENDPOINT = 'other'
+
+
+class EndpointPolicy:
+    """
+    依 endpoints 設定決定路徑的安全等級與 endpoint 名稱
+
+    match() 的結果以路徑為鍵快取；排除的路徑回傳 None。
+    """
+
+    def __init__(
+        self,
+        monitored: Sequence[Dict[str, Any]] = (),
+        excluded: Sequence[str] = (),
+        default_level: str = 'medium',
+        cache_size: int = 10000
+    ):
+        """
+        Args:
+            monitored: endpoints.monitored（path 可使用 * 萬用字元，依序比對）
+            excluded: endpoints.excluded（不記錄的路徑，可使用 * 萬用字元）
+            default_level: 未符合任何 monitored 樣式時的安全等級
+            cache_size: 快取的路徑數上限（避免含 ID 的路徑無限增長）
+        """
+        self.patterns = [(item['path'], item.get('security_level', default_level)) for item in monitored]
+        self.excluded = list(excluded)
+        self.default_level = default_level
+        self.cache_size = cache_size
+        self._cache: Dict[str, Optional[Tuple[str, str]]] = {}
+
+    @classmethod
+    def from_config(cls, endpoints: Dict[str, Any]) -> 'EndpointPolicy':
+        """從 endpoints 設定建立"""
+        return cls(endpoints.get('monitored', []), endpoints.get('excluded', []))
+
+    def match(self, path: str) -> Optional[Tuple[str, str]]:
+        """
+        Returns:
+            (安全等級, endpoint 名稱)；endpoint 為符合的 monitored 樣式，
+            未符合者為 UNMATCHED_ENDPOINT；排除的路徑回傳 None
+        """
+        matched = self._cache.get(path, _MISSING)
+        if matched is not _MISSING:
+            return matched
+        matched = (self.default_level, UNMATCHED_ENDPOINT)
+        if any(fnmatchcase(path, pattern) for pattern in self.excluded):
+            matched = None
+        else:
+            for pattern, pattern_level in self.patterns:
+                if fnmatchcase(path, pattern):
+                    matched = (pattern_level, pattern)
+                    break
+        if len(self._cache) < self.cache_size:
+            self._cache[path] = matched
+        return matched
+
+    def resolve(self, path: str) -> Optional[str]:
+        """
+        Returns:
+            路徑的安全等級；排除的路徑回傳 None
+        """
+        matched = self.match(path)
+        return matched[0] if matched is not None else None
+
+
+def client_ip(peer: Optional[str], forwarded_for: Optional[str], trusted_proxy_count: int) -> str:
+    """
+    取得用戶端 IP
+
+    只有在前方有 trusted_proxy_count 層受信任的反向代理時才採用 X-Forwarded-For，
+    並取由右數第 trusted_proxy_count 個位址（用戶端可自行偽造左側的值）。
+    """
+    if trusted_proxy_count and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(',')]
+        if len(hops) >= trusted_proxy_count:
+            return hops[-trusted_proxy_count]
+    return peer or '0.0.0.0'
+
+
+class _Exchange:
+    """單一請求的量測狀態"""
+
+    __slots__ = (
+        'started', 'request_id', 'source_ip', 'method', 'endpoint', 'path', 'parameters', 'security_level',
+        'status', 'first_byte', 'request_bytes', 'response_bytes', 'error', 'completed', 'finished',
+    )
+
+    def __init__(self, source_ip: str, method: str, endpoint: str, path: str, parameters: Dict[str, Any],
+                 security_level: str):
+        self.started = time.perf_counter()
+        self.request_id = next_request_id()
+        self.source_ip = source_ip
+        self.method = method
+        self.endpoint = endpoint
+        self.path = path
+        self.parameters = parameters
+        self.security_level = security_level
+        self.status = None
+        self.first_byte = None
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.error = None
+        self.completed = False
+        self.finished = False
+
+
+class _Middleware:
+    """WSGI 與 ASGI 中介層的共用邏輯"""
+
+    def __init__(
+        self,
+        app: Callable,
+        hook: Any,
+        trusted_proxy_count: int = 0,
+        log_params: bool = True,
+        user_id: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None,
+        policy: Optional[EndpointPolicy] = None
+    ):
+        """
+        Args:
+            app: 被包裝的應用程式
+            hook: APIHook 實例（使用其 rate_limiter 與 record()）
+            trusted_proxy_count: 前方受信任反向代理的層數（0 表示忽略 X-Forwarded-For）
+            log_params: 是否將查詢字串記錄為 parameters（請求內容不緩衝、不記錄）
+            user_id: 自訂取得使用者 ID 的函數（參數為 environ / scope，於回應結束後呼叫）
+            policy: 端點設定（預設取自 hook.config['endpoints']）
+        """
+        self.app = app
+        self.hook = hook
+        self.trusted_proxy_count = trusted_proxy_count
+        self.log_params = log_params
+        self.user_id = user_id
+        self.policy = policy or EndpointPolicy.from_config(hook.config.get('endpoints', {}))
+
+    def _parameters(self, query: str) -> Dict[str, Any]:
+        if not self.log_params or not query:
+            return {}
+        return {'query': dict(parse_qsl(query, keep_blank_values=True))}
+
+    def _check_rate_limit(self, exchange: _Exchange) -> Optional[RateLimitExceeded]:
+        limiter = self.hook.rate_limiter
+        if limiter is None:
+            return None
+        try:
+            limiter.check(exchange.source_ip)
+        except RateLimitExceeded as e:
+            exchange.status = 429
+            exchange.error = e
+            return e
+        return None
+
+    def _finish(self, exchange: _Exchange, user_id: Optional[str]):
+        """記錄一次請求（每個請求只會執行一次）"""
+        if exchange.finished:
+            return
+        exchange.finished = True
+        end = time.perf_counter()
+        status = exchange.status
+        error_message = None
+        if isinstance(exchange.error, RateLimitExceeded):
+            result = 'blocked'
+            error_message = str(exchange.error)
+        elif exchange.error is not None:
+            # 回應標頭已送出時保留原狀態碼
+            status = status or 500
+            result = 'error'
+            error_message = str(exchange.error)
+        elif status is not None and status >= 500:
+            result = 'error'
+            error_message = f"HTTP {status}"
+        else:
+            status = status or 200
+            result = 'success'
+            if not exchange.completed:
+                error_message = 'response not fully sent'
+        first_byte = exchange.first_byte if exchange.first_byte is not None else end
+        self.hook.record(LogRecord(
+            time.time(), exchange.request_id, user_id or 'anonymous', exchange.source_ip, exchange.method,
+            exchange.endpoint, exchange.parameters, status, (end - exchange.started) * 1000,
+            result, error_message, 1.0, (first_byte - exchange.started) * 1000,
+            exchange.request_bytes, exchange.response_bytes, exchange.path
+        ), exchange.security_level)
+
+
+# ---------------------------------------------------------------------------
+# WSGI
+# ---------------------------------------------------------------------------
+
+class _CountingInput:
+    """計算已讀取位元組數的 wsgi.input 包裝"""
+
+    def __init__(self, stream: Any, exchange: _Exchange):
+        self._stream = stream
+        self._exchange = exchange
+
+    def read(self, *args) -> bytes:
+        data = self._stream.read(*args)
+        self._exchange.request_bytes += len(data)
+        return data
+
+    def readline(self, *args) -> bytes:
+        line = self._stream.readline(*args)
+        self._exchange.request_bytes += len(line)
+        return line
+
+    def readlines(self, *args) -> List[bytes]:
+        lines = self._stream.readlines(*args)
+        self._exchange.request_bytes += sum(len(line) for line in lines)
+        return lines
+
+    def __iter__(self):
+        for line in self._stream:
+            self._exchange.request_bytes += len(line)
+            yield line
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._stream, name)
+
+
+class _ResponseIterator:
+    """
+    逐塊轉交回應內容並計時
+
+    WSGI 伺服器在送完（或中斷）回應後呼叫 close()，此時才記錄日誌，
+    因此 response_time_ms 涵蓋完整的串流時間。
+    """
+
+    def __init__(self, iterable: Iterable[bytes], exchange: _Exchange, finish: Callable[[], None]):
+        self._iterable = iterable
+        self._iterator = None
+        self._exchange = exchange
+        self._finish = finish
+
+    def __iter__(self):
+        self._iterator = iter(self._iterable)
+        return self
+
+    def __next__(self) -> bytes:
+        exchange = self._exchange
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            exchange.completed = True
+            raise
+        except Exception as e:
+            exchange.error = e
+            raise
+        if chunk:
+            if exchange.first_byte is None:
+                exchange.first_byte = time.perf_counter()
+            exchange.response_bytes += len(chunk)
+        return chunk
+
+    def close(self):
+        try:
+            close = getattr(self._iterable, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self._finish()
+
+
+class WSGIMiddleware(_Middleware):
+    """
+    WSGI 中介層
+
+    Example:
+        app.wsgi_app = WSGIMiddleware(app.wsgi_app, hook)
+    """
+
+    def _user_id(self, environ: Dict[str, Any]) -> Optional[str]:
+        if self.user_id is not None:
+            return self.user_id(environ)
+        return environ.get('REMOTE_USER')
+
+    def __call__(self, environ: Dict[str, Any], start_response: Callable) -> Iterable[bytes]:
+        path = environ.get('PATH_INFO') or '/'
+        matched = self.policy.match(path)
+        if matched is None:
+            return self.app(environ, start_response)
+        security_level, endpoint = matched
+
+        exchange = _Exchange(
+            client_ip(environ.get('REMOTE_ADDR'), environ.get('HTTP_X_FORWARDED_FOR'), self.trusted_proxy_count),
+            environ.get('REQUEST_METHOD', 'GET'),
+            endpoint,
+            path,
+            self._parameters(environ.get('QUERY_STRING', '')),
+            security_level
+        )
+
+        def finish():
+            self._finish(exchange, self._user_id(environ))
+
+        blocked = self._check_rate_limit(exchange)
+        if blocked is not None:
+            start_response('429 Too Many Requests', [
+                ('Content-Type', 'text/plain'),
+                ('Content-Length', str(len(_TOO_MANY_REQUESTS))),
+                ('Retry-After', str(math.ceil(blocked.retry_after))),
+            ])
+            exchange.response_bytes = len(_TOO_MANY_REQUESTS)
+            finish()
+            return [_TOO_MANY_REQUESTS]
+
+        if 'wsgi.input' in environ:
+            environ['wsgi.input'] = _CountingInput(environ['wsgi.input'], exchange)
+
+        def monitored_start_response(status: str, headers: List[Tuple[str, str]], exc_info=None):
+            exchange.status = int(status[:3])
+            write = start_response(status, headers, exc_info)
+
+            def counting_write(data: bytes):
+                # 舊式 write() 介面：同樣計入首位元組與回應大小
+                if data and exchange.first_byte is None:
+                    exchange.first_byte = time.perf_counter()
+                exchange.response_bytes += len(data)
+                return write(data)
+
+            return counting_write
+
+        try:
+            iterable = self.app(environ, monitored_start_response)
+        except Exception as e:
+            exchange.error = e
+            finish()
+            raise
+        return _ResponseIterator(iterable, exchange, finish)
+
+
+# ---------------------------------------------------------------------------
+# ASGI
+# ---------------------------------------------------------------------------
+
+def _header(scope: Dict[str, Any], name: bytes) -> Optional[str]:
+    for key, value in scope.get('headers') or ():
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+class ASGIMiddleware(_Middleware):
+    """
+    ASGI 中介層（僅處理 http 類型，websocket / lifespan 直接轉交）
+
+    Example:
+        app = ASGIMiddleware(app, hook)
+    """
+
+    def _user_id(self, scope: Dict[str, Any]) -> Optional[str]:
+        if self.user_id is not None:
+            return self.user_id(scope)
+        # Starlette AuthenticationMiddleware 於 scope['user'] 放入使用者物件
+        user = scope.get('user')
+        if user is not None and getattr(user, 'is_authenticated', False):
+            return getattr(user, 'identity', None)
+        return None
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        path = scope.get('path') or '/'
+        matched = self.policy.match(path)
+        if matched is None:
+            await self.app(scope, receive, send)
+            return
+        security_level, endpoint = matched
+
+        client = scope.get('client')
+        forwarded_for = _header(scope, b'x-forwarded-for') if self.trusted_proxy_count else None
+        exchange = _Exchange(
+            client_ip(client[0] if client else None, forwarded_for, self.trusted_proxy_count),
+            scope.get('method', 'GET'),
+            endpoint,
+            path,
+            self._parameters(scope.get('query_string', b'').decode('latin-1')),
+            security_level
+        )
+
+        blocked = self._check_rate_limit(exchange)
+        if blocked is not None:
+            await send({
+                'type': 'http.response.start',
+                'status': 429,
+                'headers': [
+                    (b'content-type', b'text/plain'),
+                    (b'content-length', str(len(_TOO_MANY_REQUESTS)).encode('ascii')),
+                    (b'retry-after', str(math.ceil(blocked.retry_after)).encode('ascii')),
+                ],
+            })
+            await send({'type': 'http.response.body', 'body': _TOO_MANY_REQUESTS})
+            exchange.response_bytes = len(_TOO_MANY_REQUESTS)
+            self._finish(exchange, self._user_id(scope))
+            return
+
+        async def counting_receive() -> Dict[str, Any]:
+            message = await receive()
+            if message['type'] == 'http.request':
+                exchange.request_bytes += len(message.get('body', b''))
+            return message
+
+        async def timing_send(message: Dict[str, Any]):
+            message_type = message['type']
+            if message_type == 'http.response.start':
+                exchange.status = message['status']
+            elif message_type == 'http.response.body':
+                body = message.get('body', b'')
+                if body and exchange.first_byte is None:
+                    exchange.first_byte = time.perf_counter()
+                exchange.response_bytes += len(body)
+                if not message.get('more_body', False):
+                    exchange.completed = True
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, timing_send)
+        except Exception as e:
+            exchange.error = e
+            raise
+        finally:
+            self._finish(exchange, self._user_id(scope))
+
+
+# ---------------------------------------------------------------------------
+# 基準測試
+# ---------------------------------------------------------------------------
+
+_BENCH_BODY = b'{"status": "success"}'
+
+
+def _bench_wsgi_app(environ, start_response):
+    environ['wsgi.input'].read()
+    start_response('200 OK', [('Content-Type', 'application/json')])
+    return [_BENCH_BODY]
+
+
+async def _bench_asgi_app(scope, receive, send):
+    await receive()
+    await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+    await send({'type': 'http.response.body', 'body': _BENCH_BODY})
+
+
+def _wsgi_environ() -> Dict[str, Any]:
+    import io
+    return {
+        'REQUEST_METHOD': 'POST', 'PATH_INFO': '/api/v1/users', 'QUERY_STRING': 'page=2',
+        'REMOTE_ADDR': '192.168.1.100', 'wsgi.input': io.BytesIO(b'{"name": "x"}'),
+    }
+
+
+def _time_wsgi(app: Callable, requests: int) -> float:
+    def start_response(status, headers, exc_info=None):
+        return lambda data: None
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        iterable = app(_wsgi_environ(), start_response)
+        for _ in iterable:
+            pass
+        close = getattr(iterable, 'close', None)
+        if close is not None:
+            close()
+    return (time.perf_counter() - start) / requests
+
+
+def _time_asgi(app: Callable, requests: int) -> float:
+    scope = {
+        'type': 'http', 'method': 'POST', 'path': '/api/v1/users', 'query_string': b'page=2',
+        'headers': [], 'client': ('192.168.1.100', 50000),
+    }
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'{"name": "x"}', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    async def run() -> float:
+        start = time.perf_counter()
+        for _ in range(requests):
+            await app(dict(scope), receive, send)
+        return (time.perf_counter() - start) / requests
+
+    return asyncio.run(run())
+
+
+def benchmark(hook: Any, requests: int = 20000, rounds: int = 3) -> Dict[str, Dict[str, float]]:
+    """
+    以同一個請求量測未包裝與包裝後應用程式的每次請求耗時（微秒，取最佳一輪）
+
+    Returns:
+        {'wsgi': {'bare_us', 'monitored_us', 'overhead_us'}, 'asgi': {...}}
+    """
+    cases = {
+        'wsgi': (_time_wsgi, _bench_wsgi_app, WSGIMiddleware(_bench_wsgi_app, hook)),
+        'asgi': (_time_asgi, _bench_asgi_app, ASGIMiddleware(_bench_asgi_app, hook)),
+    }
+    results = {}
+    for name, (timer, bare, monitored) in cases.items():
+        bare_us = min(timer(bare, requests) for _ in range(rounds)) * 1e6
+        monitored_us = min(timer(monitored, requests) for _ in range(rounds)) * 1e6
+        results[name] = {
+            'bare_us': bare_us,
+            'monitored_us': monitored_us,
+            'overhead_us': monitored_us - bare_us,
+        }
+    return results
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """主程式入口"""
+    import logging
+    from api_hook import APIHook
+    from rate_limiter import RateLimiter
+
+    parser = argparse.ArgumentParser(description='WSGI / ASGI 中介層開銷基準測試')
+    parser.add_argument('--requests', type=int, default=20000, help='每輪請求數')
+    parser.add_argument('--rounds', type=int, default=3, help='量測輪數（取最佳值）')
+    args = parser.parse_args(argv)
+
+    logging.getLogger('api_hook').setLevel(logging.WARNING)
+    hook = APIHook()
+    hook.rate_limiter = RateLimiter(max_requests_per_minute=10 ** 9, max_requests_per_hour=10 ** 9)
+    try:
+        results = benchmark(hook, args.requests, args.rounds)
+    finally:
+        hook.close()
+
+    print(f"{'':6} {'bare us':>10} {'hooked us':>10} {'overhead':>10}")
+    for name, row in results.items():
+        print(f"{name:6} {row['bare_us']:>10.2f} {row['monitored_us']:>10.2f} {row['overhead_us']:>10.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
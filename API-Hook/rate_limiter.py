@@ -0,0 +1,174 @@
+"""
+Rate Limiter
+依 security.rate_limiting 設定限制每個來源的請求速率
+
+採用「滑動視窗計數器」近似演算法：每個來源僅保存目前與前一個固定視窗的計數，
+以前一視窗剩餘比例加權估算滑動視窗內的請求數，更新與判斷皆為 O(1)。
+狀態分散於多個條帶（stripe），各自擁有獨立的鎖與 LRU 表，降低多執行緒競爭。
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+
+class RateLimitExceeded(Exception):
+    """請求超過速率限制"""
+
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded for {key}, retry after {retry_after:.0f}s")
+        self.key = key
+        self.retry_after = retry_after
+
+
+class _ClientState:
+    """單一來源的計數狀態"""
+
+    __slots__ = (
+        'minute_start', 'minute_count', 'minute_prev',
+        'hour_start', 'hour_count', 'hour_prev',
+        'blocked_until', 'last_seen',
+    )
+
+    def __init__(self, now: float):
+        self.minute_start = now - now % 60
+        self.minute_count = 0
+        self.minute_prev = 0
+        self.hour_start = now - now % 3600
+        self.hour_count = 0
+        self.hour_prev = 0
+        self.blocked_until = 0.0
+        self.last_seen = now
+
+
+class _Stripe:
+    """一個條帶：獨立的鎖、LRU 表與計數器"""
+
+    __slots__ = ('lock', 'clients', 'hits', 'blocks', 'evictions')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clients: 'OrderedDict[str, _ClientState]' = OrderedDict()
+        self.hits = 0
+        self.blocks = 0
+        self.evictions = 0
+
+
+def _estimate(count: int, previous: int, start: float, window: float, now: float) -> float:
+    """以前一視窗剩餘比例加權，估算滑動視窗內的請求數"""
+    return previous * (1.0 - (now - start) / window) + count
+
+
+class RateLimiter:
+    """
+    記憶體有上限的速率限制器
+
+    同時套用每分鐘與每小時上限；超過任一上限的來源會被封鎖 block_duration_seconds 秒。
+    追蹤的來源數量以 LRU 限制在 max_clients 內，大量 IP 掃描時最久未出現的來源會先被淘汰。
+    """
+
+    def __init__(
+        self,
+        max_requests_per_minute: int = 1000,
+        max_requests_per_hour: int = 10000,
+        block_duration_seconds: float = 300,
+        max_clients: int = 100000,
+        stripes: int = 64,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        初始化速率限制器
+
+        Args:
+            max_requests_per_minute: 每分鐘請求上限
+            max_requests_per_hour: 每小時請求上限
+            block_duration_seconds: 超限後的封鎖時間（秒）
+            max_clients: 追蹤的來源數量上限
+            stripes: 鎖條帶數量
+            clock: 單調時鐘函數（測試時可替換）
+        """
+        self.max_per_minute = max_requests_per_minute
+        self.max_per_hour = max_requests_per_hour
+        self.block_duration = block_duration_seconds
+        self._stripes = [_Stripe() for _ in range(stripes)]
+        self._per_stripe = max(1, -(-max_clients // stripes))
+        self._clock = clock
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], **kwargs) -> Optional['RateLimiter']:
+        """
+        從 security.rate_limiting 設定建立限制器
+
+        Returns:
+            RateLimiter 實例；設定停用時回傳 None
+        """
+        if not config.get('enabled', False):
+            return None
+        return cls(
+            max_requests_per_minute=config.get('max_requests_per_minute', 1000),
+            max_requests_per_hour=config.get('max_requests_per_hour', 10000),
+            block_duration_seconds=config.get('block_duration_seconds', 300),
+            **kwargs
+        )
+
+    def check(self, key: str):
+        """
+        記錄一次請求並檢查是否超限
+
+        Args:
+            key: 來源識別（通常為 source_ip）
+
+        Raises:
+            RateLimitExceeded: 來源已被封鎖或本次請求超過上限
+        """
+        stripe = self._stripes[hash(key) % len(self._stripes)]
+        with stripe.lock:
+            now = self._clock()
+            clients = stripe.clients
+            state = clients.get(key)
+            if state is None:
+                state = clients[key] = _ClientState(now)
+                if len(clients) > self._per_stripe:
+                    clients.popitem(last=False)
+                    stripe.evictions += 1
+            else:
+                clients.move_to_end(key)
+            state.last_seen = now
+
+            if now < state.blocked_until:
+                stripe.blocks += 1
+                raise RateLimitExceeded(key, state.blocked_until - now)
+
+            if now - state.minute_start >= 60:
+                elapsed = (now - state.minute_start) // 60
+                state.minute_prev = state.minute_count if elapsed == 1 else 0
+                state.minute_count = 0
+                state.minute_start += elapsed * 60
+            if now - state.hour_start >= 3600:
+                elapsed = (now - state.hour_start) // 3600
+                state.hour_prev = state.hour_count if elapsed == 1 else 0
+                state.hour_count = 0
+                state.hour_start += elapsed * 3600
+
+            per_minute = _estimate(state.minute_count, state.minute_prev, state.minute_start, 60, now)
+            per_hour = _estimate(state.hour_count, state.hour_prev, state.hour_start, 3600, now)
+            if per_minute >= self.max_per_minute or per_hour >= self.max_per_hour:
+                state.blocked_until = now + self.block_duration
+                stripe.blocks += 1
+                raise RateLimitExceeded(key, self.block_duration)
+
+            state.minute_count += 1
+            state.hour_count += 1
+            stripe.hits += 1
+
+    def stats(self) -> Dict[str, int]:
+        """取得放行、封鎖、追蹤中來源與淘汰次數的統計"""
+        totals = {'hits': 0, 'blocks': 0, 'tracked_clients': 0, 'evictions': 0}
+        for stripe in self._stripes:
+            with stripe.lock:
+                totals['hits'] += stripe.hits
+                totals['blocks'] += stripe.blocks
+                totals['tracked_clients'] += len(stripe.clients)
+                totals['evictions'] += stripe.evictions
+        return totals
@@ -0,0 +1,139 @@
+"""
+Adaptive Log Sampler
+依端點安全等級對 API 呼叫日誌做尾端取樣（tail-based sampling）
+
+- critical / high 端點一律完整記錄
+- low 端點依取樣率記錄；錯誤、401 與慢速呼叫一律保留
+- 取樣率依實際流量自動調整，使取樣日誌維持在每秒目標筆數內
+- 保留的日誌帶有 sampling_weight（= 1 / 取樣率），可由權重加總還原實際呼叫數
+"""
+
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+# 一律完整記錄的安全等級
+ALWAYS_KEEP_LEVELS = frozenset(('critical', 'high'))
+
+
+class AdaptiveSampler:
+    """
+    依安全等級與呼叫結果決定是否保留日誌
+
+    取樣決策在呼叫完成後才做（已知狀態碼與耗時），因此異常呼叫不會被取樣掉。
+    """
+
+    def __init__(
+        self,
+        rates: Optional[Dict[str, float]] = None,
+        target_entries_per_second: Optional[float] = None,
+        slow_threshold_ms: float = 1000,
+        min_rate: float = 0.001,
+        adjust_interval_seconds: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+        rng: Callable[[], float] = random.random
+    ):
+        """
+        初始化取樣器
+
+        Args:
+            rates: 各安全等級的取樣率（未列出的等級完整記錄，如 {'low': 0.1}）；
+                   設定 target_entries_per_second 時為初始值
+            target_entries_per_second: 取樣日誌的每秒目標筆數（None 表示固定取樣率）
+            slow_threshold_ms: 超過此耗時的呼叫一律保留
+            min_rate: 自動調整時的取樣率下限
+            adjust_interval_seconds: 重新計算取樣率的間隔
+            clock: 單調時鐘函數（測試時可替換）
+            rng: 回傳 [0, 1) 亂數的函數（測試時可替換）
+        """
+        self.rates = {
+            level: min(1.0, max(min_rate, float(rate)))
+            for level, rate in (rates if rates is not None else {'low': 0.1}).items()
+            if level not in ALWAYS_KEEP_LEVELS
+        }
+        self.target_entries_per_second = target_entries_per_second
+        self.slow_threshold_ms = slow_threshold_ms
+        self.min_rate = min_rate
+        self.adjust_interval_seconds = adjust_interval_seconds
+        self._clock = clock
+        self._random = rng
+        self._lock = threading.Lock()
+        self._window_start = clock()
+        self._offered: Dict[str, int] = {}
+        self.counters = {'kept': 0, 'sampled_out': 0, 'forced': 0}
+
+    @classmethod
+    def from_config(cls, sampling: Dict[str, Any], **kwargs) -> Optional['AdaptiveSampler']:
+        """
+        從 performance.sampling 設定建立取樣器
+
+        Returns:
+            AdaptiveSampler 實例；未啟用時回傳 None
+        """
+        if not sampling.get('enabled', False):
+            return None
+        return cls(
+            rates=sampling.get('rates', {'low': 0.1}),
+            target_entries_per_second=sampling.get('target_entries_per_second'),
+            slow_threshold_ms=sampling.get('slow_threshold_ms', 1000),
+            **kwargs
+        )
+
+    def sample(self, security_level: str, response_code: int, result: str, response_time_ms: float) -> float:
+        """
+        決定是否保留一筆日誌
+
+        Args:
+            security_level: 端點安全等級
+            response_code: 回應狀態碼
+            result: 呼叫結果 (success, error, blocked)
+            response_time_ms: 回應時間（毫秒）
+
+        Returns:
+            取樣權重；0 表示捨棄，1 表示完整記錄，> 1 表示此筆代表多筆呼叫
+        """
+        rate = self.rates.get(security_level)
+        if rate is None:
+            return 1.0
+        if (result != 'success' or response_code == 401 or response_code >= 500
+                or response_time_ms >= self.slow_threshold_ms):
+            with self._lock:
+                self.counters['forced'] += 1
+            return 1.0
+
+        with self._lock:
+            self._offered[security_level] = self._offered.get(security_level, 0) + 1
+            now = self._clock()
+            if now - self._window_start >= self.adjust_interval_seconds:
+                self._adjust(now)
+            rate = self.rates[security_level]
+            if rate >= 1.0 or self._random() < rate:
+                self.counters['kept'] += 1
+                return 1.0 / rate
+            self.counters['sampled_out'] += 1
+            return 0.0
+
+    def _adjust(self, now: float):
+        """依上一個區間的流量重新計算各等級的取樣率（需持有 _lock）"""
+        elapsed = now - self._window_start
+        self._window_start = now
+        offered, self._offered = self._offered, {}
+        if not self.target_entries_per_second:
+            return
+        # 目標筆數依各等級的流量比例分配
+        total = sum(offered.values())
+        for level in self.rates:
+            count = offered.get(level, 0)
+            if not count:
+                continue
+            budget = self.target_entries_per_second * count / total
+            rate = budget / (count / elapsed)
+            self.rates[level] = min(1.0, max(self.min_rate, rate))
+
+    def stats(self) -> Dict[str, Any]:
+        """取得取樣統計與目前的取樣率"""
+        with self._lock:
+            stats: Dict[str, Any] = dict(self.counters)
+            stats['rates'] = dict(self.rates)
+        return stats
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Shared Counters
+以 multiprocessing.shared_memory 在多個 worker 行程之間共享速率限制與異常偵測的計數
+
+- 固定大小的雜湊計數表（count-min sketch）：不保存鍵，記憶體用量固定，碰撞只會多算不會少算
+- 每個 worker 行程寫入自己的 lane，不需要跨行程的鎖或原子指令；讀取時加總所有 lane
+- 每個欄位保存目前與前一個固定視窗的計數，以前一視窗剩餘比例加權估算滑動視窗（同 rate_limiter.py）
+
+python shared_state.py --workers 4 8 16 可量測不同 worker 數下的每次更新成本。
+"""
+
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+import zlib
+from multiprocessing import shared_memory
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import logging
+
+from log_writer import _pid_alive
+from rate_limiter import RateLimitExceeded
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger('api_hook.shared_state')
+
+_MAGIC = 0x41504948  # 'APIH'
+_VERSION = 1
+# 標頭：magic, version, lanes, rows, slots, fields, window_ms, lanes_used
+_HEADER = struct.Struct('<8i')
+_INT = 4
+
+
+def _attach(name: str, size: int, timeout: float = 2.0) -> Tuple[shared_memory.SharedMemory, bool]:
+    """
+    建立或連接共享記憶體；回傳 (區塊, 是否為新建)
+
+    建立者以 shm_open 建立區塊後才 ftruncate 設定大小；在兩者之間連接會得到空檔案
+    （mmap 拋出 ValueError），因此在 timeout 內重試直到大小設定完成。
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            block, created = shared_memory.SharedMemory(name=name, create=True, size=size), True
+            break
+        except FileExistsError:
+            pass
+        try:
+            block, created = shared_memory.SharedMemory(name=name), False
+            break
+        except (FileNotFoundError, ValueError):
+            # FileNotFoundError：建立者在兩次嘗試之間 unlink，重新建立
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.001)
+    # 區塊的生命週期由部署端管理（unlink()），不交給個別 worker 的 resource_tracker：
+    # 否則第一個結束的 worker 會刪除其他 worker 仍在使用的區塊
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(block._name, 'shared_memory')
+    except Exception:  # pragma: no cover - 視平台而定
+        pass
+    return block, created
+
+
+def _init_header(block: shared_memory.SharedMemory, created: bool, header: Tuple[int, ...],
+                 timeout: float = 2.0):
+    """
+    寫入或驗證區塊標頭
+
+    建立者最後才寫入 magic；其他行程可能在標頭寫入前就連接上，因此等待 magic 出現後再比對。
+
+    Raises:
+        ValueError: 既有區塊的參數與本次不同
+    """
+    if created:
+        _HEADER.pack_into(block.buf, 0, 0, *header[1:], 0)
+        struct.pack_into('<i', block.buf, 0, header[0])
+        return
+    deadline = time.monotonic() + timeout
+    while struct.unpack_from('<i', block.buf, 0)[0] == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    if _HEADER.unpack_from(block.buf, 0)[:7] != header:
+        block.close()
+        raise ValueError(f"共享記憶體 {block.name} 的參數與目前設定不同")
+
+
+def _hashes(key: str, rows: int, slots: int) -> List[int]:
+    data = key.encode('utf-8')
+    return [zlib.crc32(data, row * 0x9E3779B1 & 0xFFFFFFFF) % slots for row in range(rows)]
+
+
+class _LaneLock:
+    """以 lock 檔序列化 lane 的分配（僅在 worker 啟動時使用一次）"""
+
+    def __init__(self, name: str):
+        self.path = os.path.join(tempfile.gettempdir(), f'{name}.lock')
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class SharedCounters:
+    """
+    跨行程的滑動視窗計數表
+
+    add(key, values) 將數值加到本行程 lane 的目前視窗，並回傳所有 lane 加總後的
+    滑動視窗估計值；每個欄位在 rows 個雜湊位置中取最小值（count-min）。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fields: int,
+        window_seconds: float,
+        slots: int = 8192,
+        rows: int = 2,
+        lanes: int = 64,
+        clock: Callable[[], float] = time.time
+    ):
+        """
+        建立或連接共享計數表
+
+        Args:
+            name: 共享記憶體名稱（同一部署的所有 worker 必須相同）
+            fields: 每個鍵的計數欄位數
+            window_seconds: 滑動視窗長度（秒）
+            slots: 每列的雜湊位置數
+            rows: 雜湊列數（count-min 的深度）
+            lanes: 最多可連接的 worker 行程數
+            clock: 各行程共用的時間函數（預設 time.time）
+
+        Raises:
+            ValueError: 既有的共享記憶體參數與本次不同
+            RuntimeError: lane 已用盡
+        """
+        self.name = name
+        self.fields = fields
+        self.window_seconds = window_seconds
+        self.slots = slots
+        self.rows = rows
+        self.lanes = lanes
+        self._clock = clock
+        # 每個 lane 的一個位置：視窗編號 + 目前計數 + 前一視窗計數
+        self._stride = 1 + 2 * fields
+        size = _HEADER.size + lanes * 8 + rows * slots * lanes * self._stride * _INT
+        self._shm, created = _attach(name, size)
+        header = (_MAGIC, _VERSION, lanes, rows, slots, fields, int(window_seconds * 1000))
+        _init_header(self._shm, created, header)
+        self._pids = self._shm.buf[_HEADER.size:_HEADER.size + lanes * 8].cast('q')
+        self._data = self._shm.buf[_HEADER.size + lanes * 8:].cast('i')
+        self._pid = 0
+        self.lane = self._claim_lane()
+
+    def _claim_lane(self) -> int:
+        """分配本行程的 lane；已結束行程的 lane 可重新使用（保留其計數直到視窗過期）"""
+        pid = self._pid = os.getpid()
+        with _LaneLock(self.name):
+            for lane in range(self.lanes):
+                owner = self._pids[lane]
+                if owner == pid or not _pid_alive(owner):
+                    self._pids[lane] = pid
+                    lanes_used = _HEADER.unpack_from(self._shm.buf, 0)[7]
+                    if lane + 1 > lanes_used:
+                        struct.pack_into('<i', self._shm.buf, 7 * _INT, lane + 1)
+                    return lane
+        raise RuntimeError(f"共享記憶體 {self.name} 的 lane 已用盡（上限 {self.lanes}）")
+
+    def _lanes_used(self) -> int:
+        return struct.unpack_from('<i', self._shm.buf, 7 * _INT)[0]
+
+    def add(self, key: str, values: Sequence[int]) -> List[float]:
+        """
+        累加計數並回傳所有 worker 合計的滑動視窗估計值
+
+        Args:
+            key: 計數鍵（如 'ip:192.168.1.100'）
+            values: 各欄位的增量
+
+        Returns:
+            各欄位的滑動視窗估計值
+        """
+        # 預先 fork 的 worker（如 gunicorn --preload）繼承父行程的 lane，首次使用時改分配自己的 lane
+        if self._pid != os.getpid():
+            self.lane = self._claim_lane()
+        now = self._clock()
+        epoch = int(now // self.window_seconds)
+        weight = 1.0 - (now % self.window_seconds) / self.window_seconds
+        data = self._data
+        stride = self._stride
+        fields = self.fields
+        lanes = self.lanes
+        lanes_used = self._lanes_used()
+        estimates = None
+        for row, slot in enumerate(_hashes(key, self.rows, self.slots)):
+            base = (row * self.slots + slot) * lanes * stride
+            # 只有本行程寫入自己的 lane，因此不需要鎖
+            own = base + self.lane * stride
+            stored = data[own]
+            if stored != epoch:
+                for field in range(fields):
+                    current = data[own + 1 + field]
+                    data[own + 1 + fields + field] = current if stored == epoch - 1 else 0
+                    data[own + 1 + field] = 0
+                data[own] = epoch
+            for field in range(fields):
+                data[own + 1 + field] += values[field]
+
+            totals = [0.0] * fields
+            cells = data[base:base + lanes_used * stride].tolist()
+            for offset in range(0, len(cells), stride):
+                stored = cells[offset]
+                if stored == epoch:
+                    for field in range(fields):
+                        totals[field] += cells[offset + 1 + field] + cells[offset + 1 + fields + field] * weight
+                elif stored == epoch - 1:
+                    for field in range(fields):
+                        totals[field] += cells[offset + 1 + field] * weight
+            if estimates is None:
+                estimates = totals
+            else:
+                estimates = [min(a, b) for a, b in zip(estimates, totals)]
+        return estimates
+
+    def get(self, key: str) -> List[float]:
+        """只讀取估計值，不累加"""
+        return self.add(key, [0] * self.fields)
+
+    def close(self):
+        """釋放本行程的 lane 並中斷與共享記憶體的連接"""
+        if self._shm is None:
+            return
+        if self._pids[self.lane] == os.getpid():
+            self._pids[self.lane] = 0
+        self._pids.release()
+        self._data.release()
+        self._shm.close()
+        self._shm = None
+
+    def unlink(self):
+        """刪除共享記憶體（由部署端在所有 worker 結束後呼叫）"""
+        block = shared_memory.SharedMemory(name=self.name)
+        block.close()
+        block.unlink()
+
+
+class SharedDeadlines:
+    """
+    跨行程的期限表（如速率限制的封鎖到期時間）
+
+    每個鍵在 rows 個雜湊位置寫入到期秒數，讀取時取最小值，
+    因此只有所有位置都被標記時才視為有效，避免雜湊碰撞誤封鎖。
+    """
+
+    def __init__(self, name: str, slots: int = 8192, rows: int = 2, clock: Callable[[], float] = time.time):
+        self.name = name
+        self.slots = slots
+        self.rows = rows
+        self._clock = clock
+        size = _HEADER.size + rows * slots * 8
+        self._shm, created = _attach(name, size)
+        header = (_MAGIC, _VERSION, 0, rows, slots, 0, 0)
+        _init_header(self._shm, created, header)
+        self._data = self._shm.buf[_HEADER.size:].cast('d')
+
+    def set(self, key: str, until: float):
+        data = self._data
+        for row, slot in enumerate(_hashes(key, self.rows, self.slots)):
+            index = row * self.slots + slot
+            if data[index] < until:
+                data[index] = until
+
+    def remaining(self, key: str) -> float:
+        """距離到期的秒數；未設定或已到期時回傳 0"""
+        data = self._data
+        until = min(data[row * self.slots + slot] for row, slot in enumerate(_hashes(key, self.rows, self.slots)))
+        return max(0.0, until - self._clock())
+
+    def close(self):
+        if self._shm is None:
+            return
+        self._data.release()
+        self._shm.close()
+        self._shm = None
+
+    def unlink(self):
+        block = shared_memory.SharedMemory(name=self.name)
+        block.close()
+        block.unlink()
+
+
+class SharedRateLimiter:
+    """
+    跨 worker 的速率限制器（與 RateLimiter 相同的 check() / stats() 介面）
+
+    每分鐘與每小時計數、封鎖期限皆存放在共享記憶體中，因此任一 worker 封鎖的來源
+    在所有 worker 上都會被拒絕。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_requests_per_minute: int = 1000,
+        max_requests_per_hour: int = 10000,
+        block_duration_seconds: float = 300,
+        slots: int = 8192,
+        clock: Callable[[], float] = time.time
+    ):
+        """
+        建立或連接共享速率限制器
+
+        Args:
+            name: 共享記憶體名稱前綴（同一部署的所有 worker 必須相同）
+            max_requests_per_minute: 每分鐘請求上限（所有 worker 合計）
+            max_requests_per_hour: 每小時請求上限（所有 worker 合計）
+            block_duration_seconds: 超限後的封鎖時間（秒）
+            slots: 每張計數表的雜湊位置數
+            clock: 各行程共用的時間函數
+        """
+        self.max_per_minute = max_requests_per_minute
+        self.max_per_hour = max_requests_per_hour
+        self.block_duration = block_duration_seconds
+        self._clock = clock
+        self._minute = SharedCounters(f'{name}-rl-minute', 1, 60, slots=slots, clock=clock)
+        self._hour = SharedCounters(f'{name}-rl-hour', 1, 3600, slots=slots, clock=clock)
+        self._blocked = SharedDeadlines(f'{name}-rl-block', slots=slots, clock=clock)
+        self.hits = 0
+        self.blocks = 0
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], name: str, **kwargs) -> Optional['SharedRateLimiter']:
+        """從 security.rate_limiting 設定建立；停用時回傳 None"""
+        if not config.get('enabled', False):
+            return None
+        return cls(
+            name,
+            max_requests_per_minute=config.get('max_requests_per_minute', 1000),
+            max_requests_per_hour=config.get('max_requests_per_hour', 10000),
+            block_duration_seconds=config.get('block_duration_seconds', 300),
+            **kwargs
+        )
+
+    def check(self, key: str):
+        """
+        記錄一次請求並檢查是否超限（所有 worker 合計）
+
+        Raises:
+            RateLimitExceeded: 來源已被封鎖或本次請求超過上限
+        """
+        remaining = self._blocked.remaining(key)
+        if remaining > 0:
+            self.blocks += 1
+            raise RateLimitExceeded(key, remaining)
+        # 先累加再判斷：估計值包含本次請求
+        per_minute = self._minute.add(key, (1,))[0]
+        per_hour = self._hour.add(key, (1,))[0]
+        if per_minute > self.max_per_minute or per_hour > self.max_per_hour:
+            self._blocked.set(key, self._clock() + self.block_duration)
+            self.blocks += 1
+            raise RateLimitExceeded(key, self.block_duration)
+        self.hits += 1
+
+    def stats(self) -> Dict[str, int]:
+        """本行程的放行與封鎖次數"""
+        return {'hits': self.hits, 'blocks': self.blocks}
+
+    def close(self):
+        for table in (self._minute, self._hour, self._blocked):
+            table.close()
+
+    def unlink(self):
+        """刪除所有共享記憶體（由部署端在所有 worker 結束後呼叫）"""
+        for table in (self._minute, self._hour, self._blocked):
+            table.unlink()
+
+
+# ---------------------------------------------------------------------------
+# 基準測試
+# ---------------------------------------------------------------------------
+
+def _bench_worker(args: Tuple[str, int, int]) -> Tuple[float, float]:
+    name, operations, keys = args
+    counters = SharedCounters(name, fields=3, window_seconds=60)
+    try:
+        start = time.perf_counter()
+        for i in range(operations):
+            counters.add(f'ip:10.0.{i % keys // 256}.{i % 256}', (1, 0, 0))
+        elapsed = time.perf_counter() - start
+        total = counters.get('ip:10.0.0.0')[0]
+    finally:
+        counters.close()
+    return elapsed, total
+
+
+def benchmark(workers: Sequence[int], operations: int = 50000, keys: int = 1000) -> List[Dict[str, float]]:
+    """
+    量測不同 worker 數下每次 add() 的平均耗時
+
+    Returns:
+        [{'workers', 'us_per_op', 'ops_per_second'}]
+    """
+    from multiprocessing import Pool
+
+    results = []
+    for count in workers:
+        name = f'api-hook-bench-{os.getpid()}-{count}'
+        table = SharedCounters(name, fields=3, window_seconds=60)
+        try:
+            with Pool(count) as pool:
+                start = time.perf_counter()
+                timings = pool.map(_bench_worker, [(name, operations, keys)] * count)
+                wall = time.perf_counter() - start
+        finally:
+            table.close()
+            table.unlink()
+        per_op = sum(elapsed for elapsed, _ in timings) / (count * operations)
+        results.append({
+            'workers': count,
+            'us_per_op': per_op * 1e6,
+            'ops_per_second': count * operations / wall,
+        })
+    return results
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """主程式入口"""
+    parser = argparse.ArgumentParser(description='共享計數表基準測試')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8, 16], help='worker 行程數')
+    parser.add_argument('--operations', type=int, default=50000, help='每個 worker 的更新次數')
+    parser.add_argument('--keys', type=int, default=1000, help='不同鍵的數量')
+    args = parser.parse_args(argv)
+
+    print(f"{'workers':>8} {'us/op':>10} {'ops/s':>12}")
+    for row in benchmark(args.workers, args.operations, args.keys):
+        print(f"{row['workers']:>8} {row['us_per_op']:>10.2f} {row['ops_per_second']:>12.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""
+Tests for the alert dispatcher against a local stand-in webhook server
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from alert_dispatcher import AlertDispatcher
+from api_hook import APIHook
+
+
+class StandInWebhook:
+    """記錄收到的 POST 內容與連線來源的本地 Webhook"""
+
+    def __init__(self):
+        self.payloads = []
+        self.client_ports = set()
+        self.fail = False
+        self.received = threading.Event()
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                status = 503 if webhook.fail else 200
+                if not webhook.fail:
+                    webhook.payloads.append(json.loads(body))
+                    webhook.client_ports.add(self.client_address[1])
+                    webhook.received.set()
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/webhook'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def alerts(self):
+        return [alert for payload in self.payloads for alert in payload['alerts']]
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def webhook():
+    server = StandInWebhook()
+    yield server
+    server.stop()
+
+
+def make_alert(name='API Error', message='API /api/v1/users failed', severity='ERROR'):
+    return {'timestamp': '2026-01-24T15:58:58Z', 'alert_name': name, 'message': message, 'severity': severity}
+
+
+def test_duplicates_are_suppressed_within_cooldown(webhook):
+    dispatcher = AlertDispatcher(webhook_url=webhook.url, batch_window_seconds=0.05)
+    assert dispatcher.submit(make_alert(), cooldown_seconds=60)
+    # 訊息內容不同（如計數值變動）仍視為同一警報
+    assert not dispatcher.submit(make_alert(message='API /api/v1/users failed again'), cooldown_seconds=60)
+    assert dispatcher.submit(make_alert(), cooldown_seconds=60, dedup_key='/api/v1/orders')
+    assert dispatcher.submit(make_alert(severity='CRITICAL'), cooldown_seconds=60)
+    dispatcher.close()
+
+    assert len(webhook.alerts()) == 3
+    assert dispatcher.stats()['suppressed'] == 1
+
+
+def test_bursts_are_batched_over_one_keep_alive_connection(webhook):
+    dispatcher = AlertDispatcher(webhook_url=webhook.url, batch_window_seconds=0.2, max_batch_size=50)
+    for i in range(120):
+        dispatcher.submit(make_alert(message=f'attempt {i}'), dedup_key=str(i))
+    dispatcher.close()
+
+    assert len(webhook.alerts()) == 120
+    assert len(webhook.payloads) < 10
+    assert webhook.payloads[0]['text'].startswith('50 alerts: API Error x50')
+    assert len(webhook.client_ports) == 1
+
+
+def test_failed_batches_are_spooled_and_replayed(webhook, tmp_path):
+    spool = tmp_path / 'alerts.spool'
+    webhook.fail = True
+    dispatcher = AlertDispatcher(webhook_url=webhook.url, spool_path=str(spool), batch_window_seconds=0.01,
+                                 max_retries=2, backoff_seconds=0.01)
+    dispatcher.submit(make_alert(message='while down'), dedup_key='down')
+    deadline = time.monotonic() + 5
+    while not spool.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert spool.exists()
+
+    webhook.fail = False
+    dispatcher.submit(make_alert(message='after recovery'), dedup_key='recovery')
+    dispatcher.close()
+
+    assert [alert['message'] for alert in webhook.alerts()] == ['after recovery', 'while down']
+    assert not spool.exists()
+    assert dispatcher.stats()['replayed'] == 1
+
+
+def test_failed_channel_is_retried_without_resending_the_others(webhook, tmp_path):
+    spool = tmp_path / 'alerts.spool'
+    # SMTP 埠無人監聽：Email 重試失敗，Webhook 只應收到一次
+    dispatcher = AlertDispatcher(webhook_url=webhook.url, email_recipients=['it@example.com'],
+                                 smtp_host='127.0.0.1:9', spool_path=str(spool),
+                                 batch_window_seconds=0.01, max_retries=2, backoff_seconds=0.01)
+    dispatcher.submit(make_alert(message='while smtp down'), dedup_key='down')
+    deadline = time.monotonic() + 5
+    while not spool.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(webhook.payloads) == 1
+    assert json.loads(spool.read_text(encoding='utf-8'))['channels'] == ['email']
+
+    emails = []
+    dispatcher._channels['email'] = emails.append
+    dispatcher.submit(make_alert(message='after recovery'), dedup_key='recovery')
+    dispatcher.close()
+
+    assert [alert['message'] for alert in webhook.alerts()] == ['while smtp down', 'after recovery']
+    assert [payload['alerts'][0]['message'] for payload in emails] == ['after recovery', 'while smtp down']
+    assert 'channels' not in emails[1]
+    assert not spool.exists()
+    assert dispatcher.stats()['replayed'] == 1
+
+
+def test_alert_storm_does_not_block_request_thread():
+    # 無法連線的 Webhook：發送端會持續重試，但提交端不應被阻塞
+    dispatcher = AlertDispatcher(webhook_url='http://127.0.0.1:9/webhook', max_retries=10, backoff_seconds=1)
+    start = time.perf_counter()
+    for i in range(5000):
+        dispatcher.submit(make_alert(message=f'storm {i}'), dedup_key=str(i))
+    elapsed = time.perf_counter() - start
+    dispatcher.close(timeout=0.1)
+    assert elapsed < 0.5
+
+
+def test_close_with_full_queue_returns_within_timeout(tmp_path):
+    spool = tmp_path / 'alerts.spool'
+    dispatcher = AlertDispatcher(webhook_url='http://127.0.0.1:9/webhook', spool_path=str(spool),
+                                 batch_window_seconds=0.01, max_queue_size=10, max_retries=10,
+                                 backoff_seconds=5)
+    # 第一筆送出失敗後發送端進入退避，之後的警報填滿佇列
+    accepted = dispatcher.submit(make_alert(), dedup_key='first')
+    time.sleep(0.2)
+    accepted += sum(dispatcher.submit(make_alert(), dedup_key=str(i)) for i in range(50))
+    assert dispatcher.stats()['dropped'] > 0
+    start = time.perf_counter()
+    dispatcher.close(timeout=0.2)
+    assert time.perf_counter() - start < 1
+    # 停止重試時正在發送與仍在佇列中的警報都寫入 spool
+    assert dispatcher.stats()['spooled'] == accepted
+
+
+def test_hook_forwards_alerts_to_dispatcher(webhook):
+    hook = APIHook()
+    hook.alert_dispatcher = AlertDispatcher(webhook_url=webhook.url, batch_window_seconds=0.01)
+    hook.log_event('security', 'critical', 'Brute force attack detected', {'ip': '192.168.1.100'})
+    assert webhook.received.wait(5)
+    hook.close()
+
+    assert webhook.alerts()[0]['alert_name'] == 'Security'
+    assert webhook.alerts()[0]['severity'] == 'CRITICAL'
@@ -0,0 +1,428 @@
+"""
+Tests for the Python API Hook
+"""
+
+import json
+import logging
+import threading
+import time
+import urllib.request
+
+import pytest
+
+from anomaly_engine import AnomalyEngine, compile_condition
+from api_hook import APIHook
+from log_writer import LogRecord, LogWriter, next_request_id
+from metrics import MetricsRegistry, MetricsServer
+from rate_limiter import RateLimiter, RateLimitExceeded
+from sampler import AdaptiveSampler
+
+
+class FakeClock:
+    """可手動推進的單調時鐘"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+def make_entry(endpoint='/api/v1/users', source_ip='192.168.1.100',
+               response_code=200, result='success', response_time_ms=12.5):
+    return {
+        'endpoint': endpoint,
+        'source_ip': source_ip,
+        'user_id': 'user123',
+        'method': 'GET',
+        'response_code': response_code,
+        'response_time_ms': response_time_ms,
+        'result': result,
+    }
+
+
+# === 條件運算式 ===
+
+def test_compile_condition_supports_and_or_not():
+    predicate, names = compile_condition("status_code == 401 AND attempts > 5")
+    assert names == {'status_code', 'attempts'}
+    assert predicate({'status_code': 401, 'attempts': 6})
+    assert not predicate({'status_code': 401, 'attempts': 5})
+    assert not predicate({'status_code': 200, 'attempts': 10})
+
+    predicate, _ = compile_condition("NOT (error_rate > 0.05 OR endpoint == '/health')")
+    assert predicate({'error_rate': 0.01, 'endpoint': '/api/v1/users'})
+    assert not predicate({'error_rate': 0.01, 'endpoint': '/health'})
+
+
+@pytest.mark.parametrize('condition', [
+    'unknown_field > 1',
+    'error_rate >',
+    '(error_rate > 1',
+    'error_rate > 1 1',
+    'error_rate ~ 1',
+])
+def test_compile_condition_rejects_invalid(condition):
+    with pytest.raises(ValueError):
+        compile_condition(condition)
+
+
+# === 滑動視窗規則 ===
+
+def test_unauthorized_attempts_rule_counts_per_ip_and_honours_cooldown():
+    clock = FakeClock()
+    engine = AnomalyEngine(clock=clock)
+
+    fired = []
+    for _ in range(5):
+        fired += engine.observe(make_entry(response_code=401, result='error'))
+        clock.advance(1)
+    assert fired == []
+
+    fired = engine.observe(make_entry(response_code=401, result='error'))
+    assert [rule.name for rule, _ in fired] == ['Unauthorized Access Attempts']
+    assert 'from 192.168.1.100' in fired[0][1]
+
+    # cooldown 期間不重複觸發；其他 IP 各自計數
+    assert engine.observe(make_entry(response_code=401, result='error')) == []
+    assert engine.observe(make_entry(source_ip='10.0.0.1', response_code=401, result='error')) == []
+
+    clock.advance(5 * 60)
+    for _ in range(5):
+        engine.observe(make_entry(response_code=401, result='error'))
+    fired = engine.observe(make_entry(response_code=401, result='error'))
+    assert [rule.name for rule, _ in fired] == ['Unauthorized Access Attempts']
+
+
+def test_window_expires_old_buckets():
+    clock = FakeClock()
+    engine = AnomalyEngine(clock=clock)
+    for _ in range(6):
+        engine.observe(make_entry(response_code=401, result='error'))
+
+    clock.advance(61)
+    assert engine.observe(make_entry(response_code=401, result='error')) == []
+
+
+def test_error_rate_and_call_volume_rules():
+    clock = FakeClock()
+    rules = [
+        {'name': 'High Error Rate', 'condition': 'error_rate > 0.05', 'cooldown_minutes': 15},
+        {'name': 'Abnormal API Call Volume', 'condition': 'calls_per_minute > 50', 'cooldown_minutes': 10},
+    ]
+    engine = AnomalyEngine(rules=rules, clock=clock)
+
+    names = []
+    for i in range(60):
+        result = 'error' if i % 10 == 0 else 'success'
+        names += [rule.name for rule, _ in engine.observe(make_entry(result=result))]
+    assert names == ['High Error Rate', 'Abnormal API Call Volume']
+
+
+def test_idle_and_excess_keys_are_evicted():
+    clock = FakeClock()
+    engine = AnomalyEngine(max_keys=100, clock=clock)
+    for i in range(1000):
+        engine.observe(make_entry(source_ip=f'10.0.{i // 256}.{i % 256}'))
+    assert engine.stats()['tracked_source_ips'] == 100
+
+    clock.advance(120)
+    for _ in range(100):
+        engine.observe(make_entry(source_ip='192.168.1.1'))
+    assert engine.stats()['tracked_source_ips'] < 100
+
+
+# === APIHook 整合 ===
+
+def test_monitor_triggers_configured_rules(monkeypatch):
+    hook = APIHook()
+    alerts = []
+    monkeypatch.setattr(hook, '_trigger_alert', lambda name, message, severity, **kwargs: alerts.append((name, severity)))
+
+    @hook.monitor(endpoint='/api/v1/auth/login', security_level='critical')
+    def login(**kwargs):
+        raise PermissionError('Invalid credentials')
+
+    for _ in range(30):
+        with pytest.raises(PermissionError):
+            login(user_id='user456', source_ip='192.168.1.101')
+
+    assert alerts == [('High Error Rate', 'WARNING')]
+
+
+# === 速率限制 ===
+
+def test_rate_limiter_blocks_and_unblocks_after_duration():
+    clock = FakeClock()
+    limiter = RateLimiter(max_requests_per_minute=10, block_duration_seconds=300, clock=clock)
+    for _ in range(10):
+        limiter.check('192.168.1.100')
+    with pytest.raises(RateLimitExceeded) as excinfo:
+        limiter.check('192.168.1.100')
+    assert excinfo.value.retry_after == 300
+
+    # 其他來源不受影響
+    limiter.check('192.168.1.101')
+
+    clock.advance(301)
+    limiter.check('192.168.1.100')
+    assert limiter.stats()['hits'] == 12
+    assert limiter.stats()['blocks'] == 1
+
+
+def test_rate_limiter_sliding_window_weights_previous_minute():
+    clock = FakeClock(now=6000.0)
+    limiter = RateLimiter(max_requests_per_minute=10, clock=clock)
+    for _ in range(10):
+        limiter.check('10.0.0.1')
+
+    # 進入下一分鐘的第 1 秒，前一分鐘的計數仍佔 59/60 的權重
+    clock.advance(61)
+    limiter.check('10.0.0.1')
+    with pytest.raises(RateLimitExceeded):
+        limiter.check('10.0.0.1')
+
+
+def test_rate_limiter_caps_tracked_clients():
+    limiter = RateLimiter(max_clients=256, stripes=8)
+    for i in range(5000):
+        limiter.check(f'10.{i // 65536}.{i // 256 % 256}.{i % 256}')
+    stats = limiter.stats()
+    assert stats['tracked_clients'] <= 256
+    assert stats['evictions'] == 5000 - stats['tracked_clients']
+
+
+def test_monitor_rejects_blocked_requests_before_handler():
+    hook = APIHook()
+    hook.rate_limiter = RateLimiter(max_requests_per_minute=3)
+    calls = []
+
+    @hook.monitor(endpoint='/api/v1/public/items', security_level='low')
+    def list_items(**kwargs):
+        calls.append(kwargs)
+        return {'status': 'success'}
+
+    for _ in range(3):
+        list_items(source_ip='10.1.1.1')
+    with pytest.raises(RateLimitExceeded):
+        list_items(source_ip='10.1.1.1')
+    assert len(calls) == 3
+
+
+def test_monitor_does_not_rate_limit_calls_without_source_ip():
+    # 內建設定每分鐘 1000 次：未傳入 source_ip 的呼叫不可共用 0.0.0.0 的計數而被封鎖
+    hook = APIHook()
+    hook.records = []
+    hook._process_log_entry = hook.records.append
+
+    @hook.monitor(endpoint='/api/v1/internal/jobs', security_level='low')
+    def run_job(**kwargs):
+        return {'status': 'success'}
+
+    try:
+        for _ in range(1200):
+            assert run_job(user_id='scheduler') == {'status': 'success'}
+    finally:
+        hook.close()
+    assert len(hook.records) == 1200
+    assert {record.source_ip for record in hook.records} == {'0.0.0.0'}
+    assert {record.result for record in hook.records} == {'success'}
+
+
+# === Prometheus 指標 ===
+
+def test_latency_histogram_quantiles():
+    registry = MetricsRegistry()
+    for i in range(1, 101):
+        registry.observe('/api/v1/users', 'GET', 200, 'success', float(i))
+    registry.observe('/api/v1/users', 'GET', 500, 'error', 3000.0)
+
+    assert 32 <= registry.quantile('/api/v1/users', 0.5) <= 64
+    assert 64 <= registry.quantile('/api/v1/users', 0.99) <= 128
+    summary = registry.summary()['/api/v1/users']
+    assert summary['count'] == 101
+    assert summary['errors'] == 1
+
+
+def test_metrics_server_serves_prometheus_text():
+    registry = MetricsRegistry()
+    registry.observe('/api/v1/users', 'POST', 200, 'success', 1.0)
+    registry.observe('/api/v1/users', 'POST', 200, 'success', 3.0)
+    server = MetricsServer(registry, port=0, host='127.0.0.1').start()
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics', timeout=5) as response:
+            body = response.read().decode('utf-8')
+            assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    finally:
+        server.stop()
+
+    assert 'api_hook_requests_total{endpoint="/api/v1/users",method="POST",code="200",result="success"} 2' in body
+    assert 'api_hook_request_duration_seconds_bucket{endpoint="/api/v1/users",le="0.001"} 1' in body
+    assert 'api_hook_request_duration_seconds_bucket{endpoint="/api/v1/users",le="0.004"} 2' in body
+    assert 'api_hook_request_duration_seconds_count{endpoint="/api/v1/users"} 2' in body
+
+
+def test_monitor_updates_metrics():
+    hook = APIHook()
+
+    @hook.monitor(endpoint='/api/v1/users', security_level='high')
+    def get_user(**kwargs):
+        return {'status': 'success'}
+
+    for _ in range(5):
+        get_user(user_id='user123', source_ip='192.168.1.100', method='GET')
+    assert hook.get_stats()['/api/v1/users']['count'] == 5
+
+
+class ListSink:
+    def __init__(self):
+        self.lines = []
+
+    def write_batch(self, lines):
+        self.lines.extend(lines)
+
+    def close(self):
+        pass
+
+
+def test_log_writer_serializes_records_in_background():
+    sink = ListSink()
+    writer = LogWriter(sink, sanitize=lambda params: {k: '***' for k in params}, batch_size=10,
+                       flush_interval_seconds=60)
+    for _ in range(25):
+        writer.submit(LogRecord(time.time(), next_request_id(), 'user123', '192.168.1.100', 'POST',
+                                '/api/v1/users', {'password': 'secret'}, 200, 1.234, 'success'))
+    writer.flush()
+    assert len(sink.lines) == 25
+    writer.close()
+
+    entry = json.loads(sink.lines[0])
+    assert entry['parameters'] == {'password': '***'}
+    assert entry['response_time_ms'] == 1.23
+    assert entry['timestamp'].endswith('Z')
+    assert len({json.loads(line)['request_id'] for line in sink.lines}) == 25
+    assert writer.stats()['queued'] == 0
+
+
+def test_log_writer_drops_only_unserializable_records():
+    class Unserializable:
+        def __str__(self):
+            raise RuntimeError('cannot render')
+
+    sink = ListSink()
+    writer = LogWriter(sink, batch_size=10, flush_interval_seconds=60)
+    for i in range(30):
+        # 非字串的字典鍵與 json 相同地轉為字串
+        parameters = {'filters': {1: 'a'}} if i % 3 else {'bad': Unserializable()}
+        writer.submit(LogRecord(time.time(), next_request_id(), 'user123', '192.168.1.100', 'GET',
+                                '/api/v1/items', parameters, 200, 1.0, 'success'))
+    writer.flush()
+    assert len(sink.lines) == 20
+    assert json.loads(sink.lines[0])['parameters'] == {'filters': {'1': 'a'}}
+    assert writer.stats()['dropped'] == 10
+
+    # 寫入執行緒仍在運作
+    writer.submit({'event_type': 'audit', 'message': 'still alive'})
+    writer.flush()
+    assert len(sink.lines) == 21
+    writer.close()
+
+
+def test_log_writer_restarts_dead_thread_and_writes_after_close():
+    sink = ListSink()
+    writer = LogWriter(sink, batch_size=10, flush_interval_seconds=60)
+    # 模擬寫入執行緒意外結束
+    dead = threading.Thread(target=lambda: None)
+    dead.start()
+    dead.join()
+    writer._thread = dead
+    for i in range(5):
+        writer.submit({'event_type': 'audit', 'message': str(i)})
+    writer.flush()
+    assert len(sink.lines) == 5
+    assert writer.stats()['restarts'] == 1
+
+    writer.close()
+    writer.submit({'event_type': 'audit', 'message': 'after close'})
+    writer.flush()
+    assert len(sink.lines) == 6
+
+
+def test_monitor_overhead_stays_within_budget():
+    # 每次呼叫的額外開銷上限（微秒）；CI 機器差異大，預留充足餘裕
+    budget_us = 100
+    calls = 5000
+    logging.getLogger('api_hook').setLevel(logging.WARNING)
+    hook = APIHook()
+    hook.rate_limiter = RateLimiter(max_requests_per_minute=10 ** 9, max_requests_per_hour=10 ** 9)
+
+    def handler(**kwargs):
+        return {'status': 'success'}
+
+    monitored = hook.monitor(endpoint='/api/v1/users', security_level='high')(handler)
+
+    def per_call_us(func):
+        best = float('inf')
+        for _ in range(3):
+            start = time.perf_counter()
+            for _ in range(calls):
+                func(user_id='user123', source_ip='192.168.1.100', method='GET')
+            best = min(best, (time.perf_counter() - start) / calls * 1e6)
+        return best
+
+    overhead = per_call_us(monitored) - per_call_us(handler)
+    hook.close()
+    logging.getLogger('api_hook').setLevel(logging.NOTSET)
+    assert overhead < budget_us, f"monitor adds {overhead:.1f}us per call"
+
+
+def test_sampler_keeps_high_levels_and_anomalies():
+    sampler = AdaptiveSampler(rates={'low': 0.1, 'high': 0.1}, rng=lambda: 0.99)
+    assert sampler.sample('high', 200, 'success', 1.0) == 1.0
+    assert sampler.sample('medium', 200, 'success', 1.0) == 1.0
+    assert sampler.sample('low', 200, 'success', 1.0) == 0.0
+    assert sampler.sample('low', 500, 'error', 1.0) == 1.0
+    assert sampler.sample('low', 401, 'success', 1.0) == 1.0
+    assert sampler.sample('low', 200, 'success', 5000.0) == 1.0
+    assert sampler.stats()['forced'] == 3
+
+
+def test_sampler_adapts_rate_to_target_budget():
+    clock = FakeClock()
+    sampler = AdaptiveSampler(rates={'low': 1.0}, target_entries_per_second=100, clock=clock)
+    kept_weight = 0.0
+    offered = 0
+    for second in range(5):
+        for _ in range(1000):
+            kept_weight += sampler.sample('low', 200, 'success', 1.0)
+            offered += 1
+            clock.advance(0.001)
+
+    assert sampler.rates['low'] == pytest.approx(0.1)
+    assert sampler.stats()['kept'] < 1500
+    # 權重加總可還原實際呼叫數
+    assert kept_weight == pytest.approx(offered, rel=0.1)
+
+
+def test_monitor_writes_sampled_entries_with_weight():
+    hook = APIHook()
+    sink = ListSink()
+    hook.log_writer = LogWriter(sink, batch_size=10)
+    hook.sampler = AdaptiveSampler(rates={'low': 0.25}, rng=iter([0.1, 0.9, 0.9, 0.9] * 10).__next__)
+
+    @hook.monitor(endpoint='/api/v1/public/items', security_level='low')
+    def list_items(**kwargs):
+        return []
+
+    for _ in range(40):
+        list_items(source_ip='192.168.1.100')
+    hook.flush()
+
+    entries = [json.loads(line) for line in sink.lines]
+    assert len(entries) == 10
+    assert sum(entry['sampling_weight'] for entry in entries) == 40
+    assert hook.get_stats()['/api/v1/public/items']['count'] == 40
+    hook.close()
@@ -0,0 +1,142 @@
+"""
+Tests for log segments and the Parquet audit archiver
+"""
+
+import json
+import os
+from datetime import date, datetime, timezone
+
+import pytest
+
+from audit_archive import AuditArchiver
+from log_writer import SegmentFileSink, sealed_segments
+
+
+def make_line(timestamp, user_id='user123', source_ip='192.168.1.100', endpoint='/api/v1/users',
+              result='success', request_id='req-1'):
+    return json.dumps({
+        'timestamp': timestamp, 'request_id': request_id, 'user_id': user_id, 'source_ip': source_ip,
+        'method': 'GET', 'endpoint': endpoint, 'parameters': {'page': 1}, 'response_code': 200,
+        'response_time_ms': 1.5, 'result': result, 'error_message': None, 'sampling_weight': 1.0,
+    }).encode('utf-8')
+
+
+def test_segment_sink_rotates_and_seals(tmp_path):
+    now = [1000.0]
+    sink = SegmentFileSink(str(tmp_path), max_segment_bytes=200, clock=lambda: now[0])
+    sealed = []
+    sink.on_seal.append(sealed.append)
+
+    sink.write_batch([make_line('2026-01-24T15:58:58.442000Z')])
+    assert sealed_segments(str(tmp_path)) == []
+    sink.write_batch([make_line('2026-01-24T15:58:59.000000Z')])
+    assert len(sealed) == 1
+    sink.close()
+
+    segments = sealed_segments(str(tmp_path))
+    assert segments == sorted(sealed) and len(segments) == 2
+    assert all(not name.endswith('.open') for name in os.listdir(tmp_path))
+
+
+def test_segment_sink_seals_orphaned_segments_on_start(tmp_path):
+    crashed = SegmentFileSink(str(tmp_path))
+    crashed.write_batch([make_line('2026-01-24T15:58:58.442000Z')])
+    # 模擬異常結束：區段未封存，且寫入者行程已不存在
+    orphan = str(tmp_path / 'api-hook-20260124T155858Z-999999999-0001.ndjson')
+    os.replace(crashed._path, orphan + '.open')
+    crashed._file.close()
+    # 其他仍在執行的 worker 的區段不可封存
+    live = tmp_path / f'api-hook-20260124T155858Z-{os.getppid()}-0001.ndjson.open'
+    live.write_bytes(b'')
+
+    sealed = []
+    sink = SegmentFileSink(str(tmp_path), on_seal=[sealed.append])
+    assert sealed == sink.recovered == [orphan]
+    assert sealed_segments(str(tmp_path)) == [orphan]
+    assert live.exists()
+    sink.close()
+
+
+def test_archive_keeps_event_payloads_in_mixed_segments(tmp_path):
+    pytest.importorskip('pyarrow')
+    source = tmp_path / 'logs'
+    sink = SegmentFileSink(str(source))
+    sink.write_batch([
+        make_line('2026-01-24T08:00:00.000000Z', request_id='a'),
+        json.dumps({
+            'timestamp': '2026-01-24T08:00:01.000000Z', 'event_type': 'security', 'severity': 'critical',
+            'message': 'Brute force attack detected', 'metadata': {'ip': '192.168.1.100', 'attempts': 10},
+        }).encode('utf-8'),
+        json.dumps({
+            'timestamp': '2026-01-24T08:00:02.000000Z', 'event_type': 'audit', 'severity': 'info',
+            'message': 'Segment archived', 'details': {'segments': 3},
+        }).encode('utf-8'),
+    ])
+    sink.close()
+    archiver = AuditArchiver(str(tmp_path / 'archive'))
+    archiver.archive_directory(str(source))
+
+    rows = archiver.query(columns=['request_id', 'event_type', 'severity', 'message', 'extra']).to_pylist()
+    assert [rows[0][name] for name in ('request_id', 'event_type', 'message', 'extra')] == ['a', None, None, None]
+    assert rows[1]['message'] == 'Brute force attack detected'
+    assert json.loads(rows[1]['extra']) == {'metadata': {'ip': '192.168.1.100', 'attempts': 10}}
+    assert json.loads(rows[2]['extra']) == {'details': {'segments': 3}}
+    assert archiver.query(event_type='audit', columns=['message']).column('message').to_pylist() == [
+        'Segment archived'
+    ]
+
+
+def test_prune_removes_partitions_past_retention(tmp_path):
+    for day in ('2018-12-31', '2019-01-24', '2026-01-24'):
+        (tmp_path / f'date={day}').mkdir()
+    archiver = AuditArchiver(str(tmp_path), retention_years=7)
+
+    removed = archiver.prune(today=date(2026, 1, 24))
+
+    assert [os.path.basename(path) for path in removed] == ['date=2018-12-31']
+    assert sorted(os.listdir(tmp_path)) == ['date=2019-01-24', 'date=2026-01-24']
+
+
+def test_archive_and_query_by_partition(tmp_path):
+    pytest.importorskip('pyarrow')
+    source = tmp_path / 'logs'
+    sink = SegmentFileSink(str(source))
+    sink.write_batch([
+        make_line('2026-01-23T23:59:59.000000Z', request_id='a'),
+        make_line('2026-01-24T08:00:00.000000Z', source_ip='10.0.0.5', request_id='b'),
+        make_line('2026-01-24T09:00:00.000000Z', result='error', request_id='c'),
+    ])
+    sink.close()
+    archiver = AuditArchiver(str(tmp_path / 'archive'))
+
+    assert archiver.archive_directory(str(source)) == 1
+    assert archiver.archive_directory(str(source)) == 0
+    assert len(archiver.partitions()) == 2
+
+    table = archiver.query(datetime(2026, 1, 24, tzinfo=timezone.utc), columns=['request_id'],
+                           user_id='user123')
+    assert table.column('request_id').to_pylist() == ['b', 'c']
+    table = archiver.query(source_ip='10.0.0.5', columns=['request_id', 'source_ip'])
+    assert table.column('request_id').to_pylist() == ['b']
+    with pytest.raises(ValueError):
+        archiver.query(password='x')
+
+
+def test_query_bounds_in_other_timezones_select_utc_partitions(tmp_path):
+    pytest.importorskip('pyarrow')
+    source = tmp_path / 'logs'
+    sink = SegmentFileSink(str(source))
+    sink.write_batch([
+        make_line('2026-01-01T20:00:00.000000Z', request_id='a'),
+        make_line('2026-01-02T08:00:00.000000Z', request_id='b'),
+    ])
+    sink.close()
+    archiver = AuditArchiver(str(tmp_path / 'archive'))
+    archiver.archive_directory(str(source))
+
+    # +08:00 的 1 月 2 日 03:00 即 UTC 1 月 1 日 19:00，需開啟 1 月 1 日的分區
+    start = datetime.fromisoformat('2026-01-02T03:00:00+08:00')
+    assert archiver.query(start, columns=['request_id']).column('request_id').to_pylist() == ['a', 'b']
+    # -08:00 的 1 月 1 日 22:00 即 UTC 1 月 2 日 06:00
+    end = datetime.fromisoformat('2026-01-01T22:00:00-08:00')
+    assert archiver.query(end=end, columns=['request_id']).column('request_id').to_pylist() == ['a']
@@ -0,0 +1,87 @@
+"""
+Tests for hash-chained log segments
+"""
+
+import json
+
+import pytest
+
+from integrity import GENESIS, HashChain, HmacSigner, load_signer, main, merkle_root, verify_directory
+from log_writer import SegmentFileSink, sealed_segments
+
+
+def write_chained_segments(directory, signer=None, segments=3, batches=4, lines=25):
+    sink = SegmentFileSink(str(directory))
+    sink.integrity = HashChain(str(directory), signer)
+    for s in range(segments):
+        for b in range(batches):
+            sink.write_batch([json.dumps({'request_id': f'req-{s}-{b}-{i}'}).encode('utf-8')
+                              for i in range(lines)])
+        sink.seal()
+    sink.close()
+    return sealed_segments(str(directory))
+
+
+def rewrite_line(segment, line_number, new_line):
+    with open(segment, 'rb') as f:
+        lines = f.read().split(b'\n')
+    lines[line_number - 1] = new_line
+    with open(segment, 'wb') as f:
+        f.write(b'\n'.join(lines))
+
+
+def test_merkle_root_depends_on_every_leaf():
+    leaves = [bytes([i]) * 32 for i in range(5)]
+    root = merkle_root(leaves)
+    assert merkle_root(leaves[:4] + [b'\xff' * 32]) != root
+    assert merkle_root(list(reversed(leaves))) != root
+
+
+def test_untouched_segments_verify_in_parallel(tmp_path):
+    write_chained_segments(tmp_path, HmacSigner(b'secret'))
+    (tmp_path / 'integrity.key').write_bytes(b'secret')
+
+    report = verify_directory(str(tmp_path), 'hmac', str(tmp_path / 'integrity.key'), workers=2)
+    assert report['errors'] == []
+    assert report['segments'] == 3 and report['batches'] == 12 and report['lines'] == 300
+
+
+def test_modified_entry_is_pinpointed(tmp_path):
+    segments = write_chained_segments(tmp_path)
+    rewrite_line(segments[1], 37, b'{"request_id":"forged"}')
+
+    errors = verify_directory(str(tmp_path), workers=1)['errors']
+    assert len(errors) == 1
+    assert 'forged' not in errors[0] and '37' in errors[0]
+
+
+def test_deleted_segment_and_bad_signature_are_detected(tmp_path):
+    segments = write_chained_segments(tmp_path, HmacSigner(b'secret'))
+    (tmp_path / 'wrong.key').write_bytes(b'other')
+    assert verify_directory(str(tmp_path), 'hmac', str(tmp_path / 'wrong.key'), workers=1)['errors']
+
+    for suffix in ('', '.chain'):
+        (tmp_path / (segments[1].rsplit('/', 1)[1] + suffix)).unlink()
+    errors = verify_directory(str(tmp_path), workers=1)['errors']
+    assert any('已遺失' in error for error in errors)
+
+
+def test_chain_resumes_from_last_sealed_segment(tmp_path):
+    write_chained_segments(tmp_path, segments=1)
+    chain = HashChain(str(tmp_path))
+    assert chain.prev != GENESIS
+    write_chained_segments(tmp_path, segments=1)
+    assert verify_directory(str(tmp_path), workers=1)['errors'] == []
+
+
+def test_ed25519_keygen_and_verify(tmp_path, capsys):
+    pytest.importorskip('cryptography')
+    key_path = tmp_path / 'integrity.key'
+    assert main(['keygen', '--algorithm', 'ed25519', '--output', str(key_path)]) == 0
+    logs = tmp_path / 'logs'
+    logs.mkdir()
+    write_chained_segments(logs, load_signer('ed25519', str(key_path)))
+
+    assert main(['verify', '--logs', str(logs), '--public-key', str(key_path) + '.pub', '--workers', '1']) == 0
+    rewrite_line(sealed_segments(str(logs))[0], 1, b'{}')
+    assert main(['verify', '--logs', str(logs), '--public-key', str(key_path) + '.pub', '--workers', '1']) == 2
@@ -0,0 +1,99 @@
+"""
+Tests for the investigation index
+"""
+
+import json
+import os
+
+from investigate import BloomFilter, build_index, investigate, load_index
+from log_writer import SegmentFileSink, sealed_segments
+
+
+def write_segments(directory, segments=20, lines=500):
+    sink = SegmentFileSink(str(directory))
+    for s in range(segments):
+        batch = []
+        for i in range(lines):
+            minute, second = divmod(i * 60 // lines, 60)
+            batch.append(json.dumps({
+                'timestamp': f'2026-01-{s + 1:02d}T10:{minute:02d}:{second:02d}.000000Z',
+                'request_id': f'req-{s}-{i}',
+                'user_id': f'user{i % 50}',
+                'source_ip': f'10.{s}.0.{i % 200}',
+                'endpoint': '/api/v1/users',
+                'result': 'success',
+            }).encode('utf-8'))
+        sink.write_batch(batch)
+        build_index(sink.seal(), block_lines=64)
+    sink.close()
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter.for_capacity(1000)
+    for i in range(1000):
+        bloom.add(f'10.0.{i // 256}.{i % 256}')
+    assert all(f'10.0.{i // 256}.{i % 256}' in bloom for i in range(1000))
+    false_positives = sum(f'172.16.{i // 256}.{i % 256}' in bloom for i in range(1000))
+    assert false_positives < 50
+
+
+def test_lookup_skips_segments_by_bloom_and_time(tmp_path):
+    write_segments(tmp_path)
+    assert len(sealed_segments(str(tmp_path))) == 20
+
+    stats = {}
+    results = list(investigate(str(tmp_path), request_id='req-7-123', stats=stats))
+    assert [entry['request_id'] for entry in results] == ['req-7-123']
+    assert stats['skipped'] >= 18
+
+    stats = {}
+    results = list(investigate(str(tmp_path), source_ip='10.3.0.5',
+                               start='2026-01-04T10:00:30', end='2026-01-04T10:00:59Z', stats=stats))
+    assert results and all(entry['timestamp'] >= '2026-01-04T10:00:30' for entry in results)
+    assert all(entry['source_ip'] == '10.3.0.5' for entry in results)
+    assert stats['scanned_blocks'] <= 5
+
+
+def test_unindexed_and_open_segments_are_scanned(tmp_path):
+    write_segments(tmp_path, segments=2)
+    os.remove(sealed_segments(str(tmp_path))[0] + '.idx')
+    sink = SegmentFileSink(str(tmp_path))
+    sink.write_batch([json.dumps({'timestamp': '2026-02-01T00:00:00.000000Z', 'user_id': 'user7',
+                                  'request_id': 'live'}).encode('utf-8')])
+
+    request_ids = {entry['request_id'] for entry in investigate(str(tmp_path), user_id='user7')}
+    assert 'live' in request_ids and 'req-0-7' in request_ids and 'req-1-7' in request_ids
+    sink.close()
+
+
+def test_index_is_ignored_when_segment_changes(tmp_path):
+    write_segments(tmp_path, segments=1)
+    segment = sealed_segments(str(tmp_path))[0]
+    assert load_index(segment) is not None
+    with open(segment, 'ab') as f:
+        f.write(b'{}\n')
+    assert load_index(segment) is None
+
+
+def test_fields_match_typed_values_and_times_compare_across_formats(tmp_path):
+    sink = SegmentFileSink(str(tmp_path))
+    sink.write_batch([json.dumps(entry).encode('utf-8') for entry in (
+        {'timestamp': '2026-01-24T07:59:59.999999Z', 'request_id': 'a', 'response_code': 200, 'user_id': 42},
+        # log_event 的 isoformat() 在微秒為 0 時省略小數
+        {'timestamp': '2026-01-24T08:00:00Z', 'request_id': 'b', 'response_code': 500, 'user_id': 42},
+        {'timestamp': '2026-01-24T16:30:00+08:00', 'request_id': 'c', 'response_code': 200, 'user_id': 'x'},
+        {'timestamp': '2026-01-24T09:00:00.000000Z', 'request_id': 'd', 'response_code': 200, 'user_id': 42},
+    )])
+    segment = sink.seal()
+    build_index(segment, block_lines=2)
+    sink.close()
+
+    def request_ids(**kwargs):
+        return [entry['request_id'] for entry in investigate(str(tmp_path), **kwargs)]
+
+    assert request_ids(fields={'response_code': '200'}) == ['a', 'c', 'd']
+    assert request_ids(user_id='42') == ['a', 'b', 'd']
+    # 08:30Z 以 +08:00 表示；以字串比較時會落在範圍外
+    assert request_ids(start='2026-01-24T08:00:00Z', end='2026-01-24T16:45:00+08:00') == ['b', 'c']
+    assert request_ids(fields={'response_code': '200'}, start='2026-01-24T08:00:00') == ['c', 'd']
+    assert load_index(segment)['min_timestamp'] == '2026-01-24T07:59:59.999999Z'
@@ -0,0 +1,113 @@
+"""
+Tests for the log-replay load generator
+"""
+
+import json
+
+import pytest
+
+from api_hook import APIHook
+from log_writer import SegmentFileSink
+from loadgen import check, compare, load_traffic, run, synthesize, write_traffic
+from rate_limiter import RateLimiter
+
+
+def test_synthetic_traffic_round_trips_through_ndjson(tmp_path):
+    traffic = synthesize(200, seed=7)
+    assert traffic == synthesize(200, seed=7)
+    path = tmp_path / 'traffic.ndjson'
+    write_traffic(traffic, str(path))
+    # 錄製的日誌中夾雜的 log_event 事件沒有 endpoint，重播時略過
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write('\n' + json.dumps({'event_type': 'security', 'message': 'x'}) + '\n')
+    assert load_traffic(str(path)) == traffic
+
+
+def test_threads_replay_reports_latency_queue_and_outcomes():
+    traffic = synthesize(2000, error_rate=0.05)
+    result = run(traffic, mode='threads', concurrency=4, sink='null', stages=True)
+    assert result['requests'] == 2000
+    assert result['errors'] == sum(entry['result'] == 'error' for entry in traffic)
+    assert result['blocked'] == 0
+    assert result['written'] == 2000
+    assert 0 < result['p50_us'] <= result['p90_us'] <= result['p99_us'] <= result['max_us']
+    assert result['queue_depth_max'] >= 0 and result['throughput_rps'] > 0
+    assert set(result['stages']) == {'_save_log', '_check_anomalies'}
+
+
+def test_asyncio_and_process_modes_replay_every_request():
+    traffic = synthesize(600)
+    for mode in ('asyncio', 'processes'):
+        result = run(traffic, mode=mode, concurrency=4, processes=2, sink='file')
+        assert result['requests'] == 600
+        assert result['written'] == 600
+
+
+def test_recorded_segments_replay_and_worker_errors_fail_the_run(tmp_path):
+    # 以 SegmentFileSink 錄製真實的 API Hook 日誌：parameters 中已含 user_id、source_ip 與 method
+    hook = APIHook()
+    hook.log_writer.sink = SegmentFileSink(str(tmp_path))
+
+    @hook.monitor(endpoint='/api/v1/users', security_level='high')
+    def list_users(**kwargs):
+        return {'status': 'success'}
+
+    for page in range(5):
+        list_users(user_id='alice', source_ip='10.0.0.5', method='GET', page=page)
+    hook.close()
+
+    traffic = [entry for path in sorted(tmp_path.glob('*.ndjson')) for entry in load_traffic(str(path))]
+    assert len(traffic) == 5 and traffic[0]['parameters']['user_id'] == 'alice'
+    result = run(traffic, sink='null')
+    assert result['requests'] == result['completed'] == 5
+
+    # 重播本身出錯時 run() 直接拋出例外，不回報空結果
+    with pytest.raises(AttributeError):
+        run([dict(traffic[0], parameters=['not', 'a', 'dict'])], sink='null')
+
+
+def test_rate_is_paced_and_rate_limited_sources_are_blocked():
+    traffic = synthesize(400)
+    result = run(traffic, rate=2000, sink='null')
+    assert result['duration_s'] >= 0.18
+
+    def fixed_clock_hook():
+        # 固定時鐘：所有請求落在同一個分鐘視窗，結果不受執行時間跨越視窗邊界影響
+        hook = APIHook()
+        hook.rate_limiter = RateLimiter(max_requests_per_minute=1000, clock=lambda: 1000.0)
+        return hook
+
+    # 單一來源超過每分鐘 1000 次：第 1001 次起封鎖
+    burst = [dict(entry, source_ip='10.9.9.9') for entry in synthesize(1100)]
+    result = run(burst, sink='null', hook_factory=fixed_clock_hook)
+    assert result['blocked'] == 100
+    assert run(burst, sink='null', rate_limit=False)['blocked'] == 0
+
+
+def test_compare_flags_regressions_beyond_tolerance():
+    baseline = {'throughput_rps': 1000.0, 'p50_us': 40.0, 'p99_us': 100.0}
+    assert compare({'throughput_rps': 800.0, 'p50_us': 50.0, 'p99_us': 120.0}, baseline, 0.3) == []
+    regressions = compare({'throughput_rps': 600.0, 'p50_us': 40.0, 'p99_us': 200.0}, baseline, 0.3)
+    assert [line.split()[0] for line in regressions] == ['throughput_rps', 'p99_us']
+
+
+def test_check_reruns_baseline_scenarios(tmp_path):
+    path = tmp_path / 'baseline.json'
+    path.write_text(json.dumps({'tolerance': 0.5, 'scenarios': {
+        'small': {'options': {'mode': 'threads', 'requests': 300, 'sink': 'null'}},
+    }}), encoding='utf-8')
+    assert check(str(path), update=True) == {'small': []}
+    recorded = json.loads(path.read_text(encoding='utf-8'))['scenarios']['small']
+    assert recorded['throughput_rps'] > 0 and recorded['p99_us'] > 0
+
+    machine = json.loads(path.read_text(encoding='utf-8'))['machine']
+    recorded['throughput_rps'] *= 1000
+    path.write_text(json.dumps({'tolerance': 0.5, 'machine': machine, 'scenarios': {'small': recorded}}),
+                    encoding='utf-8')
+    assert check(str(path))['small'][0].startswith('throughput_rps')
+
+    # 其他機器錄製的基準值不可直接比較
+    path.write_text(json.dumps({'tolerance': 0.5, 'machine': dict(machine, cpu_count=-1),
+                                'scenarios': {'small': recorded}}), encoding='utf-8')
+    with pytest.raises(ValueError):
+        check(str(path))
@@ -0,0 +1,177 @@
+"""
+Tests for the cross-worker shared counters
+"""
+
+import multiprocessing
+import os
+import threading
+import uuid
+
+import pytest
+
+from anomaly_engine import AnomalyEngine
+from rate_limiter import RateLimitExceeded
+from shared_state import SharedCounters, SharedRateLimiter, _attach
+
+
+class FakeClock:
+    """固定時鐘（各行程使用相同的時間）"""
+
+    def __init__(self, now: float = 1_000_020.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def name():
+    return f'api-hook-test-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+
+
+def _worker_add(name: str, operations: int):
+    counters = SharedCounters(name, fields=3, window_seconds=60, clock=FakeClock())
+    try:
+        for i in range(operations):
+            counters.add('ip:10.0.0.1', (1, i % 2, 0))
+    finally:
+        counters.close()
+
+
+def _worker_check(name: str, requests: int, queue):
+    limiter = SharedRateLimiter(name, max_requests_per_minute=10, clock=FakeClock(), slots=256)
+    blocked = 0
+    try:
+        for _ in range(requests):
+            try:
+                limiter.check('10.0.0.1')
+            except RateLimitExceeded:
+                blocked += 1
+    finally:
+        limiter.close()
+    queue.put(blocked)
+
+
+def test_workers_aggregate_into_the_same_window(name):
+    table = SharedCounters(name, fields=3, window_seconds=60, clock=FakeClock())
+    try:
+        workers = [multiprocessing.Process(target=_worker_add, args=(name, 500)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(30)
+        calls, errors, unauthorized = table.get('ip:10.0.0.1')
+        assert (calls, errors, unauthorized) == (2000, 1000, 0)
+        assert table.get('ip:10.0.0.2') == [0, 0, 0]
+    finally:
+        table.close()
+        table.unlink()
+
+
+def _inherited_add(table, operations: int):
+    try:
+        for i in range(operations):
+            table.add('ip:10.0.0.1', (1, i % 2, 0))
+    finally:
+        table.close()
+
+
+def test_forked_workers_claim_their_own_lanes(name):
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        pytest.skip('fork 不可用')
+    # 預先 fork：子行程繼承父行程已建立的計數表與 lane
+    table = SharedCounters(name, fields=3, window_seconds=60, clock=FakeClock())
+    try:
+        context = multiprocessing.get_context('fork')
+        workers = [context.Process(target=_inherited_add, args=(table, 20000)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(60)
+        assert table.get('ip:10.0.0.1') == [80000, 40000, 0]
+        assert table.lane == 0
+    finally:
+        table.close()
+        table.unlink()
+
+
+def test_previous_window_is_weighted_by_overlap(name):
+    clock = FakeClock(1_000_020.0)  # 視窗開始後 0 秒（1_000_020 = 16667 * 60）
+    table = SharedCounters(name, fields=1, window_seconds=60, clock=clock)
+    try:
+        table.add('k', (10,))
+        clock.now += 60 + 15  # 下一個視窗的第 15 秒：前一視窗權重 0.75
+        assert table.add('k', (2,)) == [pytest.approx(2 + 10 * 0.75)]
+        clock.now += 60  # 兩個視窗之後：舊計數完全過期
+        assert table.get('k') == [pytest.approx(2 * 0.75)]
+    finally:
+        table.close()
+        table.unlink()
+
+
+def test_rate_limit_is_enforced_across_workers(name):
+    queue = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_worker_check, args=(name, 5, queue)) for _ in range(4)]
+    try:
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(30)
+        blocked = sum(queue.get(timeout=5) for _ in workers)
+        # 4 個 worker 合計 20 次請求，上限 10：其餘皆被拒絕
+        assert blocked == 10
+
+        limiter = SharedRateLimiter(name, max_requests_per_minute=10, clock=FakeClock(), slots=256)
+        with pytest.raises(RateLimitExceeded):
+            limiter.check('10.0.0.1')
+        limiter.check('10.0.0.2')
+        limiter.close()
+    finally:
+        limiter = SharedRateLimiter(name, max_requests_per_minute=10, slots=256)
+        limiter.close()
+        limiter.unlink()
+
+
+def test_mismatched_parameters_are_rejected(name):
+    table = SharedCounters(name, fields=3, window_seconds=60, slots=1024)
+    try:
+        with pytest.raises(ValueError):
+            SharedCounters(name, fields=3, window_seconds=60, slots=2048)
+    finally:
+        table.close()
+        table.unlink()
+
+
+def test_attach_waits_for_creator_to_size_the_block(name):
+    _posixshmem = pytest.importorskip('_posixshmem')
+    # 模擬建立者已 shm_open、尚未 ftruncate 的瞬間
+    fd = _posixshmem.shm_open('/' + name, os.O_CREAT | os.O_EXCL | os.O_RDWR, mode=0o600)
+    timer = threading.Timer(0.05, os.ftruncate, (fd, 4096))
+    timer.start()
+    try:
+        block, created = _attach(name, 4096)
+        assert not created and block.size >= 4096
+        block.close()
+    finally:
+        timer.join()
+        os.close(fd)
+        _posixshmem.shm_unlink('/' + name)
+
+
+def test_anomaly_engine_uses_shared_windows(name):
+    table = SharedCounters(name, fields=3, window_seconds=60, clock=FakeClock())
+    rules = [{'name': 'Brute', 'condition': 'status_code == 401 AND attempts > 5', 'cooldown_minutes': 5}]
+    try:
+        # 兩個 engine 模擬兩個 worker：各自只看到 3 次 401，合計超過門檻
+        first = AnomalyEngine(rules=rules, shared=table)
+        second = AnomalyEngine(rules=rules, shared=table)
+        entry = {'endpoint': '/login', 'source_ip': '10.0.0.9', 'response_code': 401, 'result': 'error'}
+        fired = []
+        for _ in range(3):
+            fired += first.observe(entry)
+            fired += second.observe(entry)
+        assert [rule.name for rule, _ in fired] == ['Brute']
+        assert 'attempts=6' in fired[0][1]
+    finally:
+        table.close()
+        table.unlink()
@@ -0,0 +1,189 @@
+"""
+Tests for the Wazuh forwarder against a local TCP stand-in
+"""
+
+import json
+import socket
+import socketserver
+import threading
+import time
+
+import pytest
+
+from wazuh_forwarder import WazuhForwarder
+
+
+class StandInCollector:
+    """記錄收到的 syslog 行與連線數的本地 TCP 接收端"""
+
+    def __init__(self, port=0):
+        self.lines = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        collector = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                with collector.lock:
+                    collector.connections += 1
+                for line in self.rfile:
+                    with collector.lock:
+                        collector.lines.append(line.rstrip(b'\n'))
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def wait_for(self, count, timeout=10):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.lines) >= count:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def events(self):
+        with self.lock:
+            return [json.loads(line.split(b' - - ', 1)[1]) for line in self.lines]
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def make_lines(count, start=0):
+    return [json.dumps({'request_id': f'req-{i}', 'endpoint': '/api/v1/users'}).encode('utf-8')
+            for i in range(start, start + count)]
+
+
+def test_batches_share_one_persistent_connection():
+    collector = StandInCollector()
+    forwarder = WazuhForwarder('127.0.0.1', collector.port, hostname='api01')
+    for start in range(0, 1000, 100):
+        forwarder.write_batch(make_lines(100, start))
+    assert collector.wait_for(1000)
+    forwarder.close()
+    collector.stop()
+
+    assert collector.connections == 1
+    assert collector.lines[0].startswith(b'<134>1 ')
+    assert b' api01 api-hook ' in collector.lines[0]
+    assert [event['request_id'] for event in collector.events()] == [f'req-{i}' for i in range(1000)]
+    assert forwarder.stats()['sent'] == 1000
+
+
+def test_outage_is_spooled_and_replayed(tmp_path):
+    port = free_port()
+    spool = tmp_path / 'wazuh.spool'
+    forwarder = WazuhForwarder('127.0.0.1', port, spool_path=str(spool), backoff_seconds=0.05,
+                               max_backoff_seconds=0.1, connect_timeout=1)
+    forwarder.write_batch(make_lines(50))
+    deadline = time.monotonic() + 5
+    while not spool.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert spool.exists()
+
+    collector = StandInCollector(port)
+    forwarder.write_batch(make_lines(50, 50))
+    assert collector.wait_for(100)
+    forwarder.close()
+    collector.stop()
+
+    assert sorted(event['request_id'] for event in collector.events()) == sorted(f'req-{i}' for i in range(100))
+    assert not spool.exists()
+    assert forwarder.stats()['replayed'] == 50
+
+
+class RecordingSocket:
+    """記錄送出內容的假連線；每次送出時執行 on_send，可設定第幾次送出失敗"""
+
+    def __init__(self, on_send=None, fail_on=None):
+        self.chunks = []
+        self.on_send = on_send
+        self.fail_on = fail_on
+
+    def sendall(self, data):
+        if len(self.chunks) == self.fail_on:
+            raise ConnectionResetError('collector went away')
+        self.chunks.append(data)
+        if self.on_send is not None:
+            self.on_send()
+
+
+def test_spool_stays_writable_while_replaying(tmp_path):
+    spool = tmp_path / 'wazuh.spool'
+    forwarder = WazuhForwarder('127.0.0.1', free_port(), spool_path=str(spool))
+    spool.write_bytes(forwarder.frame(make_lines(100)))
+
+    # 補送期間其他執行緒仍能取得 spool 鎖並追加；追加的內容不會被送出或刪除
+    def append_while_sending():
+        assert forwarder._spool_lock.acquire(timeout=1)
+        forwarder._spool_lock.release()
+        forwarder._spool(forwarder.frame(make_lines(1, 99 + len(sock.chunks))), 1)
+
+    sock = RecordingSocket(on_send=append_while_sending)
+    forwarder._replay_spool(sock, chunk_size=1000)
+    assert b''.join(sock.chunks).count(b'\n') == 100 and len(sock.chunks) > 1
+    remaining = spool.read_bytes().splitlines()
+    assert len(remaining) == len(sock.chunks)
+    assert b'req-100' in remaining[0]
+
+    # 中途失敗：只移除已送出的部分
+    failing = RecordingSocket(fail_on=2)
+    with pytest.raises(OSError):
+        forwarder._replay_spool(failing, chunk_size=1)
+    assert spool.read_bytes().splitlines() == remaining[2:]
+    forwarder.close()
+    assert forwarder.stats()['replayed'] == 102
+
+
+def test_close_with_full_queue_returns_within_timeout(tmp_path):
+    spool = tmp_path / 'wazuh.spool'
+    forwarder = WazuhForwarder('127.0.0.1', free_port(), spool_path=str(spool), max_queue_size=2,
+                               backoff_seconds=5, connect_timeout=1)
+    # 第一批連線失敗後發送端進入退避，之後的批次填滿佇列
+    forwarder.write_batch(make_lines(10))
+    time.sleep(0.2)
+    for start in range(10, 100, 10):
+        forwarder.write_batch(make_lines(10, start))
+    started = time.perf_counter()
+    forwarder.close(timeout=0.2)
+    assert time.perf_counter() - started < 1
+    assert spool.read_bytes().count(b'\n') == forwarder.stats()['spooled'] == 100
+
+
+def test_throughput_and_spool_replay_speed(tmp_path):
+    # 量測持續轉發與 spool 補送的速度；門檻寬鬆，只防止數量級的退化
+    collector = StandInCollector()
+    forwarder = WazuhForwarder('127.0.0.1', collector.port)
+    lines = make_lines(100)
+    start = time.perf_counter()
+    for _ in range(200):
+        forwarder.write_batch(lines)
+    assert collector.wait_for(20000)
+    forward_seconds = time.perf_counter() - start
+    forwarder.close()
+
+    spool = tmp_path / 'wazuh.spool'
+    offline = WazuhForwarder('127.0.0.1', collector.port)
+    spool.write_bytes(offline.frame(lines) * 200)
+    offline.close()
+    replayer = WazuhForwarder('127.0.0.1', collector.port, spool_path=str(spool))
+    start = time.perf_counter()
+    replayer.write_batch(make_lines(1))
+    assert collector.wait_for(40001)
+    replay_seconds = time.perf_counter() - start
+    replayer.close()
+    collector.stop()
+
+    assert forward_seconds < 5
+    assert replay_seconds < 5
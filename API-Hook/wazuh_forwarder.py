@@ -0,0 +1,346 @@
+"""
+Wazuh SIEM Forwarder
+以持久 TCP 連線批次轉發 API Hook 日誌至 Wazuh（integrations.wazuh）
+
+- 每筆日誌包成一行 RFC 5424 syslog 訊息，訊息內容為原始 JSON（Wazuh 以 JSON decoder 解析）
+- 一條或少數幾條持久連線（pool_size），每批以一次 sendall 送出
+- 連線失敗時以指數退避重新連線；期間的批次寫入本地 spool 檔，恢復後優先補送
+- 實作 write_batch(lines) / close()，可作為 LogWriter 的輸出目標
+"""
+
+import os
+import queue
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+import logging
+
+from log_writer import format_timestamp
+
+logger = logging.getLogger('api_hook.wazuh')
+
+# syslog facility local0、severity informational
+_FACILITY_LOCAL0 = 16
+_SEVERITY_INFO = 6
+
+
+class WazuhForwarder:
+    """
+    非阻塞的 Wazuh 轉發器
+
+    write_batch() 只將批次放入佇列；連線、發送、重試與 spool 皆由背景執行緒處理。
+    """
+
+    def __init__(
+        self,
+        server: str,
+        port: int = 1514,
+        protocol: str = 'tcp',
+        pool_size: int = 1,
+        batch_size: int = 500,
+        max_queue_size: int = 10000,
+        spool_path: Optional[str] = None,
+        spool_max_bytes: int = 1024 * 1024 * 1024,
+        connect_timeout: float = 5.0,
+        backoff_seconds: float = 0.5,
+        max_backoff_seconds: float = 60.0,
+        app_name: str = 'api-hook',
+        hostname: Optional[str] = None,
+        clock: Callable[[], float] = time.time
+    ):
+        """
+        初始化轉發器
+
+        Args:
+            server: Wazuh manager 位址（integrations.wazuh.server）
+            port: 接收埠（integrations.wazuh.port）
+            protocol: tcp 或 udp（integrations.wazuh.protocol）
+            pool_size: 持久連線數量（每條連線一個發送執行緒）
+            batch_size: 單次發送的最大行數
+            max_queue_size: 佇列中的批次上限（滿時直接寫入 spool）
+            spool_path: 無法連線時暫存訊息的檔案路徑（None 表示丟棄並計數）
+            spool_max_bytes: spool 檔大小上限
+            connect_timeout: 連線與發送逾時（秒）
+            backoff_seconds: 第一次重新連線的等待時間（之後倍增）
+            max_backoff_seconds: 重新連線等待時間上限
+            app_name: syslog APP-NAME
+            hostname: syslog HOSTNAME（預設本機名稱）
+            clock: 產生 syslog 時間戳記的時間函數
+        """
+        if protocol not in ('tcp', 'udp'):
+            raise ValueError(f"不支援的協定: {protocol}")
+        self.server = server
+        self.port = port
+        self.protocol = protocol
+        self.batch_size = batch_size
+        self.spool_path = spool_path
+        self.spool_max_bytes = spool_max_bytes
+        self.connect_timeout = connect_timeout
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._clock = clock
+        host = (hostname or socket.gethostname() or '-').replace(' ', '_')
+        self._header_suffix = f" {host} {app_name} {os.getpid()} - - ".encode('utf-8')
+        self._pri = f"<{_FACILITY_LOCAL0 * 8 + _SEVERITY_INFO}>1 ".encode('ascii')
+
+        self._queue: 'queue.Queue[Optional[List[bytes]]]' = queue.Queue(maxsize=max_queue_size)
+        self._spool_lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.counters = {
+            'sent': 0, 'batches': 0, 'spooled': 0, 'replayed': 0,
+            'dropped': 0, 'connections': 0, 'failures': 0,
+        }
+        self._threads = [
+            threading.Thread(target=self._run, name=f'api-hook-wazuh-{i}', daemon=True)
+            for i in range(max(1, pool_size))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @classmethod
+    def from_config(cls, wazuh: Dict[str, Any], **kwargs) -> Optional['WazuhForwarder']:
+        """
+        從 integrations.wazuh 設定建立轉發器
+
+        Returns:
+            WazuhForwarder 實例；未啟用或未設定 server 時回傳 None
+        """
+        if not wazuh.get('enabled', False) or not wazuh.get('server'):
+            return None
+        return cls(
+            wazuh['server'],
+            port=wazuh.get('port', 1514),
+            protocol=wazuh.get('protocol', 'tcp'),
+            pool_size=wazuh.get('pool_size', 1),
+            spool_path=wazuh.get('spool_path'),
+            **kwargs
+        )
+
+    # ------------------------------------------------------------------
+    # 提交（請求 / 寫入執行緒）
+    # ------------------------------------------------------------------
+
+    def frame(self, lines: List[bytes]) -> bytes:
+        """將 JSON 行包成以換行分隔的 syslog 訊息"""
+        timestamp = format_timestamp(self._clock()).encode('ascii')
+        header = self._pri + timestamp + self._header_suffix
+        return b''.join(header + line + b'\n' for line in lines)
+
+    def write_batch(self, lines: List[bytes]):
+        """提交一批已序列化的日誌（非阻塞）"""
+        if not lines:
+            return
+        try:
+            self._queue.put_nowait(lines)
+        except queue.Full:
+            # 發送端跟不上（通常是 SIEM 無法連線）：直接落地到 spool
+            self._spool(self.frame(lines), len(lines))
+
+    # ------------------------------------------------------------------
+    # 背景發送
+    # ------------------------------------------------------------------
+
+    def _connect(self) -> socket.socket:
+        if self.protocol == 'udp':
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.connect((self.server, self.port))
+            return sock
+        sock = socket.create_connection((self.server, self.port), timeout=self.connect_timeout)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        return sock
+
+    def _send(self, sock: socket.socket, payload: bytes):
+        if self.protocol == 'udp':
+            for line in payload.splitlines(keepends=True):
+                sock.send(line)
+        else:
+            sock.sendall(payload)
+
+    def _next_batch(self) -> Optional[List[bytes]]:
+        """取得一批待送行數；合併佇列中已有的批次直到 batch_size"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        lines = list(first)
+        while len(lines) < self.batch_size:
+            try:
+                more = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if more is None:
+                # 保留關閉訊號給自己的下一輪
+                self._queue.put(None)
+                break
+            lines.extend(more)
+        return lines
+
+    def _run(self):
+        sock = None
+        delay = self.backoff_seconds
+        while True:
+            lines = self._next_batch()
+            if lines is None:
+                break
+            payload = self.frame(lines)
+            while True:
+                try:
+                    if sock is None:
+                        sock = self._connect()
+                        with self._lock:
+                            self.counters['connections'] += 1
+                        delay = self.backoff_seconds
+                        self._replay_spool(sock)
+                    if payload:
+                        self._send(sock, payload)
+                        with self._lock:
+                            self.counters['sent'] += len(lines)
+                            self.counters['batches'] += 1
+                    break
+                except OSError as e:
+                    if sock is not None:
+                        sock.close()
+                        sock = None
+                    with self._lock:
+                        self.counters['failures'] += 1
+                    logger.warning(f"Wazuh forwarding failed ({e}), spooling and retrying in {delay:.1f}s")
+                    self._spool(payload, len(lines))
+                    # 退避期間新批次留在佇列（佇列滿時直接寫入 spool），恢復連線後先補送 spool
+                    if self._stop.wait(delay):
+                        break
+                    delay = min(delay * 2, self.max_backoff_seconds)
+                    payload, lines = b'', []
+                    if self.spool_path is None:
+                        break
+            if self._stop.is_set():
+                break
+        if sock is not None:
+            sock.close()
+
+    # ------------------------------------------------------------------
+    # Spool
+    # ------------------------------------------------------------------
+
+    def _spool(self, payload: bytes, count: int):
+        if not payload:
+            return
+        if not self.spool_path:
+            with self._lock:
+                self.counters['dropped'] += count
+            return
+        with self._spool_lock:
+            try:
+                size = os.path.getsize(self.spool_path)
+            except OSError:
+                size = 0
+            if size + len(payload) > self.spool_max_bytes:
+                with self._lock:
+                    self.counters['dropped'] += count
+                logger.error(f"Wazuh spool full, dropping {count} events")
+                return
+            with open(self.spool_path, 'ab') as f:
+                f.write(payload)
+        with self._lock:
+            self.counters['spooled'] += count
+
+    def _replay_spool(self, sock: socket.socket, chunk_size: int = 1 << 20):
+        """
+        以大區塊補送 spool 內容（已是 syslog 格式，不需重新編碼）
+
+        只在持有 _spool_lock 時取得 spool 目前的長度；發送期間不持有鎖，
+        其他執行緒仍可追加新的批次，補送結束後只移除已送出的部分。
+
+        Raises:
+            OSError: 補送途中連線失敗（已送出的部分會從 spool 移除）
+        """
+        if not self.spool_path:
+            return
+        # 同時只由一條連線補送，避免多條連線重複送出同一段內容
+        if not self._replay_lock.acquire(blocking=False):
+            return
+        try:
+            with self._spool_lock:
+                try:
+                    size = os.path.getsize(self.spool_path)
+                except OSError:
+                    return
+            sent = 0
+            replayed = 0
+            try:
+                with open(self.spool_path, 'rb') as f:
+                    while sent < size:
+                        chunk = f.read(min(chunk_size, size - sent))
+                        if not chunk:
+                            break
+                        # spool 只以完整的行追加，快照長度必定落在行尾
+                        if sent + len(chunk) < size:
+                            chunk += f.readline()
+                        self._send(sock, chunk)
+                        sent += len(chunk)
+                        replayed += chunk.count(b'\n')
+            finally:
+                with self._spool_lock:
+                    self._truncate_spool(sent)
+                with self._lock:
+                    self.counters['replayed'] += replayed
+                    self.counters['sent'] += replayed
+        finally:
+            self._replay_lock.release()
+
+    def _truncate_spool(self, sent: int):
+        """移除 spool 中已送出的前 sent 個位元組，保留之後追加的內容（需持有 _spool_lock）"""
+        if not sent:
+            return
+        if os.path.getsize(self.spool_path) == sent:
+            os.remove(self.spool_path)
+            return
+        tmp_path = self.spool_path + '.tmp'
+        with open(self.spool_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            src.seek(sent)
+            while True:
+                chunk = src.read(1 << 20)
+                if not chunk:
+                    break
+                dst.write(chunk)
+        os.replace(tmp_path, self.spool_path)
+
+    # ------------------------------------------------------------------
+
+    def close(self, timeout: float = 10.0):
+        """
+        送出佇列中剩餘的日誌並停止背景執行緒
+
+        Args:
+            timeout: 等待時間（秒）；逾時後停止重試，未送出的批次留在 spool
+        """
+        deadline = time.monotonic() + timeout
+        for _ in self._threads:
+            try:
+                self._queue.put(None, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                # 佇列已滿且發送端仍在重試：停止重試，剩餘批次於下方寫入 spool
+                self._stop.set()
+                break
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        if any(thread.is_alive() for thread in self._threads):
+            self._stop.set()
+            for thread in self._threads:
+                thread.join(timeout)
+        # 執行緒已停止但佇列中仍有批次（逾時）：寫入 spool
+        while True:
+            try:
+                lines = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if lines:
+                self._spool(self.frame(lines), len(lines))
+
+    def stats(self) -> Dict[str, int]:
+        """取得轉發統計"""
+        with self._lock:
+            stats = dict(self.counters)
+        stats['queued'] = self._queue.qsize()
+        return stats
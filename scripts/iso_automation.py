@@ -17,12 +17,83 @@ import argparse
 import re
 import subprocess
 import traceback
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 from jinja2 import Environment, FileSystemLoader, Template
 
 
+# 模板宣告的紀錄頻率（模板表頭的「紀錄頻率」欄位）；「依事件」或未宣告者不檢查時效
+CADENCES = {
+    '每日': 'day',
+    '每週': 'week',
+    '每月': 'month',
+    '每季': 'quarter',
+    '每半年': 'half',
+    '每年': 'year',
+}
+
+# 合規性掃描預設檢查最近一年（一個稽核週期）的缺漏期間
+DEFAULT_REVIEW_DAYS = 365
+
+# 報告中每個模板最多列出的缺漏期間數
+MAX_LISTED_PERIODS = 12
+
+_RECORD_DATE_RE = re.compile(r'_(\d{8})\.md$')
+_TABLE_FIELD_RE = r'^\|\s*\*\*{}\*\*\s*\|\s*([^|]*?)\s*\|'
+
+
+def period_start(day: date, cadence: str) -> date:
+    """
+    取得 day 所屬期間的第一天
+
+    Args:
+        day: 日期
+        cadence: 期間單位（day/week/month/quarter/half/year）
+
+    Returns:
+        期間起始日
+    """
+    if cadence == 'day':
+        return day
+    if cadence == 'week':
+        return day - timedelta(days=day.weekday())
+    if cadence == 'month':
+        return day.replace(day=1)
+    if cadence == 'quarter':
+        return date(day.year, (day.month - 1) // 3 * 3 + 1, 1)
+    if cadence == 'half':
+        return date(day.year, 1 if day.month <= 6 else 7, 1)
+    return date(day.year, 1, 1)
+
+
+def next_period(start: date, cadence: str) -> date:
+    """取得下一期間的第一天（start 須為期間起始日）"""
+    if cadence == 'day':
+        return start + timedelta(days=1)
+    if cadence == 'week':
+        return start + timedelta(days=7)
+    months = {'month': 1, 'quarter': 3, 'half': 6, 'year': 12}[cadence]
+    month = start.month - 1 + months
+    return date(start.year + month // 12, month % 12 + 1, 1)
+
+
+def period_label(start: date, cadence: str) -> str:
+    """期間的顯示名稱（如：2026-01-24、2026-W04、2026-01、2026-Q1、2026-H1、2026）"""
+    if cadence == 'day':
+        return start.isoformat()
+    if cadence == 'week':
+        year, week, _ = start.isocalendar()
+        return f"{year}-W{week:02d}"
+    if cadence == 'month':
+        return start.strftime('%Y-%m')
+    if cadence == 'quarter':
+        return f"{start.year}-Q{(start.month - 1) // 3 + 1}"
+    if cadence == 'half':
+        return f"{start.year}-H{1 if start.month <= 6 else 2}"
+    return str(start.year)
+
+
 class ISOAutomation:
     """ISO 27001 自動化工具核心類別"""
     
@@ -208,21 +279,181 @@ class ISOAutomation:
             else:
                 raise ValueError(f"不支援的檔案格式: {data_path.suffix}")
     
-    def scan_compliance(self) -> Dict[str, Any]:
+    def read_template_info(self, template_path: Path) -> Dict[str, Any]:
         """
-        掃描目錄結構，檢查合規性
-        
+        讀取模板表頭宣告的紀錄頻率與生效日期
+
+        Args:
+            template_path: 模板路徑
+
+        Returns:
+            {'cadence': 頻率名稱或 None, 'effective_date': date 或 None}
+        """
+        # 表頭位於檔案開頭，不需讀取整份模板
+        with open(template_path, 'r', encoding='utf-8') as f:
+            header = ''.join(line for _, line in zip(range(20), f))
+
+        cadence = re.search(_TABLE_FIELD_RE.format('紀錄頻率'), header, re.MULTILINE)
+        effective = re.search(r'^\|\s*\*\*生效日期\*\*\s*\|\s*(\d{4})年(\d{1,2})月(\d{1,2})日',
+                              header, re.MULTILINE)
+        return {
+            'cadence': cadence.group(1) if cadence else None,
+            'effective_date': date(*map(int, effective.groups())) if effective else None,
+        }
+
+    def _record_pattern(self, template_name: str) -> re.Pattern:
+        base_name = template_name.replace('_Template.md', '')
+        return re.compile(rf'^{re.escape(base_name)}_\d{{8}}\.md$')
+
+    def _record_date(self, entry: os.DirEntry) -> date:
+        # 檔名日期戳記（generate_filename 產生）優先，否則使用修改時間
+        match = _RECORD_DATE_RE.search(entry.name)
+        if match:
+            try:
+                return datetime.strptime(match.group(1), '%Y%m%d').date()
+            except ValueError:
+                pass
+        return datetime.fromtimestamp(entry.stat().st_mtime).date()
+
+    def _month_dirs(self, category_path: Path) -> List[Tuple[int, int, Path]]:
+        """
+        由新到舊列出類別下的 YYYY/MM 目錄（只讀取目錄名稱，不列出紀錄檔）
+
+        Returns:
+            [(年, 月, 路徑)]
+        """
+        months = []
+        for year_path in category_path.iterdir():
+            if year_path.is_dir() and year_path.name.isdigit():
+                for month_path in year_path.iterdir():
+                    if month_path.is_dir() and month_path.name.isdigit():
+                        months.append((int(year_path.name), int(month_path.name), month_path))
+        months.sort(key=lambda item: item[:2], reverse=True)
+        return months
+
+    def _list_records(self, month_dirs: List[Tuple[int, int, Path]], since: date) -> List[Tuple[str, date]]:
+        """列出 since 所在月份以後的所有記錄（檔名, 日期）；更早的月目錄不會被讀取"""
+        records = []
+        for year, month, month_path in month_dirs:
+            if (year, month) < (since.year, since.month):
+                break
+            with os.scandir(month_path) as it:
+                records.extend((entry.name, self._record_date(entry)) for entry in it
+                               if entry.is_file() and entry.name.endswith('.md'))
+        return records
+
+    def find_latest_record(self, category_path: Path, template_name: str,
+                           month_dirs: List[Tuple[int, int, Path]] = None) -> Optional[date]:
+        """
+        依 YYYY/MM 目錄由新到舊尋找模板最新的證據記錄，找到即停止
+
+        Args:
+            category_path: 類別目錄
+            template_name: 模板檔名（如：備份執行紀錄_Template.md）
+            month_dirs: 已列出的月目錄（可選）
+
+        Returns:
+            最新記錄的日期，無記錄時為 None
+        """
+        pattern = self._record_pattern(template_name)
+        if month_dirs is None:
+            month_dirs = self._month_dirs(category_path)
+        for _, _, month_path in month_dirs:
+            with os.scandir(month_path) as it:
+                dates = [self._record_date(entry) for entry in it
+                         if entry.is_file() and pattern.match(entry.name)]
+            if dates:
+                return max(dates)
+        return None
+
+    def check_cadence(self, category_path: Path, template_path: Path, today: date,
+                      review_days: int = DEFAULT_REVIEW_DAYS,
+                      month_dirs: List[Tuple[int, int, Path]] = None,
+                      records: List[Tuple[str, date]] = None) -> Dict[str, Any]:
+        """
+        檢查單一模板的證據時效
+
+        只讀取檢查期間（最近 review_days 天，且不早於模板生效日期）內的月目錄，
+        掃描時間與歷史紀錄的長短無關；期間內沒有記錄時才往更早的月份尋找最新記錄。
+        進行中的期間不列為缺漏；上一個完整期間與本期間都沒有記錄時視為逾期。
+
+        Args:
+            category_path: 類別目錄
+            template_path: 模板路徑
+            today: 檢查基準日
+            review_days: 檢查缺漏期間的天數
+            month_dirs: 已由新到舊列出的月目錄（同類別的模板共用）
+            records: 已列出的檢查期間內記錄（同類別的模板共用）
+
+        Returns:
+            模板時效資訊（頻率、最新記錄日期、期間內記錄數、缺漏期間、是否逾期）
+        """
+        info = self.read_template_info(template_path)
+        cadence = CADENCES.get(info['cadence'])
+        start = today - timedelta(days=review_days)
+        if month_dirs is None:
+            month_dirs = self._month_dirs(category_path)
+        if records is None:
+            records = self._list_records(month_dirs, start)
+        if info['effective_date'] and info['effective_date'] > start:
+            start = info['effective_date']
+
+        pattern = self._record_pattern(template_path.name)
+        dates = [day for name, day in records if pattern.match(name)]
+        recent = [day for day in dates if start <= day <= today]
+        latest = max(dates) if dates else self.find_latest_record(category_path, template_path.name, month_dirs)
+
+        result = {
+            'template': template_path.name,
+            'cadence': info['cadence'],
+            'latest_record': latest.isoformat() if latest else None,
+            'records': len(recent),
+            'missing_periods': [],
+            'overdue': False,
+        }
+        if cadence is None:
+            return result
+
+        covered = {period_start(day, cadence) for day in recent}
+        current = period_start(today, cadence)
+        period = period_start(start, cadence)
+        if period < start:
+            # 生效日期或檢查期間起點落在期間中途時，從下一個完整期間開始要求
+            period = next_period(period, cadence)
+        while period < current:
+            if period not in covered:
+                result['missing_periods'].append(period_label(period, cadence))
+            period = next_period(period, cadence)
+
+        previous = period_start(current - timedelta(days=1), cadence)
+        if previous >= start:
+            result['overdue'] = latest is None or latest < previous
+        return result
+
+    def scan_compliance(self, today: date = None, review_days: int = DEFAULT_REVIEW_DAYS) -> Dict[str, Any]:
+        """
+        掃描目錄結構，檢查合規性與證據時效
+
+        Args:
+            today: 檢查基準日，預設為今天
+            review_days: 檢查缺漏期間的天數，預設最近一年
+
         Returns:
             合規性檢查報告
         """
+        if today is None:
+            today = date.today()
         report = {
             'scan_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'review_start': (today - timedelta(days=review_days)).isoformat(),
             'categories': {},
             'summary': {
                 'total_categories': 0,
                 'total_templates': 0,
                 'total_records': 0,
                 'categories_with_records': 0,
+                'overdue_categories': 0,
+                'missing_periods': 0,
             }
         }
         
@@ -239,42 +470,53 @@ class ISOAutomation:
                 if category_name.endswith('.md'):
                     continue
                 
-                templates = list(category_path.glob("*_Template.md"))
+                templates = sorted(category_path.glob("*_Template.md"))
+                month_dirs = self._month_dirs(category_path)
+                listed = self._list_records(month_dirs, today - timedelta(days=review_days))
+                checks = [self.check_cadence(category_path, template, today, review_days, month_dirs, listed)
+                          for template in templates]
                 
-                # 計算記錄數量（排除模板）
-                records = []
-                for year_path in category_path.iterdir():
-                    if year_path.is_dir() and year_path.name.isdigit():
-                        for month_path in year_path.iterdir():
-                            if month_path.is_dir():
-                                records.extend(list(month_path.glob("*.md")))
+                # 記錄數只計算檢查期間內的記錄；是否有記錄以最新記錄判斷
+                records = sum(check['records'] for check in checks)
+                latest = max((check['latest_record'] for check in checks if check['latest_record']), default=None)
+                overdue = [check for check in checks if check['overdue']]
+                missing = sum(len(check['missing_periods']) for check in checks)
                 
                 report['categories'][category_name] = {
                     'templates': len(templates),
-                    'records': len(records),
+                    'records': records,
                     'template_list': [t.name for t in templates],
-                    'has_records': len(records) > 0,
+                    'has_records': latest is not None,
+                    'latest_record': latest,
+                    'overdue': bool(overdue),
+                    'cadence': checks,
                 }
                 
                 report['summary']['total_categories'] += 1
                 report['summary']['total_templates'] += len(templates)
-                report['summary']['total_records'] += len(records)
-                if len(records) > 0:
+                report['summary']['total_records'] += records
+                report['summary']['missing_periods'] += missing
+                if latest is not None:
                     report['summary']['categories_with_records'] += 1
+                if overdue:
+                    report['summary']['overdue_categories'] += 1
         
         return report
     
-    def generate_compliance_report(self, output_path: Path = None) -> str:
+    def generate_compliance_report(self, output_path: Path = None, today: date = None,
+                                   review_days: int = DEFAULT_REVIEW_DAYS) -> str:
         """
         生成合規性報告
         
         Args:
             output_path: 報告輸出路徑（可選）
+            today: 檢查基準日，預設為今天
+            review_days: 檢查缺漏期間的天數
             
         Returns:
             報告內容
         """
-        scan_result = self.scan_compliance()
+        scan_result = self.scan_compliance(today, review_days)
         
         report_lines = []
         report_lines.append("# ISO 27001 合規性掃描報告")
@@ -297,8 +539,11 @@ class ISOAutomation:
         report_lines.append("")
         report_lines.append(f"- **證據類別總數**: {summary['total_categories']}")
         report_lines.append(f"- **模板總數**: {summary['total_templates']}")
-        report_lines.append(f"- **證據記錄總數**: {summary['total_records']}")
+        report_lines.append(f"- **檢查期間**: {scan_result['review_start']} 起")
+        report_lines.append(f"- **期間內證據記錄數**: {summary['total_records']}")
         report_lines.append(f"- **有證據記錄的類別數**: {summary['categories_with_records']}/{summary['total_categories']}")
+        report_lines.append(f"- **逾期類別數**: {summary['overdue_categories']}")
+        report_lines.append(f"- **缺漏期間數**: {summary['missing_periods']}")
         report_lines.append("")
         
         # 詳細資訊
@@ -306,16 +551,28 @@ class ISOAutomation:
         report_lines.append("")
         
         for category_name, category_data in sorted(scan_result['categories'].items()):
-            status = "✅" if category_data['has_records'] else "⚠️"
+            if category_data['overdue']:
+                status = "❌"
+            else:
+                status = "✅" if category_data['has_records'] else "⚠️"
             report_lines.append(f"### {status} {category_name}")
             report_lines.append("")
             report_lines.append(f"- **模板數量**: {category_data['templates']}")
-            report_lines.append(f"- **證據記錄數**: {category_data['records']}")
-            
-            if category_data['template_list']:
-                report_lines.append("- **可用模板**:")
-                for template in category_data['template_list']:
-                    report_lines.append(f"  - {template}")
+            report_lines.append(f"- **期間內證據記錄數**: {category_data['records']}")
+            report_lines.append(f"- **最新記錄**: {category_data['latest_record'] or '無'}")
+            
+            if category_data['cadence']:
+                report_lines.append("")
+                report_lines.append("| 模板 | 紀錄頻率 | 最新記錄 | 期間內記錄 | 缺漏期間 | 狀態 |")
+                report_lines.append("|------|---------|---------|-----------|---------|------|")
+                for check in category_data['cadence']:
+                    state = "逾期" if check['overdue'] else "正常"
+                    if CADENCES.get(check['cadence']) is None:
+                        state = "不檢查"
+                    report_lines.append(
+                        f"| {check['template']} | {check['cadence'] or '未宣告'} | {check['latest_record'] or '無'} "
+                        f"| {check['records']} | {len(check['missing_periods'])} | {state} |"
+                    )
             
             report_lines.append("")
         
@@ -338,6 +595,31 @@ class ISOAutomation:
         else:
             report_lines.append("所有有模板的類別都已生成證據記錄。")
         
+        overdue_checks = [(name, check) for name, data in sorted(scan_result['categories'].items())
+                          for check in data['cadence'] if check['overdue']]
+        if overdue_checks:
+            report_lines.append("")
+            report_lines.append("### 逾期的證據記錄")
+            report_lines.append("")
+            report_lines.append("以下模板在上一個完整期間之後沒有新的證據記錄：")
+            report_lines.append("")
+            for category, check in overdue_checks:
+                latest = check['latest_record'] or '從未產生'
+                report_lines.append(f"- {category} / {check['template']}（{check['cadence']}，最新記錄：{latest}）")
+        
+        missing_checks = [(name, check) for name, data in sorted(scan_result['categories'].items())
+                          for check in data['cadence'] if check['missing_periods']]
+        if missing_checks:
+            report_lines.append("")
+            report_lines.append("### 缺漏期間")
+            report_lines.append("")
+            for category, check in missing_checks:
+                periods = check['missing_periods']
+                shown = '、'.join(periods[:MAX_LISTED_PERIODS])
+                if len(periods) > MAX_LISTED_PERIODS:
+                    shown += f" 等 {len(periods)} 個期間"
+                report_lines.append(f"- {category} / {check['template']}：{shown}")
+        
         report_lines.append("")
         report_lines.append("---")
         report_lines.append("")
@@ -444,6 +726,8 @@ def main():
     report_parser = subparsers.add_parser('compliance-report', 
                                          help='生成合規性報告')
     report_parser.add_argument('--output', help='報告輸出路徑')
+    report_parser.add_argument('--review-days', type=int, default=DEFAULT_REVIEW_DAYS,
+                               help=f'檢查缺漏期間的天數（預設 {DEFAULT_REVIEW_DAYS}）')
     
     # weekly-report 指令
     weekly_parser = subparsers.add_parser('weekly-report', 
@@ -514,7 +798,7 @@ def main():
     elif args.command == 'compliance-report':
         try:
             output_path = Path(args.output) if args.output else None
-            report = automation.generate_compliance_report(output_path)
+            report = automation.generate_compliance_report(output_path, review_days=args.review_days)
             
             if not output_path:
                 print(report)
@@ -0,0 +1,85 @@
+"""
+Tests for the evidence cadence checks in iso_automation
+"""
+
+from datetime import date
+
+import pytest
+
+pytest.importorskip('jinja2')
+
+from iso_automation import ISOAutomation, next_period, period_label, period_start  # noqa: E402
+
+TEMPLATE = '備份執行紀錄_Template.md'
+
+
+def make_category(tmp_path, cadence='每月', effective='2026年3月15日', records=()):
+    category = tmp_path / '備份與復原'
+    category.mkdir()
+    template = category / TEMPLATE
+    template.write_text(
+        '# 備份執行紀錄\n\n| 欄位 | 內容 |\n|------|------|\n'
+        f'| **生效日期** | {effective} |\n| **紀錄頻率** | {cadence} |\n',
+        encoding='utf-8')
+    for day in records:
+        month_dir = category / f'{day.year}' / f'{day.month:02d}'
+        month_dir.mkdir(parents=True, exist_ok=True)
+        (month_dir / f'備份執行紀錄_{day:%Y%m%d}.md').write_text('紀錄', encoding='utf-8')
+    return category, template
+
+
+def test_iso_weeks_are_labelled_across_year_end():
+    # 2026-01-01 為週四，所屬 ISO 週從 2025-12-29 開始且屬於 2026 年第 1 週
+    start = period_start(date(2026, 1, 1), 'week')
+    assert start == date(2025, 12, 29)
+    assert period_label(start, 'week') == '2026-W01'
+    assert period_label(period_start(date(2027, 1, 1), 'week'), 'week') == '2026-W53'
+    assert next_period(date(2026, 12, 28), 'week') == date(2027, 1, 4)
+
+
+def test_half_and_year_periods_roll_over():
+    assert period_start(date(2026, 8, 15), 'half') == date(2026, 7, 1)
+    assert period_label(date(2026, 7, 1), 'half') == '2026-H2'
+    assert next_period(date(2026, 7, 1), 'half') == date(2027, 1, 1)
+    assert next_period(date(2026, 1, 1), 'half') == date(2026, 7, 1)
+    assert period_start(date(2026, 11, 30), 'quarter') == date(2026, 10, 1)
+    assert next_period(date(2026, 10, 1), 'quarter') == date(2027, 1, 1)
+    assert next_period(date(2026, 1, 1), 'year') == date(2027, 1, 1)
+    assert period_label(date(2026, 1, 1), 'year') == '2026'
+
+
+def test_effective_date_mid_period_starts_at_next_full_period(tmp_path):
+    category, template = make_category(tmp_path, records=[date(2026, 4, 2), date(2026, 6, 30)])
+    result = ISOAutomation(str(tmp_path)).check_cadence(category, template, today=date(2026, 7, 10))
+
+    # 3 月只生效半個月不要求紀錄；7 月仍在進行中
+    assert result['missing_periods'] == ['2026-05']
+    assert result['records'] == 2 and result['latest_record'] == '2026-06-30'
+    assert not result['overdue']
+
+
+def test_overdue_when_previous_period_has_no_record(tmp_path):
+    category, template = make_category(tmp_path, records=[date(2026, 4, 2)])
+    automation = ISOAutomation(str(tmp_path))
+
+    result = automation.check_cadence(category, template, today=date(2026, 7, 10))
+    assert result['missing_periods'] == ['2026-05', '2026-06']
+    assert result['overdue']
+
+    # 本期已有紀錄即不逾期，即使上一期缺漏
+    month_dir = category / '2026' / '07'
+    month_dir.mkdir()
+    (month_dir / '備份執行紀錄_20260703.md').write_text('紀錄', encoding='utf-8')
+    assert not automation.check_cadence(category, template, today=date(2026, 7, 10))['overdue']
+
+
+def test_templates_without_cadence_or_effective_in_current_period_are_not_overdue(tmp_path):
+    category, template = make_category(tmp_path, cadence='依事件')
+    result = ISOAutomation(str(tmp_path)).check_cadence(category, template, today=date(2026, 7, 10))
+    assert result['missing_periods'] == [] and not result['overdue']
+
+    template.write_text(template.read_text(encoding='utf-8')
+                        .replace('依事件', '每季').replace('2026年3月15日', '2026年7月1日'), encoding='utf-8')
+    result = ISOAutomation(str(tmp_path)).check_cadence(category, template, today=date(2026, 7, 10))
+    assert result['latest_record'] is None
+    assert result['missing_periods'] == [] and not result['overdue']